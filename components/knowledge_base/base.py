@@ -1,8 +1,15 @@
 from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
 from connections.db import VectorDB
 from connections.pubsub import Publisher
+from connections.envelope import register_schema
+import numpy as np
 import uuid
 
+register_schema("kb.collection_created", {"collection": str, "vector_size": int, "distance": str})
+register_schema("kb.upserted", {"collection": str, "points": int})
+register_schema("kb.searched", {"collection": str, "limit": int}, payload="array", dtype="float32")
+register_schema("kb.neural_searched", {"collection": str, "text": str})
+
 class KnowledgeBaseFunc(VectorDB):
     def __init__(self):
         super().__init__()
@@ -17,7 +24,7 @@ class KnowledgeBaseFunc(VectorDB):
             collection_name=collection_name,
             vectors_config=VectorParams(size=vector_size, distance=distance),
             )
-            self.publisher.publish(f"Collection {collection_name} created with vector size {vector_size} and distance {distance}")
+            self.publisher.send("kb.collection_created", collection=collection_name, vector_size=vector_size, distance=str(distance))
 
     def upsert(self, collection_name: str, points: list[PointStruct], wait: bool = True) -> dict:
         operation_info = self.client.upsert(
@@ -25,14 +32,14 @@ class KnowledgeBaseFunc(VectorDB):
             wait=wait,
             points=points,
         )
-        self.publisher.publish(f"Upserted points into collection {collection_name}")
+        self.publisher.send("kb.upserted", collection=collection_name, points=len(points))
         return operation_info
 
     def search(self, collection_name: str, query: list[float], limit: int) -> list:
         search_result = self.client.query_points(
             collection_name=collection_name, query=query, limit=limit
         ).points
-        self.publisher.publish(f"Searched in collection {collection_name} with query {query} and limit {limit}")
+        self.publisher.send("kb.searched", payload=np.asarray(query), collection=collection_name, limit=limit)
         return search_result
 
     def search_with_filter(self, collection_name: str, query: list[float], filter_key: str, filter_value: str, limit: int) -> list:
@@ -45,7 +52,8 @@ class KnowledgeBaseFunc(VectorDB):
             with_payload=True,
             limit=limit,
         ).points
-        self.publisher.publish(f"Searched in collection {collection_name} with query {query}, filter {filter_key}={filter_value}, and limit {limit}")
+        self.publisher.send("kb.searched", payload=np.asarray(query), collection=collection_name, limit=limit,
+                            filter={filter_key: filter_value})
         return search_result
     
     def neural_searcher(self, collection_name: str, model=None, embeddings=None, text:str= None):
@@ -62,5 +70,5 @@ class KnowledgeBaseFunc(VectorDB):
             limit=2
         )
         payloads = [hit.payload for hit in search_result]
-        self.publisher.publish(f"Neural searcher collection {collection_name} with text '{text}'")
+        self.publisher.send("kb.neural_searched", collection=collection_name, text=text)
         return payloads
\ No newline at end of file
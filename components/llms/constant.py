@@ -4,4 +4,5 @@ class InputType(Enum):
     PROMPT = "Prompt"
     TOOLS = "Tools"
     FUNCTIONS = "Functions"
-    SHORT_MEMORY = "Short Memory"
\ No newline at end of file
+    SHORT_MEMORY = "Short Memory"
+    CONTEXT = "Context"
\ No newline at end of file
@@ -1,20 +1,21 @@
-import asyncio
-from connections.pubsub import Subsciber
+from typing import Optional
+
 from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.notifications import wait_for_key
+from synapse.settings import READY_WAIT_TIMEOUT
 
-async def handle_prompt(channel:str, key:str, version:int):
+async def handle_prompt(channel:str, key:str, version:int, memory: SharedMemoryManager, timeout: Optional[float] = READY_WAIT_TIMEOUT):
     """
     Handle user message input.
     :param channel: The channel of the input
+    :param memory: Manager to read the prompt through when it was not sent inline; any node's will do
+    :param timeout: Seconds to wait for the prompt to be announced
     """
-    listener = Subsciber(channel)
-    while True:
-        message = await listener.listen()
-        if message == "Prompt is Ready":
-            storage = SharedMemoryManager(service_id=channel)
-            prompt = storage.retrieve_text(key, version)
-            return prompt
-        asyncio.sleep(0.1)
+    event = await wait_for_key(channel, key, version, timeout)
+    prompt = event.inline_data(version)
+    if prompt is None:
+        prompt = memory.retrieve_text(key, version)
+    return prompt
     
 
 async def handle_tools(channel:str, key:str, version:int):
@@ -1,17 +1,18 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI, AzureOpenAI
 from components.constants import LLMSource
 
 load_dotenv()
 def get_llm(llm_source=None, llm_model=None):
-    
-    if llm_source is LLMSource.AZURE:
+    # Imported here so nodes given their own client do not need the openai package
+    from openai import OpenAI, AzureOpenAI
+
+    if llm_source == LLMSource.AZURE:
         return AzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_KEY"),  
     api_version="2024-02-01",
     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
     )
 
-    if llm_source is LLMSource.OPENAI:
+    if llm_source == LLMSource.OPENAI:
         return OpenAI(api_key=os.getenv("OPENAI_KEY"))
\ No newline at end of file
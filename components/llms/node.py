@@ -1,9 +1,9 @@
 import asyncio
-from typing import Dict, Any, List
+import json
+from typing import Dict, Any, List, Optional
 
 from connections.nodes.base import NodeBase
 
-from components.llms.handlers import handle_prompt, handle_functions, handle_tools
 from components.constants import LLMSource, LLMModelSource
 from components.llms.constant import InputType
 from components.llms.llm import get_llm
@@ -12,21 +12,48 @@ from components.llms.handlers import handle_prompt, handle_functions, handle_too
 from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
 
 class LLMNode(NodeBase):
-    def __init__(self, node_id:int , channel:int , llm_source:LLMSource, model:LLMModelSource):
+    def __init__(self, node_id:int , channel:int , llm_source:LLMSource, model:LLMModelSource, llm=None):
+        """
+        :param llm: Chat completions client to use instead of the one get_llm builds for llm_source
+        """
         super().__init__(node_id, channel)
-        self.llm = get_llm(llm_source, model)
+        self.llm = llm or get_llm(llm_source, model)
+        self.model = model
         self.node_id = node_id
         self.channel = channel
         self.memory = SharedMemoryManager(service_id=self.node_id, num_partitions=4, cache_capacity=100000000, cache_expire_time=3600)
-    
-    async def input(self, inputs: List[Dict[str, Any]]):
+
+    async def input(self, inputs: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        Generate once every input has been read and store the reply under the node id,
+        announced on the node's channel.
+
+        :return: Version of the stored reply, or None without a prompt
+        """
         tasks = [self.process_input(input_item) for input_item in inputs]
-        await asyncio.gather(*tasks)
+        values = {input_type: value for input_type, value in await asyncio.gather(*tasks) if value is not None}
+        if InputType.PROMPT.value not in values:
+            return None
+        reply = await self.generate(values)
+        return self.memory.store_text(str(self.node_id), reply, notify=self.channel)
+
+    async def execute(self, run, inputs) -> str:
+        values = {}
+        for name, ref in inputs.items():
+            if name == InputType.SHORT_MEMORY.value:
+                continue
+            if name not in (InputType.PROMPT.value, InputType.TOOLS.value, InputType.CONTEXT.value):
+                raise ValueError(f"Unsupported input type: {name}")
+            values[name] = await run.fetch(ref)
+        if InputType.PROMPT.value not in values:
+            raise ValueError(f"LLM node {self.node_id!r} needs a {InputType.PROMPT.value} input")
+        return await self.generate(values)
 
     async def process_input(self, input_item):
         """
-        Process a single input item.
-        :param input_item: A dictionary containing 'input_type' and 'data'.
+        Read a single input item.
+        :param input_item: A dictionary containing 'input', 'channel', 'key' and 'version'.
+        :return: The input type and its value, None for inputs that are not read yet
         """
         input_type = input_item.get('input')
         channel = input_item.get('channel')
@@ -34,37 +61,68 @@ class LLMNode(NodeBase):
         version = input_item.get('version')
 
         if input_type == InputType.PROMPT.value:
-            handle_prompt(channel, key, version)
-            
+            return input_type, await handle_prompt(channel, key, version, self.memory)
+
         elif input_type == InputType.TOOLS.value:
-            handle_tools(channel, key, version)
+            return input_type, await handle_tools(channel, key, version)
 
         elif input_type == InputType.FUNCTIONS.value:
-            handle_functions(channel, key, version)
-            
+            return input_type, await handle_functions(channel, key, version)
+
         elif input_type == InputType.SHORT_MEMORY.value:
-            ...
+            return input_type, None
         else:
             raise ValueError(f"Unsupported input type: {input_type}")
 
+    async def generate(self, values: Dict[str, Any]) -> str:
+        """
+        :param values: Input values by input type. The Prompt is a JSON list of chat messages
+                       (as a PromptNode renders) or plain text sent as one user message; a
+                       Context is added as a system message and Tools as JSON tool definitions.
+        :return: The content of the reply
+        """
+        messages = self._messages(values[InputType.PROMPT.value])
+        context = values.get(InputType.CONTEXT.value)
+        if context:
+            messages.insert(0, {"role": "system", "content": f"Context:\n{context}"})
+        kwargs = {}
+        tools = values.get(InputType.TOOLS.value)
+        if tools:
+            kwargs["tools"] = json.loads(tools) if isinstance(tools, str) else tools
+        # The clients are synchronous; keep the loop free for the rest of the graph
+        response = await asyncio.to_thread(self.llm.chat.completions.create, model=self.model,
+                                           messages=messages, **kwargs)
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _messages(prompt: str) -> List[Dict[str, str]]:
+        try:
+            messages = json.loads(prompt)
+        except (TypeError, ValueError):
+            messages = None
+        if isinstance(messages, list) and all(isinstance(message, dict) for message in messages):
+            return messages
+        return [{"role": "user", "content": prompt}]
+
     def output(self):
         ...
-        
+
     def properties(self):
         ...
 
     def handle_message(self, message):
         ...
-    
+
     def possible_inputs(self):
         """
         Define the possible inputs for the LLMNode.
-        
+
         :return: A dictionary describing the possible input types.
         """
         return {
             "Prompt": "text",
             "Tools": "various data structures or functions",
             "Functions": "callable code snippets",
-            "Short Memory":"To track previous conversation"
-        }
\ No newline at end of file
+            "Short Memory":"To track previous conversation",
+            "Context": "text added to the conversation as a system message"
+        }
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from connections.db import redis_client
+from synapse.memory_manager.access_stats import collect
+
+
+class Command(BaseCommand):
+    help = "Show per-prefix traffic and the hottest keys of every SharedMemoryManager publishing stats"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--service', help="Only show this service id")
+        parser.add_argument('--top', type=int, default=10, help="Number of hot keys to list")
+        parser.add_argument('--json', action='store_true', help="Print the raw snapshots as JSON")
+
+    def handle(self, *args, **options):
+        snapshots = collect(redis_client())
+        if options['service']:
+            snapshots = {service: stats for service, stats in snapshots.items() if service == options['service']}
+        if options['json']:
+            self.stdout.write(json.dumps(snapshots, indent=2))
+            return
+        if not snapshots:
+            self.stdout.write("No memory manager stats published")
+            return
+        for service, stats in sorted(snapshots.items()):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Service {service}"))
+            self.stdout.write(f"  {'prefix':<20}{'reads':>10}{'writes':>10}{'bytes out':>14}{'bytes in':>14}"
+                              f"{'ratio':>8}{'hit rate':>10}{'lock wait':>12}")
+            for prefix, counters in sorted(stats['prefixes'].items()):
+                ratio = '-' if counters['compression_ratio'] is None else f"{counters['compression_ratio']:.2f}"
+                hit_rate = '-' if counters['cache_hit_rate'] is None else f"{counters['cache_hit_rate']:.1%}"
+                self.stdout.write(f"  {prefix:<20}{counters['reads']:>10}{counters['writes']:>10}"
+                                  f"{counters['bytes_out']:>14}{counters['bytes_in']:>14}"
+                                  f"{ratio:>8}{hit_rate:>10}{counters['lock_wait_total']:>12.4f}")
+            self.stdout.write("  Hot keys:")
+            for entry in stats['hot_keys'][:options['top']]:
+                self.stdout.write(f"    {entry['key']}  {entry['accesses']}")
+            self.stdout.write("  Most lock wait (s):")
+            for entry in stats['contended_keys'][:options['top']]:
+                self.stdout.write(f"    {entry['key']}  {entry['lock_wait']:.4f}")
@@ -4,4 +4,9 @@ class PromptPartType(Enum):
     TEXT = "text"
     VARIABLE = "variable"
     CONDITIONAL = "conditional"
-    LOOP = "loop"
\ No newline at end of file
+    LOOP = "loop"
+
+class InputType(Enum):
+    SYSTEM = "System"
+    USER = "User"
+    CONTEXT = "Context"
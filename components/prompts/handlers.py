@@ -1,7 +1,8 @@
-import asyncio
-from connections.pubsub import Subscriber
-from components.prompts.constant import PromptPartType
+from typing import Optional
+
 from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.notifications import wait_for_key
+from synapse.settings import READY_WAIT_TIMEOUT
 
 async def handle_system_prompt(system_prompt:str):
     return system_prompt
@@ -9,12 +10,24 @@ async def handle_system_prompt(system_prompt:str):
 async def handle_user_prompt(user_prompt:str):
     return user_prompt
 
-async def handle_context_prompt(channel:str, key:str, version:int):
-    listerner = Subscriber(channel)
-    while True:
-        message = await listerner.listen()
-        if message == "Context is Ready":
-            storage = SharedMemoryManager(service_id=channel)
-            context = storage.retrieve_text(key, version)
-            return context
-        await asyncio.sleep(0.1)
\ No newline at end of file
+async def read_announced_text(channel:str, key:str, version:int, memory: SharedMemoryManager,
+                              timeout: Optional[float] = READY_WAIT_TIMEOUT):
+    """
+    Wait for version of key to be announced on channel and return its text.
+
+    :param memory: Manager to read the text through when it was not sent inline; any node's will do
+    :param timeout: Seconds to wait for the announcement
+    """
+    event = await wait_for_key(channel, key, version, timeout)
+    text = event.inline_data(version)
+    if text is None:
+        text = memory.retrieve_text(key, version)
+    return text
+
+async def handle_context_prompt(channel:str, key:str, version:int, memory: SharedMemoryManager,
+                                timeout: Optional[float] = READY_WAIT_TIMEOUT):
+    """
+    :param memory: Manager to read the context through when it was not sent inline; any node's will do
+    :param timeout: Seconds to wait for the context to be announced
+    """
+    return await read_announced_text(channel, key, version, memory, timeout)
@@ -1,47 +1,87 @@
 import asyncio
-from typing import Dict, Any, List
+import json
+from typing import Dict, Any, List, Optional
 
-from components.prompts.constant import PromptPartType
 from connections.nodes.base import NodeBase
-from connections.pubsub import Publisher
 from components.prompts.constant import InputType
-from components.prompts.handlers import handle_context_prompt, handle_system_prompt, handle_user_prompt
+from components.prompts.handlers import handle_system_prompt, handle_user_prompt, read_announced_text
 from components.prompts.processor import processor
 from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
 
+INPUT_TYPES = {input_type.value for input_type in InputType}
+
 class PromptNode(NodeBase):
-    def __init__(self, node_id:int, channel:int):
+    def __init__(self, node_id:int, channel:int, system_prompt:str = "", user_prompt:str = ""):
+        """
+        Renders a system and a user template into chat messages, stored as their JSON.
+
+        :param system_prompt: System template used when no System input is given
+        :param user_prompt: User template used when no User input is given
+        """
         super().__init__(node_id, channel)
         self.node_id = node_id
         self.channel = channel
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
         self.memory = SharedMemoryManager(service_id=self.node_id, cache_capacity=100000000, cache_expire_time=3600)
 
-    async def input(self, inputs:List[Dict[str, Any]]):
-        tasks = [self.process_input(input_item) for input_item in inputs]
-        await asyncio.gather(*tasks)
-    
-    async def process_input(self, input_item:Dict[str, Any], system_prompt:str= None, user_prompt:str= None):
+    async def input(self, inputs:List[Dict[str, Any]]) -> int:
+        """
+        Render once every input has been read and store the messages under the node id,
+        announced on the node's channel.
+
+        :return: Version of the stored messages
+        """
+        values = await asyncio.gather(*(self.process_input(input_item) for input_item in inputs))
+        rendered_prompt = await self.render(dict(values))
+        return self.memory.store_text(str(self.node_id), rendered_prompt, notify=self.channel)
+
+    async def execute(self, run, inputs) -> str:
+        values = {}
+        for name, ref in inputs.items():
+            if name not in INPUT_TYPES:
+                raise ValueError(f"Unsupported input type: {name}")
+            values[name] = await run.fetch(ref)
+        return await self.render(values)
+
+    async def process_input(self, input_item:Dict[str, Any]):
         """
-        Process a single input item.
-        :param input_item: A dictionary containing 'input_type' and 'data'.
+        Read a single input item.
+        :param input_item: A dictionary containing 'input', 'channel', 'key' and 'version'.
+        :return: The input type and its text
         """
         input_type = input_item.get('input')
         channel = input_item.get('channel')
         key = input_item.get('key')
         version = input_item.get('version')
 
+        if input_type not in INPUT_TYPES:
+            raise ValueError(f"Unsupported input type: {input_type}")
+        text = await read_announced_text(channel, key, version, self.memory)
+
         if input_type == InputType.SYSTEM.value:
-            system_prompt=handle_system_prompt(system_prompt)
-        
+            text = await handle_system_prompt(text)
         elif input_type == InputType.USER.value:
-            user_prompt=handle_user_prompt(user_prompt)
-
-        elif input_type == InputType.CONTEXT.value:
-            context=handle_context_prompt(channel,key,version)
+            text = await handle_user_prompt(text)
+        return input_type, text
 
-        else:
-            raise ValueError(f"Unsupported input type: {input_type}")
-        
+    async def render(self, values:Dict[str, str]) -> str:
+        """
+        :param values: Input texts by input type. A Context that is a JSON object supplies the
+                       template variables; any other Context is bound to {context}.
+        """
+        system_prompt = values.get(InputType.SYSTEM.value, self.system_prompt)
+        user_prompt = values.get(InputType.USER.value, self.user_prompt)
+        context: Dict[str, Any] = {}
+        if InputType.CONTEXT.value in values:
+            context = self._context(values[InputType.CONTEXT.value])
         rendered_prompt = await processor(system_prompt, user_prompt, context)
-        self.memory.store_text(key, rendered_prompt)
-        Publisher(channel).publish("Prompt is Ready")
\ No newline at end of file
+        return json.dumps(rendered_prompt)
+
+    @staticmethod
+    def _context(text: Optional[str]) -> Dict[str, Any]:
+        try:
+            context = json.loads(text)
+        except (TypeError, ValueError):
+            context = None
+        return context if isinstance(context, dict) else {"context": text}
@@ -135,7 +135,7 @@ def parse_instance(template: str, role: str) -> PromptInstance:
                 i += 1
             parts.append(LoopPromptPart(loop_var, iterable, parse_instance("".join(loop_content), role).parts))
         else:
-            current_text.append(token)
+            current_text.append(tokens[i])
         i += 1
 
     add_text_part()
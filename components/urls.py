@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import GetLLMView, ChatCompletionsView, PromptTemplateView, KnowledgeBaseView
+from .views import GetLLMView, ChatCompletionsView, PromptTemplateView, KnowledgeBaseView, MemoryStatsView
 
 urlpatterns = [
     path('get-llm/', GetLLMView.as_view(), name='get-llm'),
     path('chat-completions/', ChatCompletionsView.as_view(), name='chat-completions'),
     path('prompt-template/', PromptTemplateView.as_view(), name='prompt-template'),
     path('knowledge-base/', KnowledgeBaseView.as_view(), name='knowledge_base'),
+    path('memory-stats/', MemoryStatsView.as_view(), name='memory-stats'),
 ]
\ No newline at end of file
@@ -8,7 +8,8 @@ from .llms.chat_helper import ChatCompletions
 from .prompts.prompt_template import create_prompt_template
 from .serializers import ChatCompletionSerializer, PromptTemplateSerializer
 from qdrant_client.http.exceptions import ResponseHandlingException
-from connections.db import VectorDB
+from connections.db import VectorDB, redis_client
+from synapse.memory_manager.access_stats import collect
 
 import logging
 
@@ -114,4 +115,15 @@ class KnowledgeBaseView(APIView):
             return Response(search_result, status=status.HTTP_200_OK)
         except ResponseHandlingException as e:
             logging.error(f"Error searching collection with filter: {e}")
-            return Response({"error": "Failed to connect to Qdrant server"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": "Failed to connect to Qdrant server"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MemoryStatsView(APIView):
+    def get(self, request, format=None):
+        service = request.query_params.get('service')
+        snapshots = collect(redis_client())
+        if service:
+            if service not in snapshots:
+                return Response({"error": f"No stats for service {service}"}, status=status.HTTP_404_NOT_FOUND)
+            snapshots = {service: snapshots[service]}
+        return Response(snapshots, status=status.HTTP_200_OK)
@@ -1,10 +1,17 @@
-from synapse.settings import DATABASES
+from synapse.settings import DATABASES, MEMCACHED_SERVERS, MEMCACHED_POOL_SIZE, MEMCACHED_HEALTH_CHECK_INTERVAL
+from synapse.settings import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT
 import psycopg2
 from qdrant_client import QdrantClient
 from qdrant_client.http.exceptions import ApiException
 import sqlite3
 import redis
+import redis.asyncio
 import pylibmc
+import logging
+import os
+import socket
+import threading
+import time
  
 def connect_and_query(query):
     try:
@@ -44,20 +51,207 @@ def setup_url_cache_database(db_file):
         ''')
         return conn, cursor
 
-def redis_client():
-    client = redis.Redis(host='localhost',port= 6379, db= 0)
+_redis_pools: dict[tuple, redis.ConnectionPool] = {}
+_redis_lock = threading.Lock()
+
+
+def redis_pool(url: str = None, db: int = None) -> redis.ConnectionPool:
+    """
+    The process-wide connection pool for url (default REDIS_URL) and db. Pools block for up
+    to REDIS_POOL_TIMEOUT seconds when all REDIS_MAX_CONNECTIONS connections are busy
+    instead of opening more.
+    """
+    key = (url or REDIS_URL, db)
+    with _redis_lock:
+        if key not in _redis_pools:
+            pool = redis.BlockingConnectionPool.from_url(key[0], max_connections=REDIS_MAX_CONNECTIONS,
+                                                         timeout=REDIS_POOL_TIMEOUT)
+            if db is not None:
+                pool.connection_kwargs["db"] = db
+            _redis_pools[key] = pool
+        return _redis_pools[key]
+
+
+def redis_client(url: str = None, db: int = None) -> redis.Redis:
+    """
+    A client on the shared pool for url and db; clients are cheap, connections are reused.
+    """
+    return redis.Redis(connection_pool=redis_pool(url, db))
+
+
+def async_redis_client(url: str = None, db: int = None) -> redis.asyncio.Redis:
+    """
+    A redis.asyncio client with its own pool. asyncio connections belong to the loop that
+    opened them, so keep one client per event loop rather than one per call.
+    """
+    client = redis.asyncio.Redis.from_url(url or REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+    if db is not None:
+        client.connection_pool.connection_kwargs["db"] = db
     return client
 
-def memcached_client(self, servers: list[str] = ["127.0.0.1"]):
-        try:
-            self.memcached_client = pylibmc.Client(servers, binary=True, behaviors={
-                "tcp_nodelay": True,
-                "ketama": True,
-                "remove_failed": 1,
-                "retry_timeout": 1,
-                "dead_timeout": 60
-            })
-            print("Memcached client connection established")
-        except pylibmc.Error as e:
-            print(f"Failed to connect to Memcached: {e}")
-            self.memcached_client = None
\ No newline at end of file
+
+class RedisBatch:
+    def __init__(self, client: redis.Redis = None, transaction: bool = False, max_size: int = 1000):
+        """
+        Queue Redis commands and send them in as few round trips as possible. Any client
+        command can be called on the batch; it is queued on a pipeline that is sent every
+        max_size commands and when the batch is flushed or its with-block exits.
+
+            with RedisBatch() as batch:
+                for key in keys:
+                    batch.incr(key)
+            batch.results  # one reply per command, in order
+
+        :param transaction: Wrap each round trip in MULTI/EXEC
+        :param max_size: Commands per round trip, bounding the size of a single request
+        """
+        self.client = client or redis_client()
+        self.max_size = max_size
+        self.results = []
+        self._pipeline = self.client.pipeline(transaction=transaction)
+
+    def __getattr__(self, name):
+        command = getattr(self._pipeline, name)
+
+        def queue(*args, **kwargs):
+            command(*args, **kwargs)
+            if len(self._pipeline) >= self.max_size:
+                self.flush()
+            return self
+        return queue
+
+    def __len__(self) -> int:
+        return len(self._pipeline)
+
+    def flush(self) -> list:
+        """
+        Send the queued commands.
+
+        :return: Their replies, also appended to results
+        """
+        if not len(self._pipeline):
+            return []
+        replies = self._pipeline.execute()
+        self.results.extend(replies)
+        return replies
+
+    def __enter__(self) -> "RedisBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._pipeline.reset()
+
+class PooledMemcachedClient:
+    def __init__(self, servers: list[str], pool_size: int = MEMCACHED_POOL_SIZE,
+                 health_check_interval: float = MEMCACHED_HEALTH_CHECK_INTERVAL):
+        """
+        Memcached client shared by all threads of the process. Each thread borrows its own
+        pylibmc client from a pool, keys are sharded over the servers with ketama consistent
+        hashing, and a background health check drops unreachable servers from the ring (and
+        adds them back once they answer), so only the failed server's keys move.
+
+        :param servers: "host:port" addresses (port defaults to 11211)
+        :param pool_size: Clients kept for reuse across threads
+        :param health_check_interval: Seconds between server probes; 0 disables them
+        """
+        self.servers = list(servers)
+        self.pool_size = pool_size
+        self.healthy = list(self.servers)
+        self._lock = threading.Lock()
+        self._pool = self._build_pool(self.healthy)
+        if health_check_interval:
+            threading.Thread(target=self._health_check_loop, args=(health_check_interval,),
+                             name="memcached-health", daemon=True).start()
+
+    def get(self, key):
+        with self._reserve() as client:
+            return client.get(key)
+
+    def set(self, key, value, time: int = 0):
+        with self._reserve() as client:
+            return client.set(key, value, time=time)
+
+    def delete(self, key):
+        with self._reserve() as client:
+            return client.delete(key)
+
+    def get_multi(self, keys):
+        with self._reserve() as client:
+            return client.get_multi(keys)
+
+    def set_multi(self, mapping, time: int = 0):
+        with self._reserve() as client:
+            return client.set_multi(mapping, time=time)
+
+    def delete_multi(self, keys):
+        with self._reserve() as client:
+            return client.delete_multi(keys)
+
+    def check_health(self) -> list[str]:
+        """
+        Probe every server and rebuild the ring if the set of healthy servers changed.
+
+        :return: The healthy servers
+        """
+        healthy = [server for server in self.servers if _memcached_alive(server)]
+        # With every server down keep the full ring; calls fail fast and callers fall back
+        healthy = healthy or list(self.servers)
+        with self._lock:
+            if healthy != self.healthy:
+                logging.warning(f"Memcached servers changed: {self.healthy} -> {healthy}")
+                self.healthy = healthy
+                self._pool = self._build_pool(healthy)
+        return healthy
+
+    def _reserve(self):
+        with self._lock:
+            pool = self._pool
+        return pool.reserve(block=True)
+
+    def _build_pool(self, servers: list[str]):
+        master = pylibmc.Client(servers, binary=True, behaviors={
+            "tcp_nodelay": True,
+            "ketama": True,
+            "remove_failed": 1,
+            "retry_timeout": 1,
+            "dead_timeout": 60
+        })
+        pool = pylibmc.ClientPool()
+        pool.fill(master, self.pool_size)
+        return pool
+
+    def _health_check_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.check_health()
+
+
+def _memcached_alive(server: str, timeout: float = 0.5) -> bool:
+    if server.startswith("/"):
+        return os.path.exists(server)
+    host, _, port = server.rpartition(":") if ":" in server else (server, "", "11211")
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as connection:
+            connection.sendall(b"version\r\n")
+            return connection.recv(64).startswith(b"VERSION")
+    except OSError:
+        return False
+
+
+_memcached_clients: dict[tuple, PooledMemcachedClient] = {}
+_memcached_lock = threading.Lock()
+
+
+def memcached_client(servers: list[str] = None) -> PooledMemcachedClient:
+    """
+    The process-wide pooled client for servers (default MEMCACHED_SERVERS); every caller
+    asking for the same servers shares one client and its connections.
+    """
+    key = tuple(servers or MEMCACHED_SERVERS)
+    with _memcached_lock:
+        if key not in _memcached_clients:
+            _memcached_clients[key] = PooledMemcachedClient(list(key))
+        return _memcached_clients[key]
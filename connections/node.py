@@ -6,12 +6,27 @@ from connections.pubsub import Subscriber
 class NodeRegistry:
     def __init__(self):
         self.nodes = {}
+        self.tasks = {}
         self.client = redis_client()
-    
+
     def register_node(self, node_id, channel, callback):
+        """
+        Subscribe callback to channel for node_id; must be called from a running event loop.
+
+        :param callback: Coroutine function called with each message: an Envelope when the
+                         sender used Publisher.send, else the published bytes
+        """
         if node_id not in self.nodes:
             self.nodes[node_id] = []
-        
+            self.tasks[node_id] = []
+
         subscriber = Subscriber(channel, callback)
         self.nodes[node_id].append(subscriber)
-        asyncio.create_task(subscriber.listen())
\ No newline at end of file
+        # Held so the listener is not garbage collected while it runs
+        self.tasks[node_id].append(asyncio.create_task(subscriber.listen()))
+
+    async def unregister_node(self, node_id):
+        for task in self.tasks.pop(node_id, []):
+            task.cancel()
+        for subscriber in self.nodes.pop(node_id, []):
+            await subscriber.close()
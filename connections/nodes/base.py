@@ -0,0 +1,28 @@
+import abc
+from typing import TYPE_CHECKING, Any, Dict, List
+
+if TYPE_CHECKING:
+    from connections.nodes.graph import DataRef, GraphRun
+
+
+class NodeBase(abc.ABC):
+    def __init__(self, node_id, channel):
+        self.node_id = node_id
+        self.channel = channel
+
+    @abc.abstractmethod
+    async def input(self, inputs: List[Dict[str, Any]]):
+        """
+        Process inputs given as {"input": type, "channel", "key", "version"} items: values
+        other services stored and announced on channel.
+        """
+
+    @abc.abstractmethod
+    async def execute(self, run: "GraphRun", inputs: Dict[str, "DataRef"]) -> Any:
+        """
+        Run the node once inside a graph. Upstream outputs arrive as references into
+        run.memory under the names of the incoming edges; read them with run.fetch.
+
+        :return: Text or an array for the executor to store, a DataRef to data the node stored
+                 itself, or None
+        """
@@ -1,27 +1,39 @@
-from typing import Dict, Any
+import importlib
+from typing import Dict, Any, Type, Union
 from connections.nodes.base import NodeBase
-from components.llms.node import LLMNode
 
 class NodeFactory:
-    @staticmethod
-    def create_node(node_type:str, config:Dict[str, Any]) -> NodeBase:
+    # Node classes by type, as import paths until first use so configs that never use a
+    # node type do not import its dependencies
+    node_types: Dict[str, Union[str, Type[NodeBase]]] = {
+        "LLM": "components.llms.node.LLMNode",
+        "Prompt": "components.prompts.node.PromptNode",
+    }
+
+    @classmethod
+    def register(cls, node_type: str, node_class: Union[str, Type[NodeBase]]):
+        """
+        :param node_class: The class or its dotted import path
+        """
+        cls.node_types[node_type] = node_class
+
+    @classmethod
+    def node_class(cls, node_type: str) -> Type[NodeBase]:
+        """
+        :raises ValueError: if node_type is not registered
+        """
+        if node_type not in cls.node_types:
+            raise ValueError(f"Unknown node type: {node_type}")
+        node_class = cls.node_types[node_type]
+        if isinstance(node_class, str):
+            module, _, name = node_class.rpartition(".")
+            node_class = cls.node_types[node_type] = getattr(importlib.import_module(module), name)
+        return node_class
+
+    @classmethod
+    def create_node(cls, node_type:str, config:Dict[str, Any]) -> NodeBase:
         """define all the nodes here and call using config file"""
-        # if node_type == "LLM":
-        #     return LLMNode(
-        #         node_id=config['node_id'],
-        #         channel=config['channel'],
-        #         llm_source=config['llm_source'],
-        #         model=config['model']
-        #     )
-        # elif node_type == "KnowledgeBase":
-        #     return KnowledgeBaseNode(
-        #         node_id=config['node_id'],
-        #         channel=config['channel']
-        #     )
-        # # Add other node types as needed
-        # else:
-        #     raise ValueError(f"Unknown node type: {node_type}")
-        ...
+        return cls.node_class(node_type)(**config)
 
 # Usage
 # config = {
@@ -31,9 +43,3 @@ class NodeFactory:
 #     "model": "gpt-3.5-turbo"
 # }
 # llm_node = NodeFactory.create_node("LLM", config)
-
-# kb_config = {
-#     "node_id": "kb_1",
-#     "channel": "kb_channel"
-# }
-# kb_node = NodeFactory.create_node("KnowledgeBase", kb_config)
\ No newline at end of file
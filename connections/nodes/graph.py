@@ -0,0 +1,219 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from connections.nodes.base import NodeBase
+from connections.nodes.factory import NodeFactory
+from synapse.memory_manager.async_shared_memory_manager import AsyncSharedMemoryManager
+from synapse.memory_manager.torch_compat import is_tensor
+
+
+class GraphError(ValueError):
+    pass
+
+
+class DataRef:
+    def __init__(self, key: str, version: int, kind: str):
+        """
+        Where a value lives in shared memory: nodes hand each other these instead of the values.
+
+        :param kind: "text" or "vector"
+        """
+        self.key = key
+        self.version = version
+        self.kind = kind
+
+    def __repr__(self):
+        return f"DataRef({self.key!r}, {self.version}, {self.kind!r})"
+
+
+class GraphNode:
+    def __init__(self, node_id: str, node_type: str, config: Dict[str, Any], inputs: Dict[str, str]):
+        """
+        :param inputs: Input name -> upstream node id or graph input name
+        """
+        self.id = node_id
+        self.type = node_type
+        self.config = config
+        self.inputs = inputs
+
+
+class NodeGraph:
+    def __init__(self, name: str, nodes: List[GraphNode], inputs: Optional[List[str]] = None):
+        """
+        A validated DAG of nodes. Build with from_config / load (node types other than LLM and
+        Prompt are registered with NodeFactory.register):
+
+            {"name": "answer",
+             "inputs": ["question"],
+             "nodes": [
+                 {"id": "prompt", "type": "Prompt", "inputs": {"User": "question"}},
+                 {"id": "kb", "type": "KnowledgeBase", "inputs": {"query": "prompt"}},
+                 {"id": "llm", "type": "LLM", "config": {...}, "inputs": {"Prompt": "prompt", "Context": "kb"}},
+                 {"id": "parser", "type": "OutputParser", "inputs": {"text": "llm"}}]}
+
+        :param inputs: Names of values supplied to each run and usable as node inputs
+        :raises GraphError: on duplicate ids, unknown references or cycles
+        """
+        self.name = name
+        self.inputs = list(inputs or [])
+        self.nodes: Dict[str, GraphNode] = {}
+        for node in nodes:
+            if node.id in self.nodes or node.id in self.inputs:
+                raise GraphError(f"Duplicate node id: {node.id}")
+            self.nodes[node.id] = node
+        for node in nodes:
+            for name, source in node.inputs.items():
+                if source not in self.nodes and source not in self.inputs:
+                    raise GraphError(f"Input {name!r} of node {node.id!r} refers to unknown node {source!r}")
+        self.order = self._topological_order()
+        consumed = {source for node in nodes for source in node.inputs.values()}
+        self.outputs = [node_id for node_id in self.order if node_id not in consumed]
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "NodeGraph":
+        try:
+            nodes = [GraphNode(str(node["id"]), node["type"], dict(node.get("config", {})), dict(node.get("inputs", {})))
+                     for node in config["nodes"]]
+        except (KeyError, TypeError) as error:
+            raise GraphError(f"Malformed graph config: {error}") from error
+        for node in nodes:
+            # Fail on unknown types now rather than when the graph is instantiated
+            try:
+                NodeFactory.node_class(node.type)
+            except ValueError as error:
+                raise GraphError(f"Node {node.id!r}: {error}") from error
+        return cls(config.get("name", "graph"), nodes, config.get("inputs"))
+
+    @classmethod
+    def load(cls, path: str) -> "NodeGraph":
+        with open(path) as file:
+            return cls.from_config(json.load(file))
+
+    def _topological_order(self) -> List[str]:
+        # Kahn's algorithm; whatever is left with unmet dependencies is on a cycle
+        pending = {node_id: {source for source in node.inputs.values() if source in self.nodes}
+                   for node_id, node in self.nodes.items()}
+        order = []
+        ready = [node_id for node_id, sources in pending.items() if not sources]
+        while ready:
+            node_id = ready.pop()
+            order.append(node_id)
+            del pending[node_id]
+            for other, sources in pending.items():
+                if node_id in sources:
+                    sources.discard(node_id)
+                    if not sources:
+                        ready.append(other)
+        if pending:
+            raise GraphError(f"Graph {self.name!r} has a cycle through: {', '.join(sorted(pending))}")
+        return order
+
+
+class GraphRun:
+    def __init__(self, executor: "GraphExecutor", run_id: str):
+        """
+        State of one execution: the references produced so far and the keys to clean up.
+        """
+        self.executor = executor
+        self.memory = executor.memory
+        self.run_id = run_id
+        self.refs: Dict[str, DataRef] = {}
+
+    def key(self, name: str) -> str:
+        return f"{self.executor.graph.name}:{self.run_id}:{name}"
+
+    async def store(self, name: str, value) -> DataRef:
+        """
+        Store a text or array under this run and return its reference.
+        """
+        key = self.key(name)
+        if isinstance(value, str):
+            version = await self.memory.store_text(key, value)
+            ref = DataRef(key, version, "text")
+        elif isinstance(value, np.ndarray) or is_tensor(value):
+            version = await self.memory.store_vector(key, value)
+            ref = DataRef(key, version, "vector")
+        else:
+            raise GraphError(f"{name!r} produced {type(value).__name__}; nodes must return text, an array or a DataRef")
+        self.refs[name] = ref
+        return ref
+
+    async def fetch(self, ref: DataRef):
+        if ref.kind == "text":
+            return await self.memory.retrieve_text(ref.key)
+        return await self.memory.retrieve_vector(ref.key)
+
+
+class GraphExecutor:
+    def __init__(self, graph: NodeGraph, memory: Optional[AsyncSharedMemoryManager] = None,
+                 max_concurrency: Optional[int] = None, keep_outputs: bool = False):
+        """
+        Runs a NodeGraph. Nodes are created once and reused by every run; within a run each
+        node starts as soon as all of its inputs are ready, so independent branches run
+        concurrently. Values pass between nodes as DataRefs into one shared memory manager.
+
+        :param memory: Where run values are stored; by default a manager owned by the executor
+        :param max_concurrency: Most node executions in flight across all runs
+        :param keep_outputs: Keep every value of a run in memory after it finishes instead of
+                             deleting them once the outputs are read
+        """
+        self.graph = graph
+        self.memory = memory or AsyncSharedMemoryManager(service_id=f"graph:{graph.name}", cache_capacity=100000000,
+                                                         cache_expire_time=3600)
+        self.keep_outputs = keep_outputs
+        self.nodes: Dict[str, NodeBase] = {
+            node_id: NodeFactory.create_node(node.type, {"node_id": node_id, "channel": node_id, **node.config})
+            for node_id, node in graph.nodes.items()
+        }
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def run(self, **inputs) -> Dict[str, Any]:
+        """
+        :param inputs: Values of the graph's inputs (text or arrays)
+        :return: Values of the graph's output nodes (those no other node consumes); outputs
+                 that returned None are left out
+        :raises GraphError: if an input is missing or a node returns an unsupported value
+        """
+        missing = set(self.graph.inputs) - set(inputs)
+        if missing:
+            raise GraphError(f"Missing graph inputs: {', '.join(sorted(missing))}")
+        run = GraphRun(self, uuid.uuid4().hex)
+        try:
+            for name in self.graph.inputs:
+                await run.store(name, inputs[name])
+            tasks: Dict[str, asyncio.Task] = {}
+            for node_id in self.graph.order:
+                upstream = [tasks[source] for source in self.graph.nodes[node_id].inputs.values() if source in tasks]
+                tasks[node_id] = asyncio.ensure_future(self._execute(run, node_id, upstream))
+            try:
+                await asyncio.gather(*tasks.values())
+            except BaseException:
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+                raise
+            return {node_id: await run.fetch(run.refs[node_id])
+                    for node_id in self.graph.outputs if node_id in run.refs}
+        finally:
+            if not self.keep_outputs:
+                await asyncio.gather(*(self.memory.delete(ref.key) for ref in run.refs.values()
+                                       if ref.key.startswith(run.key(""))))
+
+    async def _execute(self, run: GraphRun, node_id: str, upstream: List[asyncio.Task]):
+        await asyncio.gather(*upstream)
+        node = self.graph.nodes[node_id]
+        # Inputs whose node returned None are not passed on
+        refs = {name: run.refs[source] for name, source in node.inputs.items() if source in run.refs}
+        if self._slots is None:
+            result = await self.nodes[node_id].execute(run, refs)
+        else:
+            async with self._slots:
+                result = await self.nodes[node_id].execute(run, refs)
+        if isinstance(result, DataRef):
+            run.refs[node_id] = result
+        elif result is not None:
+            await run.store(node_id, result)
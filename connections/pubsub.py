@@ -1,31 +1,347 @@
+import asyncio
+import weakref
+from typing import Dict, List, Optional, Set, Union
+
+import numpy as np
+import redis
+
+from connections.envelope import Envelope, decode_message
+from connections.db import redis_client, async_redis_client, RedisBatch
+from connections.streams import StreamPublisher, StreamConsumer, StreamMessage, is_durable
+
+CONNECTION_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError)
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+
+class SlowConsumerError(redis.exceptions.ConnectionError):
+    pass
 
-from connections.db import redis_client
 
 class Publisher:
-    def __init__(self, channel):
+    def __init__(self, channel, service_id: Optional[str] = None, durable: Optional[bool] = None):
+        """
+        :param service_id: Sender recorded with each message on durable channels
+        :param durable: Append to the channel's Redis stream instead of PUBLISH, so consumers
+                        that are down or slow still get every message (defaults to whether
+                        the channel is listed in DURABLE_CHANNELS)
+        """
         self.channel = channel
+        self.service_id = service_id
         self.client = redis_client()
         self.subscribers = []
+        self.stream = StreamPublisher(channel, self.client) if (is_durable(channel) if durable is None else durable) else None
 
     def publish(self, message):
+        if self.stream is not None:
+            self.stream.publish(message, self.service_id)
+            return
         self.client.publish(self.channel, message)
 
+    def publish_many(self, messages):
+        """
+        Publish several messages in one round trip.
+        """
+        if self.stream is not None:
+            self.stream.publish_many(messages, self.service_id)
+            return
+        with RedisBatch(self.client) as batch:
+            for message in messages:
+                batch.publish(self.channel, message)
+
+    def send(self, message_type: str, key: Optional[str] = None, version: Optional[int] = None,
+             payload: Union[np.ndarray, bytes, None] = None, trace_id: Optional[str] = None, **fields) -> Envelope:
+        """
+        Publish a typed Envelope, checked against the schema registered for message_type.
+
+        :param payload: Array or raw bytes sent after the header without any text encoding
+        :param fields: Header fields of the schema
+        """
+        envelope = Envelope(message_type, key=key, version=version, fields=fields, payload=payload,
+                            trace_id=trace_id, source=self.service_id)
+        self.publish(envelope.encode())
+        return envelope
+
+    async def publish_async(self, message) -> Optional[int]:
+        """
+        Publish from a coroutine without blocking the event loop.
+
+        :return: Number of subscribers that received the message (None on durable channels)
+        """
+        transport = AsyncPubSubTransport.instance()
+        if self.stream is not None:
+            await self.stream.publish_async(transport.client, message, self.service_id)
+            return None
+        return await transport.publish(self.channel, message)
+
+
+class Subscription:
+    def __init__(self, transport: "AsyncPubSubTransport", channel: str, maxsize: int, overflow: str):
+        """
+        One consumer's bounded queue of messages from a channel. Delivery never waits on the
+        consumer, so a slow one cannot hold up the shared reader or other subscriptions.
+
+        :param overflow: What a full queue does: "drop_oldest" discards the oldest queued
+                         message and counts it in dropped, "disconnect" ends the subscription:
+                         get() returns what is queued, then raises SlowConsumerError
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.transport = transport
+        self.channel = channel
+        self.overflow = overflow
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.disconnected = False
+
+    async def get(self) -> bytes:
+        """
+        :raises SlowConsumerError: once a disconnected subscription's queue is drained
+        """
+        if self.disconnected and self.queue.empty():
+            raise SlowConsumerError(f"Subscription to {self.channel} fell {self.queue.maxsize} messages behind")
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        return await self.get()
+
+    async def close(self):
+        await self.transport.unsubscribe(self)
+
+    def _deliver(self, data: bytes) -> bool:
+        """
+        :return: False if the subscription was disconnected for falling behind
+        """
+        if self.queue.full():
+            if self.overflow == "disconnect":
+                self.disconnected = True
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+        return True
+
+
+class AsyncPubSubTransport:
+    _instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncPubSubTransport]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, client: Optional[redis.asyncio.Redis] = None, queue_size: int = 1000,
+                 reconnect_delay: float = 0.1, max_reconnect_delay: float = 5.0):
+        """
+        asyncio pub/sub over a single Redis connection: every channel subscribed in the
+        process shares one PubSub, and one reader task dispatches each message to the
+        bounded queues of that channel's subscriptions.
+
+        If the connection drops, the reader reconnects with exponential backoff and
+        resubscribes every channel; messages published while disconnected are lost, as
+        with any Redis pub/sub.
+
+        :param queue_size: Default bound of each subscription's queue
+        :param reconnect_delay: First delay before reconnecting, doubled up to max_reconnect_delay
+        """
+        self.client = client or async_redis_client()
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.subscriptions: Dict[str, Set[Subscription]] = {}
+        self.reconnects = 0
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connecting = asyncio.Lock()
+
+    @classmethod
+    def instance(cls) -> "AsyncPubSubTransport":
+        """
+        The transport of the running event loop, created on first use.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in cls._instances:
+            cls._instances[loop] = cls()
+        return cls._instances[loop]
+
+    async def subscribe(self, channel: str, maxsize: Optional[int] = None, overflow: str = "drop_oldest") -> Subscription:
+        """
+        Returns once Redis has the channel subscribed, so every message published afterwards
+        is delivered.
+
+        :param overflow: What the subscription does when its queue is full (see Subscription)
+        :raises redis.exceptions.ConnectionError: if Redis could not be reached; nothing is subscribed
+        """
+        subscription = Subscription(self, channel, self.queue_size if maxsize is None else maxsize, overflow)
+        new_channel = channel not in self.subscriptions
+        self.subscriptions.setdefault(channel, set()).add(subscription)
+        try:
+            async with self._connecting:
+                if self._pubsub is None:
+                    await self._connect()
+                elif new_channel:
+                    await self._pubsub.subscribe(channel)
+        except CONNECTION_ERRORS:
+            await self._drop_connection()
+            await self.unsubscribe(subscription)
+            raise
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_loop())
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        subscriptions = self.subscriptions.get(subscription.channel)
+        if not subscriptions or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if subscriptions:
+            return
+        del self.subscriptions[subscription.channel]
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(subscription.channel)
+            except CONNECTION_ERRORS:
+                await self._drop_connection()
+
+    async def publish(self, channel: str, message) -> int:
+        return await self.client.publish(channel, message)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        self.subscriptions.clear()
+        await self._drop_connection()
+
+    async def _read_loop(self):
+        delay = self.reconnect_delay
+        # Runs while anything is subscribed; subscribe() starts a new reader after that
+        while self.subscriptions:
+            try:
+                if self._pubsub is None:
+                    async with self._connecting:
+                        if self._pubsub is None:
+                            await self._connect()
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except CONNECTION_ERRORS:
+                await self._drop_connection()
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            delay = self.reconnect_delay
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode("utf-8")
+            for subscription in list(self.subscriptions.get(channel, ())):
+                if not subscription._deliver(message["data"]):
+                    await self.unsubscribe(subscription)
+
+    async def _connect(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(*self.subscriptions)
+        self._pubsub = pubsub
+
+    async def _drop_connection(self):
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+            except CONNECTION_ERRORS:
+                pass
+
+
 class Subscriber:
-    def __init__(self, channel):
+    def __init__(self, channel, callback=None, maxsize: Optional[int] = None, overflow: str = "drop_oldest",
+                 group: Optional[str] = None, durable: Optional[bool] = None):
+        """
+        A subscription to channel on the process-wide AsyncPubSubTransport, opened on first use.
+        On durable channels it is instead a member of a consumer group on the channel's stream.
+
+        :param callback: Coroutine function called by listen() with each message, as get() returns it
+        :param group: Consumer group on durable channels (default: the channel name, so all
+                      subscribers share the messages between them)
+        :param durable: Read from the channel's stream (defaults to whether the channel is listed
+                        in DURABLE_CHANNELS)
+        """
         self.channel = channel
-        self.client = redis_client()
-        self.pubsub = self.client.pubsub()
-        self.pubsub.subscribe(self.channel)
-    
+        self.handler = callback
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.group = group or channel
+        self.durable = is_durable(channel) if durable is None else durable
+        self.subscription: Optional[Subscription] = None
+        self.consumer: Optional[StreamConsumer] = None
+        self._batch: List[StreamMessage] = []
+
+    async def subscribe(self) -> Union[Subscription, StreamConsumer]:
+        transport = AsyncPubSubTransport.instance()
+        if self.durable:
+            if self.consumer is None:
+                self.consumer = StreamConsumer(self.channel, self.group, client=transport.client)
+                await self.consumer.ensure_group()
+            return self.consumer
+        if self.subscription is None:
+            self.subscription = await transport.subscribe(self.channel, self.maxsize, self.overflow)
+        return self.subscription
+
+    async def get(self) -> Union[Envelope, bytes]:
+        """
+        Wait for the next message on the channel: an Envelope when one was sent, else the
+        published bytes. Durable messages are acknowledged as they are handed out.
+        """
+        return decode_message(await self.get_raw())
+
+    async def receive(self) -> Envelope:
+        """
+        Wait for the next message and decode it as an Envelope.
+        """
+        return Envelope.decode(await self.get_raw())
+
+    async def get_raw(self) -> bytes:
+        subscription = await self.subscribe()
+        if not self.durable:
+            return await subscription.get()
+        while not self._batch:
+            self._batch = await subscription.read()
+        message = self._batch.pop(0)
+        await message.ack()
+        return message.data
+
     async def listen(self):
-        await self.pubsub.subscribe(self.channel)
-        async for message in self.pubsub.listen():
-            if message['type'] == 'message':
-                await self.callback(message['data'].decode('utf-8'))
+        """
+        Pass every message on the channel to callback, until cancelled. Durable messages are
+        acknowledged after callback returns and redelivered if it raised.
+        """
+        if self.durable:
+            consumer = await self.subscribe()
+            return await consumer.listen(lambda message: self.callback(decode_message(message.data)))
+        while True:
+            await self.callback(await self.get())
 
     async def callback(self, message):
         """
         Callback function to handle incoming messages.
-        :param message: The message received from the channel
+        :param message: The message received from the channel: an Envelope or the published bytes
         """
-        return message
\ No newline at end of file
+        if self.handler is not None:
+            return await self.handler(message)
+        return message
+
+    async def close(self):
+        if self.subscription is not None:
+            await self.subscription.close()
+            self.subscription = None
+        # Fetched but unacknowledged durable messages go back to the group after claim_idle_ms
+        self.consumer = None
+        self._batch = []
+
+    async def __aenter__(self) -> "Subscriber":
+        await self.subscribe()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
@@ -0,0 +1,166 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+import redis
+
+from connections.db import redis_client, async_redis_client, RedisBatch
+from synapse.settings import DURABLE_CHANNELS, STREAM_MAXLEN, STREAM_BATCH_SIZE, STREAM_CLAIM_IDLE_MS
+
+STREAM_PREFIX = "synapse:stream:"
+
+logger = logging.getLogger(__name__)
+
+
+def stream_key(channel: str) -> str:
+    return f"{STREAM_PREFIX}{channel}"
+
+
+def is_durable(channel: str) -> bool:
+    return channel in DURABLE_CHANNELS
+
+
+class StreamMessage:
+    def __init__(self, consumer: "StreamConsumer", message_id: bytes, fields: dict):
+        self.consumer = consumer
+        self.id = message_id
+        self.data = fields.get(b"data")
+        sender = fields.get(b"sender")
+        self.sender = sender.decode("utf-8") if sender is not None else None
+
+    async def ack(self):
+        await self.consumer.ack(self.id)
+
+
+class StreamPublisher:
+    def __init__(self, channel: str, client=None, maxlen: int = STREAM_MAXLEN):
+        """
+        Appends messages to the channel's Redis stream. Unlike PUBLISH, entries stay until
+        every consumer group has read them and the stream outgrows maxlen (trimmed
+        approximately, so Redis can drop whole nodes).
+        """
+        self.channel = channel
+        self.key = stream_key(channel)
+        self.client = client or redis_client()
+        self.maxlen = maxlen
+
+    def publish(self, message, sender: Optional[str] = None) -> bytes:
+        """
+        :return: The entry id
+        """
+        return self.client.xadd(self.key, self._fields(message, sender), maxlen=self.maxlen, approximate=True)
+
+    def publish_many(self, messages, sender: Optional[str] = None):
+        with RedisBatch(self.client) as batch:
+            for message in messages:
+                batch.xadd(self.key, self._fields(message, sender), maxlen=self.maxlen, approximate=True)
+
+    async def publish_async(self, client, message, sender: Optional[str] = None) -> bytes:
+        """
+        :param client: redis.asyncio client of the running loop
+        """
+        return await client.xadd(self.key, self._fields(message, sender), maxlen=self.maxlen, approximate=True)
+
+    @staticmethod
+    def _fields(message, sender: Optional[str]) -> dict:
+        fields = {"data": message}
+        if sender is not None:
+            fields["sender"] = sender
+        return fields
+
+
+class StreamConsumer:
+    def __init__(self, channel: str, group: str, consumer: Optional[str] = None, batch_size: int = STREAM_BATCH_SIZE,
+                 block_ms: int = 1000, claim_idle_ms: int = STREAM_CLAIM_IDLE_MS, start_id: str = "0", client=None):
+        """
+        One member of a consumer group on the channel's stream. Each entry goes to a single
+        member of the group, so adding consumers spreads the load; separate groups each see
+        every entry.
+
+        Entries stay pending until acknowledged. A consumer first re-reads its own pending
+        entries and takes over entries any member has held unacknowledged for claim_idle_ms,
+        so messages survive crashed consumers and failed handlers.
+
+        :param consumer: Name within the group; defaults to a unique one. Give a stable name to
+                         have a restarted consumer resume its own pending entries at once
+        :param batch_size: Entries fetched per XREADGROUP
+        :param start_id: Where a newly created group starts: "0" for the retained backlog, "$" for new entries only
+        """
+        self.channel = channel
+        self.key = stream_key(channel)
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.start_id = start_id
+        self.client = client or async_redis_client()
+        self._group_ready = False
+        self._next_claim = 0.0
+        # Own pending entries are read after this id until exhausted, then new ones from ">"
+        self._cursor = "0"
+        self._claim_cursor = "0-0"
+
+    async def ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            await self.client.xgroup_create(self.key, self.group, id=self.start_id, mkstream=True)
+        except redis.exceptions.ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+        self._group_ready = True
+
+    async def read(self) -> List[StreamMessage]:
+        """
+        Next batch: stale entries claimed from other consumers, then this consumer's own
+        pending entries, then new ones (waiting up to block_ms).
+        """
+        await self.ensure_group()
+        messages = await self._claim()
+        if messages:
+            return messages
+        while True:
+            pending = self._cursor != ">"
+            response = await self.client.xreadgroup(self.group, self.consumer, {self.key: self._cursor},
+                                                    count=self.batch_size, block=None if pending else self.block_ms)
+            entries = response[0][1] if response else []
+            if not pending:
+                break
+            self._cursor = entries[-1][0] if entries else ">"
+            if entries:
+                break
+        # Entries deleted by trimming while pending come back with no fields
+        return [StreamMessage(self, message_id, fields) for message_id, fields in entries if fields]
+
+    async def ack(self, *message_ids):
+        if message_ids:
+            await self.client.xack(self.key, self.group, *message_ids)
+
+    async def listen(self, callback: Callable[[StreamMessage], Awaitable]):
+        """
+        Pass every entry to callback, acknowledging it once callback returns. Entries whose
+        callback raised stay pending and are redelivered after claim_idle_ms.
+        """
+        while True:
+            for message in await self.read():
+                try:
+                    await callback(message)
+                except Exception:
+                    logger.exception("Handling %s from %s failed; left pending", message.id, self.key)
+                    continue
+                await message.ack()
+
+    async def _claim(self) -> List[StreamMessage]:
+        # Nothing can have gone stale sooner than claim_idle_ms after the last sweep finished
+        if time.monotonic() < self._next_claim:
+            return []
+        response = await self.client.xautoclaim(self.key, self.group, self.consumer, self.claim_idle_ms,
+                                                start_id=self._claim_cursor, count=self.batch_size)
+        self._claim_cursor, entries = response[0], response[1]
+        if self._claim_cursor in (b"0-0", "0-0"):
+            self._next_claim = time.monotonic() + self.claim_idle_ms / 1000
+        return [StreamMessage(self, message_id, fields) for message_id, fields in entries if fields]
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import threading
+import time
+import weakref
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+PUBLISH_PREFIX = "synapse:stats:"
+
+# Live collectors in this process, by service id
+_registry: "weakref.WeakValueDictionary[str, AccessStats]" = weakref.WeakValueDictionary()
+
+
+def key_prefix(key: str) -> str:
+    # Keys without a prefix share one bucket so per-prefix tables stay bounded.
+    return key.split(":", 1)[0] if ":" in key else "*"
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 2048, depth: int = 4):
+        """
+        Approximate per-key counts in fixed memory. Estimates never undercount and
+        overcount by at most ~e/width of the total with probability 1 - e^-depth.
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def add(self, key: str, count: int = 1) -> int:
+        """
+        Conservative update: only the counters at the current minimum are raised.
+
+        :return: The key's new estimate
+        """
+        columns = self._columns(key)
+        current = self.table[self._rows, columns]
+        estimate = int(current.min()) + count
+        self.table[self._rows, columns] = np.maximum(current, estimate)
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return int(self.table[self._rows, self._columns(key)].min())
+
+    def _columns(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self.depth).digest()
+        return np.frombuffer(digest, dtype=np.uint32) % self.width
+
+
+class TopK:
+    def __init__(self, k: int = 20, width: int = 2048, depth: int = 4):
+        """
+        Heavy hitters over a count-min sketch: only the k keys with the highest estimates
+        are kept by name, so memory does not grow with the key space.
+        """
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1):
+        estimate = self.sketch.add(key, count)
+        if key in self.top or len(self.top) < self.k:
+            self.top[key] = estimate
+            return
+        coldest = min(self.top, key=self.top.get)
+        if estimate > self.top[coldest]:
+            del self.top[coldest]
+            self.top[key] = estimate
+
+    def items(self) -> List[Tuple[str, int]]:
+        return sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+
+
+class AccessStats:
+    def __init__(self, service_id: Optional[str] = None, top_k: int = 20):
+        """
+        Per-prefix traffic counters plus the hottest keys by accesses and by lock wait.
+
+        :param service_id: Registers the collector under this id for collect()
+        :param top_k: Number of hot keys to report
+        """
+        self.service_id = service_id
+        self.started_at = time.time()
+        self.prefixes: Dict[str, Dict[str, float]] = {}
+        self.hot_keys = TopK(top_k)
+        # Weighted by microseconds waited
+        self.contended_keys = TopK(top_k)
+        self._lock = threading.Lock()
+        if service_id is not None:
+            _registry[str(service_id)] = self
+
+    def record_read(self, key: str, nbytes: int, hit: Optional[bool] = None):
+        """
+        :param hit: Whether the cache served the read; None when the cache was not involved
+        """
+        with self._lock:
+            stats = self._stats(key)
+            stats["reads"] += 1
+            stats["bytes_out"] += nbytes
+            if hit is not None:
+                stats["cache_hits" if hit else "cache_misses"] += 1
+            self.hot_keys.add(key)
+
+    def record_write(self, key: str, raw_bytes: int, stored_bytes: int):
+        with self._lock:
+            stats = self._stats(key)
+            stats["writes"] += 1
+            stats["bytes_in"] += raw_bytes
+            stats["stored_bytes"] += stored_bytes
+            self.hot_keys.add(key)
+
+    def record_lock_wait(self, key: str, waited: float):
+        with self._lock:
+            stats = self._stats(key)
+            stats["lock_waits"] += 1
+            stats["lock_wait_total"] += waited
+            stats["lock_wait_max"] = max(stats["lock_wait_max"], waited)
+            micros = int(waited * 1e6)
+            if micros:
+                self.contended_keys.add(key, micros)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        JSON-serialisable view, with compression ratio (raw / stored bytes written) and
+        cache hit rate derived per prefix.
+        """
+        with self._lock:
+            prefixes = {}
+            for prefix, stats in self.prefixes.items():
+                stats = dict(stats)
+                lookups = stats["cache_hits"] + stats["cache_misses"]
+                stats["compression_ratio"] = stats["bytes_in"] / stats["stored_bytes"] if stats["stored_bytes"] else None
+                stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else None
+                prefixes[prefix] = stats
+            return {
+                "service_id": self.service_id,
+                "since": self.started_at,
+                "prefixes": prefixes,
+                "hot_keys": [{"key": key, "accesses": count} for key, count in self.hot_keys.items()],
+                "contended_keys": [{"key": key, "lock_wait": micros / 1e6} for key, micros in self.contended_keys.items()],
+            }
+
+    def publish(self, client, ttl: int = 60):
+        """
+        Store the snapshot in Redis so processes other than this one (the management
+        command, the stats endpoint) can read it.
+        """
+        client.set(f"{PUBLISH_PREFIX}{self.service_id}", json.dumps(self.snapshot()), ex=ttl)
+
+    def _stats(self, key: str) -> Dict[str, float]:
+        prefix = key_prefix(key)
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = {"reads": 0, "writes": 0, "bytes_in": 0, "bytes_out": 0, "stored_bytes": 0,
+                                     "cache_hits": 0, "cache_misses": 0, "lock_waits": 0,
+                                     "lock_wait_total": 0.0, "lock_wait_max": 0.0}
+        return self.prefixes[prefix]
+
+
+def collect(client=None) -> Dict[str, Dict[str, Any]]:
+    """
+    Snapshots of every collector in this process and, given a Redis client, every one
+    published by other processes. Local collectors win over their published copies.
+    """
+    snapshots = {}
+    if client is not None:
+        for name in client.scan_iter(match=f"{PUBLISH_PREFIX}*"):
+            payload = client.get(name)
+            if payload is not None:
+                name = name.decode("utf-8") if isinstance(name, bytes) else name
+                snapshots[name[len(PUBLISH_PREFIX):]] = json.loads(payload)
+    for service_id, stats in list(_registry.items()):
+        snapshots[service_id] = stats.snapshot()
+    return snapshots
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import numpy as np
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.notifications import wait_for_key
+
+if TYPE_CHECKING:
+    import torch
+
+
+class AsyncSharedMemoryManager:
+    def __init__(self, service_id: str, cache_capacity: int, cache_expire_time: int, inline_decompress_limit: int = 16384, **kwargs):
+        """
+        asyncio front end for SharedMemoryManager. It shares the sync manager's storage,
+        cache and wire format, so values written by either can be read by both.
+
+        Blocking work (memcached calls, compression, mmap and partition I/O) runs on the
+        manager's thread pool, distributed leases are awaited without blocking the loop,
+        and texts held in process that are small enough to decompress inline never leave the loop.
+
+        The pool caps concurrency: at most max_workers calls (a SharedMemoryManager argument,
+        default MEMORY_MANAGER_WORKERS) run at once per manager and further ones queue for
+        a thread, so size it for the number of requests expected to go to the pool concurrently.
+
+        :param inline_decompress_limit: Largest in-process text in bytes decompressed on the event loop
+        :param kwargs: Passed through to SharedMemoryManager
+        """
+        self.sync = SharedMemoryManager(service_id=service_id, cache_capacity=cache_capacity,
+                                        cache_expire_time=cache_expire_time, **kwargs)
+        self.inline_decompress_limit = inline_decompress_limit
+
+    @classmethod
+    def wrap(cls, manager: SharedMemoryManager, inline_decompress_limit: int = 16384) -> "AsyncSharedMemoryManager":
+        """
+        Build an async front end over an existing sync manager.
+        """
+        instance = cls.__new__(cls)
+        instance.sync = manager
+        instance.inline_decompress_limit = inline_decompress_limit
+        return instance
+
+    async def store_text(self, key: str, text: str, metadata: Dict[str, Any] = None, distributed: Optional[bool] = None,
+                         notify: Optional[str] = None) -> int:
+        store = functools.partial(self.sync.store_text, notify=notify)
+        return await self._write(key, distributed, store, key, text, metadata)
+
+    async def wait_for_text(self, channel: str, key: str, version: Optional[int] = None, timeout: Optional[float] = None) -> str:
+        """
+        Wait until key is announced on channel and return its text (the requested version when
+        given), from the event itself when it was sent inline, else from storage.
+        """
+        event = await wait_for_key(channel, key, version, timeout)
+        data = event.inline_data(version)
+        if data is not None:
+            return data
+        return await self.retrieve_text(key, version)
+
+    async def retrieve_text(self, key: str, version: int = None) -> str:
+        if version is None:
+            payload = self.sync.text_storage.get(key)
+            if payload is not None and len(payload) <= self.inline_decompress_limit:
+                decompressed = self.sync.compression_service.decompress(payload)
+                self.sync.access_stats.record_read(key, len(decompressed))
+                return decompressed.decode('utf-8')
+        return await self._run(self.sync.retrieve_text, key, version)
+
+    async def store_tensor(self, key: str, tensor: Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None,
+                           shared: bool = False, distributed: Optional[bool] = None) -> int:
+        return await self._write(key, distributed, self.sync.store_tensor, key, tensor, metadata, shared)
+
+    async def retrieve_tensor(self, key: str, version: int = None) -> Union[np.ndarray, torch.Tensor]:
+        return await self._run(self.sync.retrieve_tensor, key, version)
+
+    async def retrieve_rows(self, key: str, start: int, stop: int) -> np.ndarray:
+        return await self._run(self.sync.retrieve_rows, key, start, stop)
+
+    async def store_vector(self, key: str, vector: Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None,
+                           shared: bool = False, distributed: Optional[bool] = None, quantize: Optional[str] = None) -> Optional[int]:
+        store = functools.partial(self.sync.store_vector, quantize=quantize)
+        return await self._write(key, distributed, store, key, vector, metadata, shared)
+
+    async def retrieve_vector(self, key: str, version: int = None, dequantize: bool = True) -> Union[np.ndarray, torch.Tensor]:
+        return await self._run(self.sync.retrieve_vector, key, version, dequantize)
+
+    async def store_many(self, items: List[Tuple[str, Union[str, np.ndarray, torch.Tensor]]], metadata: Dict[str, Any] = None,
+                         distributed: Optional[bool] = None) -> List[Optional[Exception]]:
+        return await self._run(self.sync.store_many, items, metadata, distributed)
+
+    async def retrieve_many(self, keys: List[str]) -> List[Union[str, np.ndarray, Exception]]:
+        return await self._run(self.sync.retrieve_many, keys)
+
+    async def delete(self, key: str, distributed: Optional[bool] = None) -> bool:
+        return await self._write(key, distributed, self.sync.delete, key)
+
+    def get_metadata(self, key: str) -> Dict[str, Any]:
+        return self.sync.get_metadata(key)
+
+    async def set_metadata(self, key: str, metadata: Dict[str, Any]):
+        await self._run(self.sync.set_metadata, key, metadata)
+
+    async def find_keys(self, **conditions: Any) -> List[str]:
+        return await self._run(self.sync.find_keys, **conditions)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.sync.executor, functools.partial(func, *args, **kwargs))
+
+    async def _write(self, key: str, distributed: Optional[bool], func, *args):
+        """
+        Run a sync store method on the thread pool. A requested distributed lease is awaited
+        here rather than in the worker thread, and fenced before the write commits.
+        """
+        async with self._lease(key, distributed) as lease:
+            return await self._run(func, *args, distributed=False, lease=lease)
+
+    @asynccontextmanager
+    async def _lease(self, key: str, distributed: Optional[bool]):
+        if not (self.sync.distributed_locks if distributed is None else distributed):
+            yield None
+            return
+        async with self.sync.distributed_lock_manager.lease_manager.lease_async(key) as lease:
+            yield lease
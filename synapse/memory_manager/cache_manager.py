@@ -1,67 +1,251 @@
-import sys
+import time
+import threading
+from collections import OrderedDict
 from typing import Any, Optional
+
+import pylibmc
+
 from connections.db import memcached_client
 
+
+def sizeof(value: Any) -> int:
+    """
+    Byte-accurate size of a cached value.
+
+    :param value: bytes-like object or numpy array
+    :return: Size of the payload in bytes
+    """
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    raise TypeError(f"Unsupported cache value type: {type(value).__name__}")
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+class LocalCache:
+    def __init__(self, capacity: int, expire_time: int = 0):
+        """
+        Bounded in-process LRU cache sized by payload bytes.
+
+        :param capacity: Maximum total size of the cached values in bytes
+        :param expire_time: Time in seconds after which an item expires (0 means no expiration)
+        """
+        self.capacity = capacity
+        self.expire_time = expire_time
+        self.current_capacity = 0
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, count: bool = True) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self.stats.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at and expires_at <= time.monotonic():
+                self._remove(key)
+                self.stats.expirations += 1
+                if count:
+                    self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self.stats.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> bool:
+        """
+        Insert or replace an item, evicting least recently used items as needed.
+
+        :return: False if the value is larger than the whole cache and was not admitted
+        """
+        size = sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.capacity:
+                return False
+            while self.current_capacity + size > self.capacity:
+                self._evict_one()
+            expires_at = time.monotonic() + self.expire_time if self.expire_time else 0
+            self._entries[key] = (value, size, expires_at)
+            self.current_capacity += size
+            return True
+
+    def evict(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_capacity = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_capacity -= entry[1]
+
+    def _evict_one(self):
+        key, (_, size, _) = self._entries.popitem(last=False)
+        self.current_capacity -= size
+        self.stats.evictions += 1
+
+
 class CacheManager:
-    def __init__(self, servers:list[str] = ["127.0.0.1"], capacity:int= 100000000, expire_time:int=3600):
+    def __init__(self, servers:list[str] = None, capacity:int= 100000000, expire_time:int=3600):
         """
-        Initialize the CacheManager with Memcached backend.
-        
-        :param servers: List of Memcached server addresses
-        :capacity: Maximum size of the cache in bytes
+        Initialize the CacheManager: an in-process LRU (L1) in front of Memcached (L2).
+        Reads go through L1 and fill it from L2 on a miss, writes go to both tiers.
+
+        :param servers: List of Memcached server addresses (defaults to MEMCACHED_SERVERS); managers
+                        using the same servers share one pooled client
+        :capacity: Maximum size of the in-process cache in bytes
         :param expire_time: Time in seconds after which an item should expire (0 means no expiration)
         """
-        self.client = memcached_client()
+        self.client = memcached_client(servers)
         self.capacity = capacity
         self.expire_time = expire_time
-        self.current_capacity = 0
+        self.local = LocalCache(capacity=capacity, expire_time=expire_time)
+        self.stats = CacheStats()
+
+    @property
+    def current_capacity(self) -> int:
+        return self.local.current_capacity
 
     def get(self, key:str) -> Optional[Any]:
         """
         Retrieve an item from the cache.
-        
+
         :param key: The key of the item to retrieve
         :return: The value associated with the key, or None if not found
         """
+        value = self.local.get(key)
+        if value is not None:
+            return value
         try:
-            return self.client.get(key)
+            value = self.client.get(key)
         except pylibmc.Error:
+            value = None
+        if value is None:
+            self.stats.misses += 1
             return None
-        
-    def put(self, key: str, value: bytes):
-        value_size = sys.getsizeof(value)
-        print(f"Storing key: {key}, value size: {value_size}")  # Debug print
-        while self.current_capacity + value_size > self.capacity:
-            self._evict_one()
-        self.client.set(key, value, time=self.expire_time)
-        self.current_capacity += value_size
+        self.stats.hits += 1
+        self.local.put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes, local: bool = True):
+        """
+        Store an item in both cache tiers.
+
+        :param key: The key of the item to store
+        :param value: The bytes payload to store
+        :param local: Also keep it in L1; pass False when the caller already holds the value in process
+        """
+        if local:
+            self.local.put(key, value)
+        else:
+            self.local.evict(key)
+        try:
+            self.client.set(key, value, time=self.expire_time)
+        except pylibmc.Error:
+            pass
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        Retrieve several items, fetching L1 misses from Memcached in a single round trip.
+
+        :param keys: The keys of the items to retrieve
+        :return: Mapping of found keys to values; missing keys are omitted
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+        if not missing:
+            return found
+        try:
+            fetched = self.client.get_multi(missing)
+        except pylibmc.Error:
+            fetched = {}
+        self.stats.hits += len(fetched)
+        self.stats.misses += len(missing) - len(fetched)
+        for key, value in fetched.items():
+            self.local.put(key, value)
+        found.update(fetched)
+        return found
+
+    def put_many(self, items: dict, local: bool = True):
+        """
+        Store several items in both cache tiers with a single Memcached call.
+
+        :param items: Mapping of keys to bytes payloads
+        :param local: Also keep them in L1 (see put)
+        :return: Keys that Memcached failed to store
+        """
+        for key, value in items.items():
+            if local:
+                self.local.put(key, value)
+            else:
+                self.local.evict(key)
+        try:
+            return list(self.client.set_multi(items, time=self.expire_time) or [])
+        except pylibmc.Error:
+            return list(items)
 
     def evict(self, key:str):
         """
         Remove an item from the cache.
-        
+
         :param key: The key of the item to remove
         """
+        self.local.evict(key)
         try:
-            value = self.client.get(key)
-            if value:
-                self.current_capacity -= sys.getsizeof(value)
             self.client.delete(key)
         except pylibmc.Error:
             pass
-    
-    def _evict_one(self):
+
+    def get_stats(self) -> dict:
         """
-        Evict one item from the cache when at capacity.
-        This is a simplistic implementation and may not be the most efficient.
+        Hit/miss/eviction counters for both tiers. L2 counters only cover L1 misses.
         """
-        try:
-            keys = self.client.get_stats()[0][1].get(b'curr_items', [])
-            if keys:
-                key_to_evict = keys[0]
-                value = self.client.get(key_to_evict)
-                if value:
-                    self.current_capacity -= sys.getsizeof(value)
-                self.client.delete(key_to_evict)
-        except pylibmc.Error:
-            pass
\ No newline at end of file
+        return {
+            "l1": {**self.local.stats.as_dict(), "size": self.local.current_capacity, "items": len(self.local)},
+            "l2": self.stats.as_dict(),
+        }
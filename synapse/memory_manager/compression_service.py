@@ -1,22 +1,356 @@
-import numpy as np
-import torch
+from __future__ import annotations
+
+import io
+import lzma
+import struct
 import zlib
-from typing import Union
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from synapse.memory_manager.torch_compat import is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+# Header: magic, format version, codec id, payload kind (0 = bytes, 1 = ndarray).
+# ndarray payloads are followed by the dtype string and the shape. Chunked payloads
+# then record the total and chunk size and hold length-prefixed compressed frames.
+MAGIC = b"SY"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBB")
+CHUNKED_HEADER = struct.Struct("<QQ")
+FRAME = struct.Struct("<I")
+KIND_BYTES = 0
+KIND_NDARRAY = 1
+KIND_CHUNKED_BYTES = 2
+KIND_CHUNKED_NDARRAY = 3
+
+
+class Codec:
+    id = 0
+    name = "raw"
+
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def decompress(self, data) -> bytes:
+        return bytes(data)
+
+
+class ZlibCodec(Codec):
+    id = 1
+
+    def __init__(self, level: int = zlib.Z_DEFAULT_COMPRESSION, name: str = "zlib"):
+        self.level = level
+        self.name = name
+
+    def compress(self, data) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCodec(Codec):
+    id = 2
+    name = "lzma"
+
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def compress(self, data) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data) -> bytes:
+        return lzma.decompress(data)
+
+
+CODECS: Dict[str, Codec] = {}
+DECODERS: Dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec, decoder: bool = False):
+    """
+    Make a codec selectable by name. The first codec registered for an id (or one
+    registered with decoder=True) is used to decode payloads carrying that id.
+    """
+    CODECS[codec.name] = codec
+    if decoder or codec.id not in DECODERS:
+        DECODERS[codec.id] = codec
+
+
+register_codec(Codec())
+register_codec(ZlibCodec(), decoder=True)
+register_codec(ZlibCodec(level=1, name="zlib-fast"))
+register_codec(ZlibCodec(level=9, name="zlib-best"))
+register_codec(LzmaCodec())
+
+
+def array_header(data: np.ndarray) -> bytes:
+    dtype = data.dtype.str.encode("ascii")
+    return struct.pack(f"<B{len(dtype)}sB{data.ndim}Q", len(dtype), dtype, data.ndim, *data.shape)
+
+
+def read_array_header(data: bytes, offset: int) -> Tuple[np.dtype, Tuple[int, ...], int]:
+    """
+    :return: dtype, shape and the offset just past the array header
+    :raises IndexError: if data ends before the header does
+    """
+    if offset + 1 > len(data):
+        raise IndexError("Truncated array header")
+    dtype_len = data[offset]
+    offset += 1
+    if offset + dtype_len + 1 > len(data):
+        raise IndexError("Truncated array header")
+    dtype = np.dtype(bytes(data[offset:offset + dtype_len]).decode("ascii"))
+    offset += dtype_len
+    ndim = data[offset]
+    offset += 1
+    if offset + 8 * ndim > len(data):
+        raise IndexError("Truncated array header")
+    shape = struct.unpack_from(f"<{ndim}Q", data, offset)
+    return dtype, shape, offset + 8 * ndim
+
+
+class ChunkedDecompressor:
+    def __init__(self, out: Optional[np.ndarray] = None):
+        """
+        Incremental decoder for chunked payloads. Input can be fed in pieces of any
+        size; frames are decoded in place from each piece, and only a header or frame
+        split across pieces is buffered, one at a time.
+
+        :param out: Optional preallocated C-contiguous array to decompress into
+        """
+        self.out = out
+        self._buffer = bytearray()
+        self._view = None
+        self._codec = None
+        self._kind = None
+        self._total = 0
+        self._written = 0
+
+    def feed(self, data: bytes):
+        data = memoryview(data).cast("B")
+        while data:
+            if self._buffer:
+                # Top the split unit up with just the bytes it still needs
+                take = self._unit_size(self._buffer) - len(self._buffer)
+                self._buffer += data[:take]
+                data = data[take:]
+                if self._unit_size(self._buffer) <= len(self._buffer):
+                    unit, self._buffer = self._buffer, bytearray()
+                    self._consume(memoryview(unit))
+                continue
+            size = self._unit_size(data)
+            if size > len(data):
+                self._buffer = bytearray(data)
+                return
+            self._consume(data[:size])
+            data = data[size:]
+
+    def result(self) -> Union[np.ndarray, bytes]:
+        if self._codec is None or self._written != self._total or self._buffer:
+            raise ValueError("Incomplete chunked payload")
+        if self._kind == KIND_CHUNKED_BYTES:
+            return bytes(self.out)
+        return self.out
+
+    def _unit_size(self, data) -> int:
+        """
+        :return: Size of the header or frame starting data, or a lower bound larger than
+                 len(data) when data does not reach far enough to tell
+        """
+        if self._codec is not None:
+            if len(data) < FRAME.size:
+                return FRAME.size
+            return FRAME.size + FRAME.unpack_from(data)[0]
+        size = HEADER.size
+        if len(data) < size:
+            return size
+        magic, version, _, kind = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION or kind not in (KIND_CHUNKED_BYTES, KIND_CHUNKED_NDARRAY):
+            raise ValueError("Not a chunked compression stream")
+        if kind == KIND_CHUNKED_NDARRAY:
+            # dtype length, dtype string and ndim, then the shape
+            if len(data) < size + 1:
+                return size + 1
+            size += 1 + data[size] + 1
+            if len(data) < size:
+                return size
+            size += 8 * data[size - 1]
+        return size + CHUNKED_HEADER.size
+
+    def _consume(self, unit: memoryview):
+        if self._codec is None:
+            self._read_header(unit)
+            return
+        chunk = self._codec.decompress(unit[FRAME.size:])
+        if self._written + len(chunk) > self._total:
+            raise ValueError("Chunked payload is larger than its header declares")
+        self._view[self._written:self._written + len(chunk)] = chunk
+        self._written += len(chunk)
+
+    def _read_header(self, header: memoryview):
+        _, _, codec_id, kind = HEADER.unpack_from(header)
+        offset = HEADER.size
+        if kind == KIND_CHUNKED_NDARRAY:
+            dtype, shape, offset = read_array_header(header, offset)
+        self._total, _ = CHUNKED_HEADER.unpack_from(header, offset)
+        if kind == KIND_CHUNKED_NDARRAY:
+            if self.out is None:
+                self.out = np.empty(shape, dtype=dtype)
+            elif self.out.dtype != dtype or self.out.shape != tuple(shape) or not self.out.flags.c_contiguous:
+                raise ValueError("Output array does not match the stored dtype and shape")
+            self._view = memoryview(self.out).cast("B") if self.out.size else memoryview(bytearray())
+        else:
+            self.out = bytearray(self._total)
+            self._view = memoryview(self.out)
+        self._codec = DECODERS[codec_id]
+        self._kind = kind
+
 
 class CompressionService:
-    def compress(self, data: Union[np.ndarray, torch.Tensor, bytes]) -> bytes:
-        if isinstance(data, torch.Tensor):
+    def __init__(self, min_size: int = 256, sample_size: int = 65536, min_ratio: float = 0.9, cold_codec: str = "lzma",
+                 chunk_size: int = 4 * 1024 * 1024, stream_threshold: int = 64 * 1024 * 1024):
+        """
+        :param min_size: Payloads smaller than this are stored raw
+        :param sample_size: Bytes compressed with the fast codec to estimate the ratio
+        :param min_ratio: Store raw when the sampled compressed/original ratio is above this
+        :param cold_codec: Codec used when compressing with cold=True
+        :param chunk_size: Size in bytes of the slices compressed in chunked mode
+        :param stream_threshold: Payloads larger than this are compressed in chunked mode
+        """
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.min_ratio = min_ratio
+        self.cold_codec = cold_codec
+        self.chunk_size = chunk_size
+        self.stream_threshold = stream_threshold
+
+    def compress(self, data: Union[np.ndarray, torch.Tensor, bytes], codec: Optional[str] = None, cold: bool = False) -> bytes:
+        """
+        Compress data behind a self-describing header.
+
+        :param data: bytes or an array; arrays keep their dtype and shape
+        :param codec: Name of a registered codec; chosen automatically when omitted
+        :param cold: Favour ratio over speed for rarely read data
+        """
+        sink = io.BytesIO()
+        self.compress_into(data, sink, codec=codec, cold=cold)
+        return sink.getvalue()
+
+    def compress_into(self, data: Union[np.ndarray, torch.Tensor, bytes], sink, codec: Optional[str] = None, cold: bool = False,
+                      limit: Optional[int] = None) -> Optional[int]:
+        """
+        Write what compress returns to sink. Payloads above stream_threshold are written
+        one frame at a time, so besides what sink keeps only one compressed frame is held.
+
+        :param sink: Anything with a write(bytes) method, e.g. a file or io.BytesIO
+        :param limit: Stop once more than this many bytes would be written
+        :return: Bytes written, or None if limit was reached; sink then holds a partial payload
+        """
+        data, header, buffer = self._prepare(data)
+        if len(buffer) > self.stream_threshold:
+            pieces = self.compress_chunks(data, codec=codec, cold=cold)
+        else:
+            kind = KIND_NDARRAY if isinstance(data, np.ndarray) else KIND_BYTES
+            selected = CODECS[codec] if codec else self.choose_codec(buffer, cold)
+            pieces = [HEADER.pack(MAGIC, FORMAT_VERSION, selected.id, kind) + header + selected.compress(buffer)]
+        written = 0
+        for piece in pieces:
+            written += len(piece)
+            if limit is not None and written > limit:
+                return None
+            sink.write(piece)
+        return written
+
+    def compress_chunks(self, data: Union[np.ndarray, torch.Tensor, bytes], codec: Optional[str] = None, cold: bool = False,
+                        chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Compress data as a stream of independently compressed frames. Slices are taken
+        from a memoryview over the array buffer, so the input is never copied whole.
+
+        :param chunk_size: Uncompressed size of each frame, defaults to the service's chunk_size
+        :return: Iterator over the header followed by one item per frame
+        """
+        chunk_size = chunk_size or self.chunk_size
+        data, header, buffer = self._prepare(data)
+        kind = KIND_CHUNKED_NDARRAY if isinstance(data, np.ndarray) else KIND_CHUNKED_BYTES
+        selected = CODECS[codec] if codec else self.choose_codec(buffer, cold)
+        yield HEADER.pack(MAGIC, FORMAT_VERSION, selected.id, kind) + header + CHUNKED_HEADER.pack(len(buffer), chunk_size)
+        for start in range(0, len(buffer), chunk_size):
+            frame = selected.compress(buffer[start:start + chunk_size])
+            yield FRAME.pack(len(frame)) + frame
+
+    def decompress_chunks(self, chunks: Iterable[bytes], out: Optional[np.ndarray] = None) -> Union[np.ndarray, bytes]:
+        """
+        Decompress a stream produced by compress_chunks, writing each frame straight
+        into the output buffer.
+
+        :param chunks: The compressed stream, split at arbitrary boundaries
+        :param out: Optional preallocated C-contiguous array with the stored dtype and shape
+        """
+        decompressor = ChunkedDecompressor(out)
+        for chunk in chunks:
+            decompressor.feed(chunk)
+        return decompressor.result()
+
+    def _prepare(self, data: Union[np.ndarray, torch.Tensor, bytes]) -> Tuple[Union[np.ndarray, bytes], bytes, memoryview]:
+        if is_tensor(data):
             data = data.cpu().numpy()
+        if isinstance(data, np.generic):
+            data = np.asarray(data)
         if isinstance(data, np.ndarray):
-            data = data.tobytes()
-        return zlib.compress(data)
-    
+            if data.dtype.hasobject:
+                raise TypeError("Object arrays cannot be compressed")
+            if not data.flags.c_contiguous:
+                data = data.copy(order="C")
+            buffer = memoryview(data).cast("B") if data.size else memoryview(b"")
+            return data, array_header(data), buffer
+        return data, b"", memoryview(data)
+
     def decompress(self, compressed_data: bytes) -> Union[np.ndarray, bytes]:
         if not isinstance(compressed_data, bytes):
             raise TypeError("compressed_data must be of type bytes")
-        
+        if not compressed_data.startswith(MAGIC):
+            return self._decompress_legacy(compressed_data)
+
+        if len(compressed_data) < HEADER.size:
+            raise ValueError("Truncated compression header")
+        _, version, codec_id, kind = HEADER.unpack_from(compressed_data)
+        if kind in (KIND_CHUNKED_BYTES, KIND_CHUNKED_NDARRAY):
+            return self.decompress_chunks([compressed_data])
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compression format version: {version}")
+        offset = HEADER.size
+        if kind == KIND_NDARRAY:
+            try:
+                dtype, shape, offset = read_array_header(compressed_data, offset)
+            except IndexError as e:
+                raise ValueError(str(e)) from e
+        payload = DECODERS[codec_id].decompress(memoryview(compressed_data)[offset:])
+        if kind == KIND_NDARRAY:
+            return np.frombuffer(payload, dtype=dtype).reshape(shape)
+        return payload
+
+    def choose_codec(self, buffer: memoryview, cold: bool = False) -> Codec:
+        """
+        Pick raw for small or incompressible payloads, the cold codec when asked,
+        and zlib otherwise, based on the ratio of a fast-compressed sample.
+        """
+        if len(buffer) < self.min_size:
+            return CODECS["raw"]
+        sample = buffer[:self.sample_size]
+        ratio = len(CODECS["zlib-fast"].compress(sample)) / len(sample)
+        if ratio > self.min_ratio:
+            return CODECS["raw"]
+        if cold:
+            return CODECS[self.cold_codec]
+        return CODECS["zlib"]
+
+    def _decompress_legacy(self, compressed_data: bytes) -> Union[np.ndarray, bytes]:
         decompressed_data = zlib.decompress(compressed_data)
         try:
             return np.frombuffer(decompressed_data, dtype=np.float32)
         except ValueError:
-            return decompressed_data
\ No newline at end of file
+            return decompressed_data
@@ -1,45 +1,421 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import struct
+import threading
+import time
 import numpy as np
-import torch
-from typing import List, Union, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Union, Tuple
+
+from synapse.memory_manager.torch_compat import is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+def _match_length(matches, limit: int) -> int:
+    """
+    Largest n <= limit for which matches(n) holds, assuming it holds for every smaller n.
+    Binary search keeps the byte comparisons in C slice equality.
+    """
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if matches(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class VersionRecord:
+    __slots__ = ("version", "digest", "created_at", "size")
+
+    def __init__(self, version: int, digest: str, created_at: float, size: int):
+        self.version = version
+        self.digest = digest
+        self.created_at = created_at
+        self.size = size
+
 
 class VersionControl:
+    def __init__(self, keep_last: Optional[int] = None, keep_for: Optional[float] = None, keyframe_interval: int = 16):
+        """
+        Content-addressed version store. Each version points at an object identified by
+        the hash of its content, so identical contents are stored once across all keys.
+        A key's consecutive versions are delta-encoded against each other, with a full
+        copy every keyframe_interval versions to bound reconstruction cost.
+
+        :param keep_last: Keep at most this many versions per key
+        :param keep_for: Drop versions older than this many seconds
+        :param keyframe_interval: Maximum length of a delta chain
+        """
+        self.keep_last = keep_last
+        self.keep_for = keep_for
+        self.keyframe_interval = keyframe_interval
+        self.versions: Dict[str, "OrderedDict[int, VersionRecord]"] = {}
+        self.latest: Dict[str, VersionRecord] = {}
+        # digest -> (base digest or None, payload, chain depth); refcounts include delta bases
+        self.objects: Dict[str, Tuple[Optional[str], bytes, int]] = {}
+        self.refcounts: Dict[str, int] = {}
+        # Per key: objects its versions reach (delta bases included) and their total payload bytes
+        self._key_objects: Dict[str, Dict[str, int]] = {}
+        self._key_bytes: Dict[str, int] = {}
+        self._next_version: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def create_version(self, key:str, data: Optional[bytes] = None, delta: bool = True) -> int:
+        """
+        Record a new version of key.
+
+        :param data: Content of the version; versions created without data only bump the counter
+        :param delta: Allow delta-encoding against the key's previous version
+        :return: The new version number
+        """
+        with self._lock:
+            version = self._next_version.get(key, 0)
+            self._next_version[key] = version + 1
+            digest = None
+            size = 0
+            if data is not None:
+                data = bytes(data)
+                digest = self._put_object(data, self.latest.get(key) if delta else None)
+                self._charge(key, digest, 1)
+                size = len(data)
+            record = VersionRecord(version, digest, time.time(), size)
+            self.versions.setdefault(key, OrderedDict())[version] = record
+            self.latest[key] = record
+            self.apply_retention(key)
+            return version
+
+    def get_version(self, key:str, version:int) -> bytes:
+        """
+        :return: The content stored for the given version
+        :raises KeyError: if the version does not exist, was dropped or holds no content
+        """
+        with self._lock:
+            record = self.versions.get(key, {}).get(version)
+            if record is None or record.digest is None:
+                raise KeyError(f"No data for version {version} of key: {key}")
+            return self._get_object(record.digest)
+
+    def get_latest_version(self, key:str) -> int:
+        return self.latest[key].version
+
+    def get_latest(self, key: str) -> bytes:
+        return self.get_version(key, self.get_latest_version(key))
+
+    def footprint(self, key: str) -> int:
+        """
+        Bytes the store holds for key's versions: the payloads of every object they reach,
+        delta bases included. Objects shared with other keys count towards each of them.
+        """
+        with self._lock:
+            return self._key_bytes.get(key, 0)
+
+    def list_versions(self, key: str) -> List[int]:
+        with self._lock:
+            return list(self.versions.get(key, {}))
+
+    def apply_retention(self, key: str):
+        """
+        Drop versions outside the keep_last / keep_for policies. The latest version is always kept.
+        """
+        with self._lock:
+            records = self.versions.get(key)
+            if not records:
+                return
+            cutoff = time.time() - self.keep_for if self.keep_for is not None else None
+            while len(records) > 1:
+                version, record = next(iter(records.items()))
+                too_many = self.keep_last is not None and len(records) > self.keep_last
+                too_old = cutoff is not None and record.created_at < cutoff
+                if not (too_many or too_old):
+                    break
+                del records[version]
+                if record.digest is not None:
+                    self._charge(key, record.digest, -1)
+                    self._release_object(record.digest)
+
+    def delete(self, key: str):
+        with self._lock:
+            for record in self.versions.pop(key, {}).values():
+                if record.digest is not None:
+                    self._release_object(record.digest)
+            self.latest.pop(key, None)
+            self._next_version.pop(key, None)
+            self._key_objects.pop(key, None)
+            self._key_bytes.pop(key, None)
+
+    def export_state(self) -> Tuple[Dict[str, List[VersionRecord]], Dict[str, int], Dict[str, Tuple[Optional[str], bytes, int]], Dict[str, int]]:
+        """
+        Shallow copy of the whole store for persistence: (versions per key, next version
+        numbers, objects, refcounts). Records and objects are never mutated in place.
+        """
+        with self._lock:
+            versions = {key: list(records.values()) for key, records in self.versions.items()}
+            return versions, dict(self._next_version), dict(self.objects), dict(self.refcounts)
+
+    def import_state(self, versions: Dict[str, List[VersionRecord]], next_version: Dict[str, int],
+                     objects: Dict[str, Tuple[Optional[str], bytes, int]], refcounts: Dict[str, int]):
+        """
+        Replace the store's contents with state produced by export_state().
+        """
+        with self._lock:
+            self.versions = {key: OrderedDict((record.version, record) for record in records)
+                             for key, records in versions.items() if records}
+            self.latest = {key: next(reversed(records.values())) for key, records in self.versions.items()}
+            self._next_version = dict(next_version)
+            self.objects = dict(objects)
+            self.refcounts = dict(refcounts)
+            self._key_objects, self._key_bytes = {}, {}
+            for key, records in self.versions.items():
+                for record in records.values():
+                    if record.digest is not None:
+                        self._charge(key, record.digest, 1)
+
+    def _put_object(self, data: bytes, previous: Optional[VersionRecord]) -> str:
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        if digest in self.objects:
+            self.refcounts[digest] += 1
+            return digest
+        base = previous.digest if previous is not None else None
+        if base is not None and base in self.objects and self.objects[base][2] + 1 < self.keyframe_interval:
+            encoded = self._encode_delta(self._get_object(base), data)
+            if len(encoded) < len(data):
+                self.objects[digest] = (base, encoded, self.objects[base][2] + 1)
+                self.refcounts[digest] = 1
+                self.refcounts[base] += 1
+                return digest
+        self.objects[digest] = (None, data, 0)
+        self.refcounts[digest] = 1
+        return digest
+
+    def _charge(self, key: str, digest: str, count: int):
+        # Called before _release_object, while the object's delta chain still exists
+        reached = self._key_objects.setdefault(key, {})
+        while digest is not None:
+            base, payload, _ = self.objects[digest]
+            before = reached.get(digest, 0)
+            after = before + count
+            if after:
+                reached[digest] = after
+            else:
+                del reached[digest]
+            if not before or not after:
+                self._key_bytes[key] = self._key_bytes.get(key, 0) + (len(payload) if after else -len(payload))
+            digest = base
+
+    def _get_object(self, digest: str) -> bytes:
+        base, payload, _ = self.objects[digest]
+        if base is None:
+            return payload
+        return self._apply_delta(self._get_object(base), payload)
+
+    def _release_object(self, digest: str):
+        while digest is not None:
+            self.refcounts[digest] -= 1
+            if self.refcounts[digest] > 0:
+                return
+            del self.refcounts[digest]
+            base, _, _ = self.objects.pop(digest)
+            digest = base
+
+    @staticmethod
+    def _encode_delta(base: bytes, data: bytes) -> bytes:
+        # Edits between prompt versions are local, so a shared prefix/suffix plus the
+        # replaced middle captures them in O(n) without a full diff.
+        limit = min(len(base), len(data))
+        prefix = _match_length(lambda n: base[:n] == data[:n], limit)
+        suffix = _match_length(lambda n: base[len(base) - n:] == data[len(data) - n:], limit - prefix)
+        return struct.pack("<QQ", prefix, suffix) + data[prefix:len(data) - suffix]
+
+    @staticmethod
+    def _apply_delta(base: bytes, delta: bytes) -> bytes:
+        prefix, suffix = struct.unpack_from("<QQ", delta)
+        return base[:prefix] + delta[16:] + base[len(base) - suffix:]
+
+
+class MemoryPartitionBackend:
     def __init__(self):
-        self.versions = {}
-    
-    def create_version(self, key:str):
-        if key not in self.versions:
-            self.versions[key]= []
-        self.versions[key].append(len(self.versions[key]))
-        return self.versions[key][-1]
-    
-    def get_version(self, key:str, version:int):
-        return self.version[key][version]
-    
-    def get_latest_version(self, key:str):
-        return self.versions[key][-1]
-    
+        self.partitions = {}
+
+    def put(self, name: str, data: np.ndarray):
+        self.partitions[name] = data
+
+    def get(self, name: str, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        return self.partitions[name][start:stop]
+
+    def delete(self, name: str):
+        self.partitions.pop(name, None)
+
+
+class MmapPartitionBackend:
+    def __init__(self, mmap_manager):
+        """
+        :param mmap_manager: A MemoryMappedFileManager; row-range reads only page in the requested rows
+        """
+        self.mmap_manager = mmap_manager
+
+    def put(self, name: str, data: np.ndarray):
+        self.mmap_manager.store_mmap(name, data)
+
+    def get(self, name: str, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        try:
+            return self.mmap_manager.retrieve_mmap(name)[start:stop]
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def delete(self, name: str):
+        self.mmap_manager.delete_mmap(name)
+
+
+class CachePartitionBackend:
+    def __init__(self, cache_manager, compression_service):
+        """
+        :param cache_manager: A CacheManager holding compressed partitions
+        :param compression_service: Used to (de)compress partitions
+        """
+        self.cache_manager = cache_manager
+        self.compression_service = compression_service
+
+    def put(self, name: str, data: np.ndarray):
+        self.cache_manager.put(name, self.compression_service.compress(data))
+
+    def get(self, name: str, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        payload = self.cache_manager.get(name)
+        if payload is None:
+            raise KeyError(name)
+        return self.compression_service.decompress(payload)[start:stop]
+
+    def delete(self, name: str):
+        self.cache_manager.evict(name)
+
+
+class PartitionLayout:
+    __slots__ = ("boundaries", "dtype", "shape", "generation", "generations")
+
+    def __init__(self, boundaries: List[int], dtype: np.dtype, shape: Tuple[int, ...], generation: int = 0,
+                 generations: Optional[List[int]] = None):
+        # boundaries[i] is the first row of partition i; the last entry is the row count
+        self.boundaries = boundaries
+        self.dtype = dtype
+        self.shape = shape
+        # Each rewrite of a key, or of one of its partitions, stores it under a new generation;
+        # generations[i] is the one partition i was last written under
+        self.generation = generation
+        self.generations = generations if generations is not None else [generation] * (len(boundaries) - 1)
+
 
 class PartitioningService:
-    def __init__(self, num_partitions: int):
+    def __init__(self, num_partitions: int, backends: Optional[list] = None, max_workers: int = 4):
+        """
+        Row-sharded tensor store. Partition i of every key lives on backends[i % len(backends)]
+        and partitions are read and written concurrently on a thread pool. A rewrite stores
+        new partitions before publishing their layout, so readers never mix two tensors.
+
+        :param num_partitions: Number of row ranges each tensor is split into
+        :param backends: Partition backends (memory, mmap, cache); defaults to a single in-memory backend
+        :param max_workers: Threads used for partition I/O
+        """
         self.num_partitions = num_partitions
-        self.partitions = [{} for _ in range(num_partitions)]
+        self.backends = backends or [MemoryPartitionBackend()]
+        self.layouts: Dict[str, PartitionLayout] = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="partition-io")
 
     def partition_tensor(self, tensor: Union[np.ndarray, torch.Tensor]) -> List[Union[np.ndarray, torch.Tensor]]:
-        if isinstance(tensor, torch.Tensor):
+        if is_tensor(tensor):
             tensor = tensor.cpu().numpy()
         return np.array_split(tensor, self.num_partitions)
 
     def store_partitioned(self, key: str, tensor: Union[np.ndarray, torch.Tensor]):
         partitions = self.partition_tensor(tensor)
-        for i, partition in enumerate(partitions):
-            self.partitions[i][key] = partition
+        boundaries = [0]
+        for partition in partitions:
+            boundaries.append(boundaries[-1] + len(partition))
+        previous = self.layouts.get(key)
+        layout = PartitionLayout(boundaries, partitions[0].dtype, (boundaries[-1],) + partitions[0].shape[1:],
+                                 previous.generation + 1 if previous is not None else 0)
+        list(self.executor.map(lambda item: self._backend(item[0]).put(self._name(key, item[0], layout), item[1]), enumerate(partitions)))
+        self.layouts[key] = layout
+        if previous is not None:
+            self._delete_partitions(key, previous)
 
     def retrieve_partitioned(self, key: str) -> Union[np.ndarray, torch.Tensor]:
-        partitions = [self.partitions[i][key] for i in range(self.num_partitions)]
-        return np.concatenate(partitions)
+        layout = self._layout(key)
+        return self.retrieve_rows(key, 0, layout.boundaries[-1])
+
+    def retrieve_rows(self, key: str, start: int, stop: int) -> np.ndarray:
+        """
+        Read rows [start, stop) touching only the partitions that overlap the range.
+        """
+        while True:
+            layout = self._layout(key)
+            try:
+                return self._read_rows(key, layout, start, stop)
+            except KeyError:
+                # Rewritten mid-read: the old generation is gone, read the new one
+                if self.layouts.get(key) is layout:
+                    raise
+
+    def _read_rows(self, key: str, layout: PartitionLayout, start: int, stop: int) -> np.ndarray:
+        start, stop, _ = slice(start, stop).indices(layout.boundaries[-1])
+        if start >= stop:
+            return np.empty((0,) + tuple(layout.shape[1:]), dtype=layout.dtype)
+        first = bisect.bisect_right(layout.boundaries, start) - 1
+        last = bisect.bisect_left(layout.boundaries, stop) - 1
+        reads = []
+        for index in range(first, last + 1):
+            offset = layout.boundaries[index]
+            local_start = max(start, offset) - offset
+            local_stop = min(stop, layout.boundaries[index + 1]) - offset
+            reads.append((index, local_start, local_stop))
+        parts = list(self.executor.map(
+            lambda read: self._backend(read[0]).get(self._name(key, read[0], layout), read[1], read[2]), reads))
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
 
     def update_partition(self, key: str, partition_index: int, new_data: Union[np.ndarray, torch.Tensor]):
-        self.partitions[partition_index][key] = new_data
+        """
+        Replace one partition's rows. Like a rewrite, the partition is stored under a new
+        generation and a new layout is published, so readers see the old or the new tensor.
+        """
+        if is_tensor(new_data):
+            new_data = new_data.cpu().numpy()
+        previous = self._layout(key)
+        delta = len(new_data) - (previous.boundaries[partition_index + 1] - previous.boundaries[partition_index])
+        boundaries = previous.boundaries[:partition_index + 1] + [row + delta for row in previous.boundaries[partition_index + 1:]]
+        generations = list(previous.generations)
+        generations[partition_index] = previous.generation + 1
+        layout = PartitionLayout(boundaries, previous.dtype, (boundaries[-1],) + tuple(previous.shape[1:]),
+                                 previous.generation + 1, generations)
+        self._backend(partition_index).put(self._name(key, partition_index, layout), new_data)
+        self.layouts[key] = layout
+        self._backend(partition_index).delete(self._name(key, partition_index, previous))
+
+    def delete_partitioned(self, key: str):
+        layout = self.layouts.pop(key, None)
+        if layout is not None:
+            self._delete_partitions(key, layout)
+
+    def _delete_partitions(self, key: str, layout: PartitionLayout):
+        for index in range(len(layout.boundaries) - 1):
+            self._backend(index).delete(self._name(key, index, layout))
+
+    def _layout(self, key: str) -> PartitionLayout:
+        layout = self.layouts.get(key)
+        if layout is None:
+            raise KeyError(f"No partitioned tensor for key: {key}")
+        return layout
+
+    def _backend(self, partition_index: int):
+        return self.backends[partition_index % len(self.backends)]
+
+    @staticmethod
+    def _name(key: str, partition_index: int, layout: PartitionLayout) -> str:
+        return f"{key}.g{layout.generations[partition_index]}.part{partition_index}"
+
 
 class AccessControl:
     def __init__(self):
@@ -54,16 +430,208 @@ class AccessControl:
     def check_permission(self, key: str, required_permission: str) -> bool:
         return self.permissions.get(key) == required_permission
 
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+class Reservation:
+    def __init__(self, allocator: "MemoryAllocator", key: str, size: int, tier: str):
+        self.allocator = allocator
+        self.key = key
+        self.size = size
+        self.tier = tier
+        self.active = True
+
+    def commit(self, size: Optional[int] = None):
+        """
+        Turn the reserved bytes into the key's allocation, replacing any previous one.
+
+        :param size: Bytes actually written when the reservation was an upper bound
+        """
+        self.allocator._commit(self, size)
+
+    def release(self):
+        self.allocator._cancel(self)
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.active:
+            self.release()
+
+
 class MemoryAllocator:
-    def __init__(self):
+    POLICIES = ("reject", "block", "evict")
+
+    def __init__(self, budget: Optional[int] = None, prefix_budgets: Optional[Dict[str, int]] = None, policy: str = "reject",
+                 block_timeout: float = 5.0, evictor=None, budget_tiers: Tuple[str, ...] = ("ram",)):
+        """
+        Accounting of bytes held per key, split by the tier holding them ("ram", "cache", "mmap"),
+        with a service-wide budget and per-key-prefix budgets enforced on the budget_tiers.
+
+        Writes reserve their size first; when a reservation would exceed a budget the policy
+        decides: "reject" raises MemoryBudgetExceeded, "block" waits up to block_timeout for
+        other keys to be freed, and "evict" asks evictor(bytes_needed, prefix) to free memory.
+
+        :param budget: Bytes the service may hold in budget_tiers; None means unlimited
+        :param prefix_budgets: Budgets for keys starting with each prefix
+        :param policy: Back-pressure policy, one of "reject", "block" or "evict"
+        :param block_timeout: Seconds to wait under the "block" policy
+        :param evictor: Callable(bytes_needed, prefix or None) -> bytes freed, used by "evict"
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown back-pressure policy: {policy}")
+        self.budget = budget
+        self.prefix_budgets = prefix_budgets or {}
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.evictor = evictor
+        self.budget_tiers = budget_tiers
         self.allocations = {}
+        self.tiers = {}
+        self.usage = {}
+        self.reserved = 0
+        self.prefix_usage = {prefix: 0 for prefix in self.prefix_budgets}
+        self.prefix_reserved = {prefix: 0 for prefix in self.prefix_budgets}
+        self.counters = {"rejections": 0, "evictions": 0, "blocked": 0}
+        self._condition = threading.Condition(threading.RLock())
 
-    def allocate(self, key: str, size: int):
-        self.allocations[key] = size
+    @staticmethod
+    def nbytes(value) -> int:
+        """
+        Payload size: nbytes for arrays and tensors, len() for bytes-like values.
+        """
+        if hasattr(value, "nbytes"):
+            return int(value.nbytes)
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        return len(value)
+
+    def reserve(self, key: str, size: int, tier: str = "ram") -> Reservation:
+        """
+        Hold size bytes for an upcoming write of key, applying back-pressure if a budget
+        would be exceeded. Bytes already allocated to key count as available.
+
+        :raises MemoryBudgetExceeded: under "reject", or when blocking/eviction could not make room
+        """
+        deadline = time.monotonic() + self.block_timeout
+        evicted = False
+        while True:
+            with self._condition:
+                shortfall, prefix = self._shortfall(key, size, tier)
+                if shortfall <= 0:
+                    return self._hold(key, size, tier)
+                if self.policy == "block":
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        self.counters["blocked"] += 1
+                        self._condition.wait(remaining)
+                        continue
+                if self.policy != "evict" or evicted or self.evictor is None:
+                    self.counters["rejections"] += 1
+                    raise MemoryBudgetExceeded(f"Reserving {size} bytes for {key} exceeds the {prefix or 'service'} budget by {shortfall} bytes")
+            # Evict outside the lock: the evictor frees memory through deallocate()
+            self.counters["evictions"] += 1
+            self.evictor(shortfall, prefix)
+            evicted = True
+
+    def allocate(self, key: str, size: int, tier: str = "ram"):
+        self.reserve(key, size, tier).commit()
 
     def deallocate(self, key: str):
-        if key in self.allocations:
-            del self.allocations[key]
+        with self._condition:
+            self._release(key)
+            self._condition.notify_all()
 
     def get_allocation(self, key: str) -> int:
-        return self.allocations.get(key, 0)
\ No newline at end of file
+        return self.allocations.get(key, 0)
+
+    def get_tier(self, key: str) -> Optional[str]:
+        return self.tiers.get(key)
+
+    def get_usage(self, tier: Optional[str] = None) -> int:
+        if tier is None:
+            return sum(self.usage.values())
+        return self.usage.get(tier, 0)
+
+    def keys_in(self, tier: str) -> List[str]:
+        with self._condition:
+            return [key for key, key_tier in self.tiers.items() if key_tier == tier]
+
+    def get_metrics(self) -> Dict[str, object]:
+        with self._condition:
+            return {
+                "budget": self.budget,
+                "used": self._budgeted_usage(),
+                "reserved": self.reserved,
+                "by_tier": dict(self.usage),
+                "by_prefix": {prefix: {"used": self.prefix_usage[prefix], "reserved": self.prefix_reserved[prefix],
+                                       "budget": budget} for prefix, budget in self.prefix_budgets.items()},
+                **self.counters,
+            }
+
+    def _prefixes(self, key: str) -> List[str]:
+        return [prefix for prefix in self.prefix_budgets if key.startswith(prefix)]
+
+    def _budgeted_usage(self) -> int:
+        return sum(self.usage.get(tier, 0) for tier in self.budget_tiers)
+
+    def _shortfall(self, key: str, size: int, tier: str) -> Tuple[int, Optional[str]]:
+        if tier not in self.budget_tiers:
+            return 0, None
+        freed = self.allocations.get(key, 0) if self.tiers.get(key) in self.budget_tiers else 0
+        if self.budget is not None:
+            shortfall = self._budgeted_usage() + self.reserved + size - freed - self.budget
+            if shortfall > 0:
+                return shortfall, None
+        for prefix in self._prefixes(key):
+            shortfall = self.prefix_usage[prefix] + self.prefix_reserved[prefix] + size - freed - self.prefix_budgets[prefix]
+            if shortfall > 0:
+                return shortfall, prefix
+        return 0, None
+
+    def _hold(self, key: str, size: int, tier: str) -> Reservation:
+        if tier in self.budget_tiers:
+            self.reserved += size
+            for prefix in self._prefixes(key):
+                self.prefix_reserved[prefix] += size
+        return Reservation(self, key, size, tier)
+
+    def _unhold(self, reservation: Reservation):
+        reservation.active = False
+        if reservation.tier in self.budget_tiers:
+            self.reserved -= reservation.size
+            for prefix in self._prefixes(reservation.key):
+                self.prefix_reserved[prefix] -= reservation.size
+
+    def _commit(self, reservation: Reservation, size: Optional[int] = None):
+        with self._condition:
+            if not reservation.active:
+                raise ValueError(f"Reservation for {reservation.key} is no longer active")
+            self._unhold(reservation)
+            self._release(reservation.key)
+            key, tier = reservation.key, reservation.tier
+            size = reservation.size if size is None else size
+            self.allocations[key] = size
+            self.tiers[key] = tier
+            self.usage[tier] = self.usage.get(tier, 0) + size
+            if tier in self.budget_tiers:
+                for prefix in self._prefixes(key):
+                    self.prefix_usage[prefix] += size
+            self._condition.notify_all()
+
+    def _cancel(self, reservation: Reservation):
+        with self._condition:
+            if reservation.active:
+                self._unhold(reservation)
+                self._condition.notify_all()
+
+    def _release(self, key: str):
+        size = self.allocations.pop(key, None)
+        if size is not None:
+            tier = self.tiers.pop(key)
+            self.usage[tier] -= size
+            if tier in self.budget_tiers:
+                for prefix in self._prefixes(key):
+                    self.prefix_usage[prefix] -= size
@@ -1,6 +1,65 @@
+from __future__ import annotations
+
+import struct
 import numpy as np
-import torch
-from typing import Union
+from typing import TYPE_CHECKING, Optional, Union
+
+from synapse.memory_manager.torch_compat import get_torch, is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+# Quantized payloads: magic, mode id, original dtype, then the value and scale buffers
+# (both compressed by the caller's CompressionService).
+QUANT_MAGIC = b"SQ"
+QUANT_MODES = {"float16": 1, "bfloat16": 2, "int8": 3}
+QUANT_MODE_NAMES = {mode_id: name for name, mode_id in QUANT_MODES.items()}
+
+
+class QuantizedArray:
+    def __init__(self, mode: str, values: np.ndarray, dtype: np.dtype, scales: Optional[np.ndarray] = None):
+        """
+        A vector or matrix stored in a reduced-precision form.
+
+        :param mode: "float16", "bfloat16" (kept as the upper 16 bits of float32) or "int8"
+        :param values: The quantized values, same shape as the original
+        :param dtype: dtype of the original array, restored by dequantize()
+        :param scales: Per-row scale factors for int8, shape (rows,)
+        """
+        self.mode = mode
+        self.values = values
+        self.dtype = np.dtype(dtype)
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dequantize(self) -> np.ndarray:
+        if self.mode == "float16":
+            return self.values.astype(self.dtype)
+        if self.mode == "bfloat16":
+            return (self.values.astype(np.uint32) << 16).view(np.float32).astype(self.dtype)
+        values = self.values.astype(np.float32)
+        scales = self.scales.astype(np.float32)
+        if values.ndim > 1:
+            scales = scales.reshape((-1,) + (1,) * (values.ndim - 1))
+        return (values * scales).astype(self.dtype)
+
+    def dot(self, query: np.ndarray) -> Union[np.ndarray, float]:
+        """
+        Dot product of each row with query, computed on the quantized values and rescaled,
+        so int8 data never has to be fully dequantized for similarity search.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.mode != "int8":
+            return self.dequantize().astype(np.float32) @ query
+        return (self.values.astype(np.float32) @ query) * (self.scales if self.values.ndim > 1 else self.scales[0])
+
 
 class DataTypeManager:
     def __init__(self):
@@ -11,17 +70,69 @@ class DataTypeManager:
             'int64': np.int64,
             'float16': np.float16
         }
-    
+
     def get_numpy_dtype(self, dtype_str: str):
         return self.dtype_map.get(dtype_str, np.float32)
-    
+
     def get_torch_dtype(self, dtype_str:str):
-        return getattr(torch, dtype_str)
-    
+        return getattr(get_torch(), dtype_str)
+
     def convert_dtype(self, data: Union[np.ndarray, torch.Tensor], dtype_str: str):
         if isinstance(data, np.ndarray):
             return data.astype(self.get_numpy_dtype(dtype_str))
-        elif isinstance(data, torch.Tensor):
+        elif is_tensor(data):
             return data.to(self.get_torch_dtype(dtype_str))
         else:
-            raise ValueError("Unsupported data type")
\ No newline at end of file
+            raise ValueError("Unsupported data type")
+
+    def quantize(self, data: Union[np.ndarray, torch.Tensor], mode: str) -> QuantizedArray:
+        """
+        :param mode: "float16", "bfloat16" or "int8" (symmetric, one scale per row)
+        """
+        if is_tensor(data):
+            data = data.cpu().numpy()
+        if mode not in QUANT_MODES:
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+        if not np.issubdtype(data.dtype, np.floating):
+            raise ValueError("Only floating point arrays can be quantized")
+        if mode == "float16":
+            return QuantizedArray(mode, data.astype(np.float16), data.dtype)
+        if mode == "bfloat16":
+            bits = np.ascontiguousarray(data, dtype=np.float32).view(np.uint32)
+            # Round to nearest even on the dropped 16 bits
+            rounded = (bits + 0x7FFF + ((bits >> 16) & 1)) >> 16
+            return QuantizedArray(mode, rounded.astype(np.uint16), data.dtype)
+        rows = data.reshape(len(data), -1) if data.ndim > 1 else data.reshape(1, -1)
+        scales = np.abs(rows).max(axis=1).astype(np.float32) / 127 if rows.size else np.ones(len(rows), np.float32)
+        scales[scales == 0] = 1
+        values = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8).reshape(data.shape)
+        return QuantizedArray(mode, values, data.dtype, scales)
+
+    def dequantize(self, quantized: QuantizedArray) -> np.ndarray:
+        return quantized.dequantize()
+
+    def pack_quantized(self, quantized: QuantizedArray, compression_service) -> bytes:
+        """
+        Serialize a quantized array; the value and scale buffers go through compression_service.
+        """
+        dtype = quantized.dtype.str.encode("ascii")
+        values = compression_service.compress(quantized.values)
+        scales = compression_service.compress(quantized.scales) if quantized.scales is not None else b""
+        return (struct.pack(f"<2sBB{len(dtype)}sQ", QUANT_MAGIC, QUANT_MODES[quantized.mode], len(dtype), dtype, len(values))
+                + values + scales)
+
+    def unpack_quantized(self, payload: bytes, compression_service) -> QuantizedArray:
+        _, mode_id, dtype_len = struct.unpack_from("<2sBB", payload)
+        offset = 4
+        dtype = payload[offset:offset + dtype_len].decode("ascii")
+        offset += dtype_len
+        (values_len,) = struct.unpack_from("<Q", payload, offset)
+        offset += 8
+        values = compression_service.decompress(payload[offset:offset + values_len])
+        scales_payload = payload[offset + values_len:]
+        scales = compression_service.decompress(scales_payload) if scales_payload else None
+        return QuantizedArray(QUANT_MODE_NAMES[mode_id], values, dtype, scales)
+
+    @staticmethod
+    def is_quantized(payload: bytes) -> bool:
+        return payload[:2] == QUANT_MAGIC
@@ -0,0 +1,413 @@
+from __future__ import annotations
+
+import abc
+import ctypes
+import ctypes.util
+import mmap
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+
+from synapse.memory_manager.torch_compat import get_torch, is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+ALIGNMENT = 64
+NUMA_ROOT = "/sys/devices/system/node"
+
+
+def numa_nodes() -> List[int]:
+    """
+    :return: Online NUMA node ids, or [] where the kernel does not expose them
+    """
+    try:
+        with open(os.path.join(NUMA_ROOT, "online")) as file:
+            return _parse_cpulist(file.read())
+    except OSError:
+        return []
+
+
+def _node_cpus(node: int) -> List[int]:
+    try:
+        with open(os.path.join(NUMA_ROOT, f"node{node}", "cpulist")) as file:
+            return _parse_cpulist(file.read())
+    except OSError:
+        return []
+
+
+def _parse_cpulist(text: str) -> List[int]:
+    ids = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+
+def _mlock(buffer: mmap.mmap) -> bool:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    address = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+    return libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(len(buffer))) == 0
+
+
+class Arena:
+    def __init__(self, size: int, numa_node: Optional[int] = None, pinned: bool = False):
+        """
+        A fixed block of anonymous memory that arrays are carved out of, first-fit with
+        coalescing free ranges, so storing a key never goes through the general allocator.
+
+        :param numa_node: Fault the pages in from a CPU of this node so the kernel's
+                          first-touch policy places them there
+        :param pinned: mlock the arena so it is never swapped out; falls back to unpinned
+                       when RLIMIT_MEMLOCK forbids it (check .pinned)
+        """
+        self.size = size
+        self.buffer = mmap.mmap(-1, size)
+        self.free: List[Tuple[int, int]] = [(0, size)]
+        self.numa_node = numa_node
+        if numa_node is not None:
+            self._first_touch(numa_node)
+        self.pinned = pinned and _mlock(self.buffer)
+
+    def alloc(self, nbytes: int) -> Optional[int]:
+        """
+        :return: Offset of a block of at least nbytes, or None if no free range is large enough
+        """
+        nbytes = self._aligned(nbytes)
+        for index, (offset, length) in enumerate(self.free):
+            if length >= nbytes:
+                if length == nbytes:
+                    del self.free[index]
+                else:
+                    self.free[index] = (offset + nbytes, length - nbytes)
+                return offset
+        return None
+
+    def release(self, offset: int, nbytes: int):
+        nbytes = self._aligned(nbytes)
+        index = 0
+        while index < len(self.free) and self.free[index][0] < offset:
+            index += 1
+        self.free.insert(index, (offset, nbytes))
+        # Merge with the following and then the preceding range when adjacent
+        if index + 1 < len(self.free) and offset + nbytes == self.free[index + 1][0]:
+            self.free[index] = (offset, nbytes + self.free.pop(index + 1)[1])
+        if index > 0 and self.free[index - 1][0] + self.free[index - 1][1] == offset:
+            previous_offset, previous_length = self.free[index - 1]
+            self.free[index - 1] = (previous_offset, previous_length + self.free.pop(index)[1])
+
+    def free_bytes(self) -> int:
+        return sum(length for _, length in self.free)
+
+    @staticmethod
+    def _aligned(nbytes: int) -> int:
+        return max(ALIGNMENT, -(-nbytes // ALIGNMENT) * ALIGNMENT)
+
+    def _first_touch(self, node: int):
+        cpus = _node_cpus(node)
+        if not cpus or not hasattr(os, "sched_setaffinity"):
+            return
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        try:
+            np.frombuffer(self.buffer, dtype=np.uint8)[::mmap.PAGESIZE] = 0
+        finally:
+            os.sched_setaffinity(0, previous)
+
+
+class Device(abc.ABC):
+    kind = "device"
+
+    def __init__(self, index: int, capacity: int):
+        """
+        One memory domain of a DevicePool. Keeps an LRU of the keys placed on it and evicts
+        the least recently used ones when a new value does not fit. Backends implement
+        _copy_in and may override _release, _nbytes, read, pin and unpin.
+
+        :param capacity: Bytes this device may hold
+        """
+        self.index = index
+        self.capacity = capacity
+        self.used = 0
+        self.evictions = 0
+        self.entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+
+    def put(self, key: str, data) -> List[str]:
+        """
+        :return: Keys evicted to make room
+        :raises MemoryError: if data is larger than the device
+        """
+        size = self._nbytes(data)
+        if size > self.capacity:
+            raise MemoryError(f"{size} bytes do not fit {self.kind}:{self.index} ({self.capacity} bytes)")
+        self.remove(key)
+        evicted = []
+        while self.used + size > self.capacity:
+            evicted.append(self._evict_one())
+        stored = self._copy_in(data)
+        while stored is None:
+            # Enough bytes are free but fragmented; keep evicting until a block fits
+            if not self.entries:
+                raise MemoryError(f"No contiguous block of {size} bytes on {self.kind}:{self.index}")
+            evicted.append(self._evict_one())
+            stored = self._copy_in(data)
+        self.entries[key] = stored
+        self.sizes[key] = size
+        self.used += size
+        return evicted
+
+    def get(self, key: str):
+        stored = self.entries[key]
+        self.entries.move_to_end(key)
+        return stored
+
+    def read(self, key: str):
+        """
+        :return: key's value, safe to keep after the key is evicted
+        """
+        return self.get(key)
+
+    def pin(self, key: str):
+        """
+        :return: key's stored value, which stays valid until unpin(value) even if key is evicted
+        """
+        return self.get(key)
+
+    def unpin(self, stored):
+        pass
+
+    def remove(self, key: str) -> bool:
+        stored = self.entries.pop(key, None)
+        if stored is None:
+            return False
+        self.used -= self.sizes.pop(key)
+        self._release(stored)
+        return True
+
+    def clear(self):
+        for key in list(self.entries):
+            self.remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "capacity": self.capacity, "used": self.used,
+                "keys": len(self.entries), "evictions": self.evictions}
+
+    def _evict_one(self) -> str:
+        key = next(iter(self.entries))
+        self.remove(key)
+        self.evictions += 1
+        return key
+
+    @abc.abstractmethod
+    def _copy_in(self, data):
+        """
+        :return: The stored value, or None when there is no room for it
+        """
+
+    def _release(self, stored):
+        pass
+
+    def _nbytes(self, data) -> int:
+        return data.nbytes if not is_tensor(data) else data.element_size() * data.nelement()
+
+
+class CPUDevice(Device):
+    kind = "cpu"
+
+    def __init__(self, index: int, capacity: int, numa_node: Optional[int] = None, pinned: bool = False):
+        """
+        Host memory device backed by one Arena. read() returns a copy; pinned values are
+        read-only views into the arena, and an evicted block is only reused once every pin
+        on it has been released.
+        """
+        super().__init__(index, capacity)
+        self.arena = Arena(capacity, numa_node=numa_node, pinned=pinned)
+        self._base_address = np.frombuffer(self.arena.buffer, dtype=np.uint8).ctypes.data
+        # Block offset -> number of pins held on it
+        self.pins: Dict[int, int] = {}
+        # Evicted blocks still pinned: offset -> nbytes
+        self.pending: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(numa_node=self.arena.numa_node, pinned=self.arena.pinned,
+                     free_bytes=self.arena.free_bytes(), pending_blocks=len(self.pending))
+        return stats
+
+    def _copy_in(self, data) -> Optional[np.ndarray]:
+        if is_tensor(data):
+            data = data.cpu().numpy()
+        data = np.asarray(data)
+        if data.dtype.hasobject:
+            raise TypeError("Object arrays cannot be placed in an arena")
+        with self._lock:
+            offset = self.arena.alloc(data.nbytes)
+        if offset is None:
+            return None
+        array = np.frombuffer(self.arena.buffer, dtype=data.dtype, count=data.size, offset=offset).reshape(data.shape)
+        array[...] = data
+        array.flags.writeable = False
+        return array
+
+    def read(self, key: str) -> np.ndarray:
+        return self.get(key).copy()
+
+    def pin(self, key: str) -> np.ndarray:
+        stored = self.get(key)
+        offset = self._offset(stored)
+        with self._lock:
+            self.pins[offset] = self.pins.get(offset, 0) + 1
+        return stored
+
+    def unpin(self, stored: np.ndarray):
+        offset = self._offset(stored)
+        with self._lock:
+            count = self.pins[offset] - 1
+            if count:
+                self.pins[offset] = count
+                return
+            del self.pins[offset]
+            nbytes = self.pending.pop(offset, None)
+            if nbytes is not None:
+                self.arena.release(offset, nbytes)
+
+    def _release(self, stored: np.ndarray):
+        offset = self._offset(stored)
+        with self._lock:
+            if offset in self.pins:
+                self.pending[offset] = stored.nbytes
+            else:
+                self.arena.release(offset, stored.nbytes)
+
+    def _offset(self, stored: np.ndarray) -> int:
+        return stored.ctypes.data - self._base_address
+
+
+class TorchDevice(Device):
+    kind = "torch"
+
+    def __init__(self, index: int, capacity: int, device: str):
+        """
+        Device managed by torch, e.g. "cuda:0". torch is imported when the device is created.
+        """
+        super().__init__(index, capacity)
+        self.device = get_torch().device(device)
+        self.kind = self.device.type
+
+    def _copy_in(self, data) -> "torch.Tensor":
+        torch = get_torch()
+        tensor = data if is_tensor(data) else torch.from_numpy(np.ascontiguousarray(data))
+        return tensor.to(self.device)
+
+
+class DevicePool:
+    def __init__(self, devices: List[Device], on_evict: Optional[Callable[[str], None]] = None):
+        """
+        Places keys on devices and tracks where each one lives. Values go to the requested
+        device or, by default, the one with the most free capacity; each device evicts its
+        own least recently used keys when full.
+
+        :param on_evict: Called with each evicted key, e.g. to fall back to another store
+        """
+        self.devices = devices
+        self.on_evict = on_evict
+        self.placement: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def cpu(cls, capacity: int, pinned: bool = False, numa: bool = True, **kwargs) -> "DevicePool":
+        """
+        One CPU device per NUMA node, splitting capacity evenly; a single device when the
+        host has no NUMA information or numa is False.
+        """
+        nodes = numa_nodes() if numa else []
+        if len(nodes) <= 1:
+            return cls([CPUDevice(0, capacity, numa_node=nodes[0] if nodes else None, pinned=pinned)], **kwargs)
+        share = capacity // len(nodes)
+        return cls([CPUDevice(index, share, numa_node=node, pinned=pinned) for index, node in enumerate(nodes)], **kwargs)
+
+    def store(self, key: str, data: Union[np.ndarray, torch.Tensor], device_index: Optional[int] = None) -> int:
+        """
+        :return: Index of the device the value was placed on
+        """
+        error = None
+        with self._lock:
+            if device_index is None:
+                device_index = max(range(len(self.devices)), key=lambda index: self.devices[index].capacity - self.devices[index].used)
+            device = self.devices[device_index]
+            previous = self.placement.get(key)
+            try:
+                evicted = device.put(key, data)
+            except MemoryError as e:
+                # put may have evicted keys, including key's old value, before giving up
+                error = e
+                evicted = [placed for placed, index in self.placement.items() if index == device_index and placed not in device.entries]
+            else:
+                if previous is not None and previous != device_index:
+                    self.devices[previous].remove(key)
+                self.placement[key] = device_index
+            for evicted_key in evicted:
+                self.placement.pop(evicted_key, None)
+        for evicted_key in evicted:
+            if self.on_evict is not None:
+                self.on_evict(evicted_key)
+        if error is not None:
+            raise error
+        return device_index
+
+    def retrieve(self, key: str, device_index: Optional[int] = None):
+        """
+        :return: key's value; CPU devices return a copy (use lease() to read in place)
+        :raises KeyError: if key is not placed (on device_index, when given)
+        """
+        with self._lock:
+            return self.devices[self._placed(key, device_index)].read(key)
+
+    @contextmanager
+    def lease(self, key: str, device_index: Optional[int] = None):
+        """
+        Read key's value in place. Its memory is not reused while the block is open, even
+        if key is evicted or overwritten meanwhile; do not keep the value after it exits.
+
+        :raises KeyError: if key is not placed (on device_index, when given)
+        """
+        with self._lock:
+            device = self.devices[self._placed(key, device_index)]
+            stored = device.pin(key)
+        try:
+            yield stored
+        finally:
+            device.unpin(stored)
+
+    def _placed(self, key: str, device_index: Optional[int]) -> int:
+        placed = self.placement.get(key)
+        if placed is None or (device_index is not None and placed != device_index):
+            raise KeyError(f"No device data for key: {key}")
+        return placed
+
+    def device_of(self, key: str) -> Optional[int]:
+        return self.placement.get(key)
+
+    def evict(self, key: str) -> bool:
+        with self._lock:
+            device_index = self.placement.pop(key, None)
+            return device_index is not None and self.devices[device_index].remove(key)
+
+    def clear(self, device_index: Optional[int] = None):
+        with self._lock:
+            indexes = range(len(self.devices)) if device_index is None else [device_index]
+            for index in indexes:
+                for key in list(self.devices[index].entries):
+                    self.placement.pop(key, None)
+                self.devices[index].clear()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [device.stats() for device in self.devices]
@@ -1,24 +1,225 @@
 import numpy as np
 import os
+import struct
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+# Fixed-size header at the start of every file; data starts at the next page boundary
+# so it can be mapped directly. flags bit 0 marks the data checksum as current.
+MAGIC = b"SYMM"
+FORMAT_VERSION = 1
+MAX_DIMS = 8
+HEADER = struct.Struct(f"<4sHH16sB7x{MAX_DIMS}Q{MAX_DIMS}qQI")
+HEADER_CRC = struct.Struct("<I")
+DATA_OFFSET = 4096
+FLAG_CHECKSUM_VALID = 1
+
+
+class MmapHeader:
+    def __init__(self, dtype: np.dtype, shape: Tuple[int, ...], strides: Tuple[int, ...], data_version: int = 0,
+                 data_crc: int = 0, flags: int = FLAG_CHECKSUM_VALID):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.strides = tuple(strides)
+        self.data_version = data_version
+        self.data_crc = data_crc
+        self.flags = flags
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    @property
+    def checksum_valid(self) -> bool:
+        return bool(self.flags & FLAG_CHECKSUM_VALID)
+
+    def pack(self) -> bytes:
+        ndim = len(self.shape)
+        if ndim > MAX_DIMS:
+            raise ValueError(f"Arrays with more than {MAX_DIMS} dimensions are not supported")
+        padding = MAX_DIMS - ndim
+        body = HEADER.pack(MAGIC, FORMAT_VERSION, self.flags, self.dtype.str.encode("ascii"), ndim,
+                           *self.shape, *([0] * padding), *self.strides, *([0] * padding),
+                           self.data_version, self.data_crc)
+        return body + HEADER_CRC.pack(zlib.crc32(body))
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> "MmapHeader":
+        body = raw[:HEADER.size]
+        fields = HEADER.unpack(body)
+        (header_crc,) = HEADER_CRC.unpack_from(raw, HEADER.size)
+        if fields[0] != MAGIC:
+            raise ValueError("Not a synapse mmap file")
+        if fields[1] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported mmap format version: {fields[1]}")
+        if zlib.crc32(body) != header_crc:
+            raise ValueError("Corrupted mmap header")
+        ndim = fields[4]
+        shape = fields[5:5 + ndim]
+        strides = fields[5 + MAX_DIMS:5 + MAX_DIMS + ndim]
+        dtype = fields[3].rstrip(b"\0").decode("ascii")
+        return cls(dtype, shape, strides, data_version=fields[-2], data_crc=fields[-1], flags=fields[2])
+
 
 class MemoryMappedFileManager:
     def __init__(self, directory: str):
+        """
+        Stores arrays in memory-mapped files with a self-describing header (dtype, shape,
+        strides, data version and checksum). Read-only maps are cached per key and
+        reopened only when the file changes on disk.
+        """
         self.directory = directory
         os.makedirs(directory, exist_ok=True)
+        self._handles: Dict[str, Tuple[Tuple[int, int, int], np.memmap]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mmap")
 
     def store_mmap(self, key: str, data: np.ndarray):
-        filename = os.path.join(self.directory, f"{key}.mmap")
-        mmap_file = np.memmap(filename, dtype=data.dtype, mode='w+', shape=data.shape)
-        mmap_file[:] = data[:]
-        mmap_file.flush()
+        data = np.ascontiguousarray(data)
+        filename = self._path(key)
+        header = MmapHeader(data.dtype, data.shape, data.strides, data_crc=zlib.crc32(memoryview(data).cast("B")) if data.size else 0)
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(header.pack())
+            f.truncate(DATA_OFFSET + header.nbytes)
+        if data.size:
+            mmap_file = np.memmap(tmp_filename, dtype=data.dtype, mode='r+', offset=DATA_OFFSET, shape=data.shape)
+            mmap_file[:] = data[:]
+            mmap_file.flush()
+            del mmap_file
+        os.replace(tmp_filename, filename)
+        self._invalidate(key)
 
     def retrieve_mmap(self, key: str) -> np.memmap:
-        filename = os.path.join(self.directory, f"{key}.mmap")
-        mmap_file = np.memmap(filename, dtype=np.float32, mode='r')
+        """
+        :return: A read-only map of the stored array with its original dtype and shape
+        """
+        filename = self._path(key)
+        stat = os.stat(filename)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            cached = self._handles.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        header = self.read_header(key)
+        if header is None:
+            mmap_file = np.memmap(filename, dtype=np.float32, mode='r')
+        else:
+            mmap_file = self._open(filename, header, mode='r')
+        with self._lock:
+            self._handles[key] = (stamp, mmap_file)
         return mmap_file
 
-    def update_mmap(self, key: str, new_data: np.ndarray):
-        filename = os.path.join(self.directory, f"{key}.mmap")
-        mmap_file = np.memmap(filename, dtype=new_data.dtype, mode='r+', shape=new_data.shape)
-        mmap_file[:] = new_data[:]
-        mmap_file.flush()
\ No newline at end of file
+    def read_header(self, key: str) -> Optional[MmapHeader]:
+        """
+        :return: The file header, or None for legacy headerless files
+        """
+        with open(self._path(key), "rb") as f:
+            raw = f.read(HEADER.size + HEADER_CRC.size)
+        if not raw.startswith(MAGIC):
+            return None
+        return MmapHeader.unpack(raw)
+
+    def update_mmap(self, key: str, new_data: np.ndarray, start_row: Optional[int] = None):
+        """
+        Overwrite data in place. With start_row, only rows [start_row, start_row + len(new_data))
+        are written; otherwise new_data replaces the whole array, rewriting the file only if
+        its dtype or shape changed.
+        """
+        if start_row is not None:
+            return self.update_rows(key, start_row, new_data)
+        header = self.read_header(key)
+        if header is None or header.dtype != new_data.dtype or header.shape != new_data.shape:
+            return self.store_mmap(key, new_data)
+        return self.update_rows(key, 0, new_data)
+
+    def update_rows(self, key: str, start_row: int, rows: np.ndarray):
+        """
+        Write rows into [start_row, start_row + len(rows)) without touching the rest of the file.
+        The data checksum is marked stale; verify() recomputes it.
+        """
+        filename = self._path(key)
+        header = self._require_header(key)
+        rows = np.asarray(rows, dtype=header.dtype)
+        if rows.shape[1:] != header.shape[1:]:
+            raise ValueError(f"Row shape {rows.shape[1:]} does not match stored shape {header.shape[1:]}")
+        if start_row < 0 or start_row + len(rows) > header.shape[0]:
+            raise IndexError(f"Rows {start_row}:{start_row + len(rows)} out of range for {header.shape[0]} rows")
+        mmap_file = self._open(filename, header, mode='r+')
+        mmap_file[start_row:start_row + len(rows)] = rows
+        mmap_file.flush()
+        del mmap_file
+        header.data_version += 1
+        header.flags &= ~FLAG_CHECKSUM_VALID
+        self._write_header(filename, header)
+        self._invalidate(key)
+
+    def append_rows(self, key: str, rows: np.ndarray):
+        """
+        Grow the array along its first axis, writing only the new rows. The data checksum is
+        extended incrementally when it is current.
+        """
+        filename = self._path(key)
+        header = self._require_header(key)
+        rows = np.ascontiguousarray(rows, dtype=header.dtype)
+        if rows.shape[1:] != header.shape[1:]:
+            raise ValueError(f"Row shape {rows.shape[1:]} does not match stored shape {header.shape[1:]}")
+        with open(filename, "r+b") as f:
+            f.seek(DATA_OFFSET + header.nbytes)
+            f.write(memoryview(rows).cast("B") if rows.size else b"")
+        if header.checksum_valid and rows.size:
+            header.data_crc = zlib.crc32(memoryview(rows).cast("B"), header.data_crc)
+        header.shape = (header.shape[0] + len(rows),) + header.shape[1:]
+        header.data_version += 1
+        self._write_header(filename, header)
+        self._invalidate(key)
+
+    def verify(self, key: str, repair: bool = True) -> bool:
+        """
+        Check the data against the header checksum. A stale checksum (after partial
+        updates) is recomputed and written back when repair is set.
+        """
+        filename = self._path(key)
+        header = self._require_header(key)
+        data = self._open(filename, header, mode='r')
+        crc = zlib.crc32(memoryview(np.ascontiguousarray(data)).cast("B")) if header.nbytes else 0
+        if header.checksum_valid:
+            return crc == header.data_crc
+        if repair:
+            header.data_crc = crc
+            header.flags |= FLAG_CHECKSUM_VALID
+            self._write_header(filename, header)
+            self._invalidate(key)
+        return True
+
+    def delete_mmap(self, key: str):
+        self._invalidate(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _open(self, filename: str, header: MmapHeader, mode: str) -> np.ndarray:
+        if not header.nbytes:
+            return np.empty(header.shape, dtype=header.dtype)
+        mmap_file = np.memmap(filename, dtype=header.dtype, mode=mode, offset=DATA_OFFSET, shape=header.shape)
+        if mmap_file.strides != header.strides:
+            mmap_file = np.lib.stride_tricks.as_strided(mmap_file, shape=header.shape, strides=header.strides)
+        return mmap_file
+
+    def _require_header(self, key: str) -> MmapHeader:
+        header = self.read_header(key)
+        if header is None:
+            raise ValueError(f"mmap file for key {key} has no header; store it again with store_mmap")
+        return header
+
+    def _write_header(self, filename: str, header: MmapHeader):
+        with open(filename, "r+b") as f:
+            f.write(header.pack())
+
+    def _invalidate(self, key: str):
+        with self._lock:
+            self._handles.pop(key, None)
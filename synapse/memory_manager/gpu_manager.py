@@ -1,24 +1,37 @@
-import torch
-from typing import List
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional
+
+from synapse.memory_manager.device_pool import DevicePool, TorchDevice
+from synapse.memory_manager.torch_compat import get_torch
+
+if TYPE_CHECKING:
+    import torch
 
 class GPUMemoryManager:
-    def __init__(self, device_ids: List[int]):
-        self.devices = [torch.device(f'cuda:{i}') for i in device_ids]
-        self.gpu_storage = {device: {} for device in self.devices}
+    def __init__(self, device_ids: List[int], capacity_per_device: Optional[int] = None):
+        """
+        CUDA devices as a DevicePool; torch is only imported when this is constructed.
+
+        :param capacity_per_device: Bytes to use per device (defaults to each device's total memory)
+        """
+        torch = get_torch()
+        devices = []
+        for index, device_id in enumerate(device_ids):
+            capacity = capacity_per_device or torch.cuda.get_device_properties(device_id).total_memory
+            devices.append(TorchDevice(index, capacity, f'cuda:{device_id}'))
+        self.pool = DevicePool(devices)
+        self.devices = [device.device for device in devices]
 
     def store_on_gpu(self, key: str, tensor: torch.Tensor, device_index: int):
-        device = self.devices[device_index]
-        self.gpu_storage[device][key] = tensor.to(device)
+        self.pool.store(key, tensor, device_index)
 
     def retrieve_from_gpu(self, key: str, device_index: int) -> torch.Tensor:
-        device = self.devices[device_index]
-        return self.gpu_storage[device][key]
+        return self.pool.retrieve(key, device_index)
 
     def update_on_gpu(self, key: str, new_tensor: torch.Tensor, device_index: int):
-        device = self.devices[device_index]
-        self.gpu_storage[device][key] = new_tensor.to(device)
+        self.pool.store(key, new_tensor, device_index)
 
     def clear_gpu_memory(self, device_index: int):
-        device = self.devices[device_index]
-        self.gpu_storage[device].clear()
-        torch.cuda.empty_cache()
\ No newline at end of file
+        self.pool.clear(device_index)
+        get_torch().cuda.empty_cache()
@@ -0,0 +1,261 @@
+import atexit
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from synapse.memory_manager.control import VersionRecord
+
+# Record: crc32 of (op, key, payload), payload length, op, key length; then key and payload
+RECORD = struct.Struct("<IIBH")
+OP_TEXT = 1
+OP_VECTOR = 2
+OP_METADATA = 3
+OP_OBJECT = 4
+OP_VERSIONS = 5
+OP_DELETE = 6
+
+SNAPSHOT_MAGIC = b"SYSN"
+SNAPSHOT_VERSION = 1
+# Magic, format version, first journal segment not covered by the snapshot
+SNAPSHOT_HEADER = struct.Struct("<4sBQ")
+SNAPSHOT_NAME = "snapshot.bin"
+SEGMENT_PATTERN = re.compile(r"journal\.(\d+)\.log$")
+
+# Object: refcount, chain depth, base digest length; then base digest and data
+OBJECT_HEADER = struct.Struct("<IIB")
+# Version entry: version, created_at, size, digest (empty when the version holds no content)
+VERSION_ENTRY = struct.Struct("<Qdq40s")
+
+
+def pack_record(op: int, key: str, payload: bytes) -> bytes:
+    encoded_key = key.encode("utf-8")
+    crc = zlib.crc32(payload, zlib.crc32(encoded_key, zlib.crc32(bytes((op,)))))
+    return RECORD.pack(crc, len(payload), op, len(encoded_key)) + encoded_key + payload
+
+
+def iter_records(buffer, offset: int = 0) -> Iterator[Tuple[int, str, bytes, int]]:
+    """
+    :return: (op, key, payload, end offset) per intact record; stops at the first torn
+             or corrupt record, so the last end offset is where valid data ends
+    """
+    size = len(buffer)
+    while offset + RECORD.size <= size:
+        crc, length, op, key_length = RECORD.unpack_from(buffer, offset)
+        start = offset + RECORD.size
+        end = start + key_length + length
+        if end > size:
+            return
+        encoded_key = bytes(buffer[start:start + key_length])
+        payload = bytes(buffer[start + key_length:end])
+        if zlib.crc32(payload, zlib.crc32(encoded_key, zlib.crc32(bytes((op,))))) != crc:
+            return
+        yield op, encoded_key.decode("utf-8"), payload, end
+        offset = end
+
+
+def pack_object(refcount: int, obj: Tuple[Optional[str], bytes, int]) -> bytes:
+    base, data, depth = obj
+    encoded_base = base.encode("ascii") if base is not None else b""
+    return OBJECT_HEADER.pack(refcount, depth, len(encoded_base)) + encoded_base + data
+
+
+def unpack_object(payload: bytes) -> Tuple[int, Tuple[Optional[str], bytes, int]]:
+    refcount, depth, base_length = OBJECT_HEADER.unpack_from(payload)
+    start = OBJECT_HEADER.size
+    base = payload[start:start + base_length].decode("ascii") if base_length else None
+    return refcount, (base, payload[start + base_length:], depth)
+
+
+def pack_versions(next_version: int, records: List[VersionRecord]) -> bytes:
+    return struct.pack("<Q", next_version) + b"".join(
+        VERSION_ENTRY.pack(record.version, record.created_at, record.size, (record.digest or "").encode("ascii"))
+        for record in records)
+
+
+def unpack_versions(payload: bytes) -> Tuple[int, List[VersionRecord]]:
+    (next_version,) = struct.unpack_from("<Q", payload)
+    records = []
+    for version, created_at, size, digest in VERSION_ENTRY.iter_unpack(payload[8:]):
+        digest = digest.rstrip(b"\0").decode("ascii") or None
+        records.append(VersionRecord(version, digest, created_at, size))
+    return next_version, records
+
+
+class Journal:
+    def __init__(self, directory: str, flush_interval: float = 0.2, snapshot_bytes: int = 256 * 1024 * 1024,
+                 on_snapshot: Optional[Callable[[], None]] = None):
+        """
+        Write-behind persistence: append() queues a record and returns, and a background
+        thread writes queued records to the current journal segment in batches, fsyncing
+        every flush_interval. A crash loses at most the last interval of writes.
+
+        Periodically the owner writes a compact snapshot of its full state; segments the
+        snapshot covers are then deleted. Warm start mmaps the snapshot and replays the
+        segments written after it.
+
+        :param flush_interval: Seconds between journal fsyncs
+        :param snapshot_bytes: Journal size after which on_snapshot is called
+        :param on_snapshot: Takes a snapshot under snapshot_lock (see rotate() and write_snapshot());
+                            run on its own thread
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_bytes = snapshot_bytes
+        self.on_snapshot = on_snapshot
+        os.makedirs(directory, exist_ok=True)
+        self.segment = self._snapshot_segment()
+        self.journal_bytes = 0
+        self._file = None
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._file_lock = threading.Lock()
+        # Held for a whole snapshot (rotate to write_snapshot) so snapshots never interleave
+        self.snapshot_lock = threading.Lock()
+        self._snapshot_pending = threading.Lock()
+        self._writer = None
+        self._closed = False
+
+    def replay(self) -> Iterator[Tuple[int, str, bytes, bool]]:
+        """
+        Yield (op, key, payload, from_snapshot) for the snapshot and then every later segment,
+        and open the last segment for appending, cut back to its last intact record.
+        """
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.exists(path) and os.path.getsize(path) > SNAPSHOT_HEADER.size:
+            with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for op, key, payload, _ in iter_records(mapped, SNAPSHOT_HEADER.size):
+                    yield op, key, payload, True
+        segments = self._segments()
+        for segment, segment_path in segments:
+            if segment < self.segment:
+                os.remove(segment_path)
+                continue
+            end = 0
+            if os.path.getsize(segment_path):
+                with open(segment_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for op, key, payload, end in iter_records(mapped):
+                        yield op, key, payload, False
+            if os.path.getsize(segment_path) != end:
+                with open(segment_path, "r+b") as file:
+                    file.truncate(end)
+            self.segment = segment
+            self.journal_bytes += end
+
+    def start(self):
+        """
+        Open the current segment and start the writer thread. Call after replay().
+        """
+        self._file = open(self._segment_path(self.segment), "ab")
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def append(self, op: int, key: str, payload: bytes):
+        self._queue.put(pack_record(op, key, payload))
+
+    def flush(self):
+        """
+        Block until every queued record is written and fsynced.
+        """
+        self._queue.join()
+
+    def rotate(self) -> int:
+        """
+        Flush, then continue in a new segment. The caller must stop writes for the duration
+        and capture its state before resuming them; that state plus segments from the returned
+        number onwards reproduce everything.
+
+        :return: The new segment number
+        """
+        self.flush()
+        with self._file_lock:
+            self._file.close()
+            self.segment += 1
+            self.journal_bytes = 0
+            self._file = open(self._segment_path(self.segment), "ab")
+            return self.segment
+
+    def write_snapshot(self, records: Iterator[Tuple[int, str, bytes]], segment: int):
+        """
+        Write records as the new snapshot covering everything before segment, then delete
+        the segments it replaces.
+        """
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, segment))
+            for op, key, payload in records:
+                file.write(pack_record(op, key, payload))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        for old_segment, segment_path in self._segments():
+            if old_segment < segment:
+                os.remove(segment_path)
+
+    def close(self):
+        if self._closed or self._writer is None:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Group commit: gather whatever arrives within one flush interval
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [record for record in batch if record is not None]
+            if records:
+                with self._file_lock:
+                    data = b"".join(records)
+                    self._file.write(data)
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self.journal_bytes += len(data)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+            if self.on_snapshot is not None and self.journal_bytes >= self.snapshot_bytes and self._snapshot_pending.acquire(blocking=False):
+                threading.Thread(target=self._snapshot, name="journal-snapshot", daemon=True).start()
+
+    def _snapshot(self):
+        try:
+            self.on_snapshot()
+        finally:
+            self._snapshot_pending.release()
+
+    def _snapshot_segment(self) -> int:
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as file:
+            magic, _, segment = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a snapshot file: {path}")
+        return segment
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        segments = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"journal.{segment:08d}.log")
@@ -0,0 +1,262 @@
+import bisect
+import datetime
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+LOOKUPS = ("exact", "in", "gt", "gte", "lt", "lte")
+
+
+def _sort_tag(value: Any) -> str:
+    """
+    Values of different types never compare with each other in the range index,
+    except that bools, ints and floats all sort as numbers.
+    """
+    if isinstance(value, (bool, int, float)):
+        return "number"
+    return type(value).__name__
+
+
+def json_default(value: Any):
+    """
+    json.dumps default: datetimes are tagged so json_object_hook can restore them.
+    """
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Metadata value of type {type(value).__name__} is not persistable")
+
+
+def json_object_hook(obj: Dict[str, Any]):
+    if "__datetime__" in obj and len(obj) == 1:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class FieldIndex:
+    def __init__(self, field: str):
+        """
+        Secondary index on one metadata field: a hash index for equality and a sorted
+        index for range lookups. Unhashable values are left out and matched by scanning.
+        """
+        self.field = field
+        self.by_value: Dict[Any, Set[str]] = {}
+        self.sorted_values: List[Tuple[str, Any]] = []
+        self.sorted_keys: List[str] = []
+        # Keys whose value is unhashable: candidates for every lookup, checked by the caller
+        self.unindexed: Set[str] = set()
+
+    def add(self, key: str, value: Any):
+        try:
+            self.by_value.setdefault(value, set()).add(key)
+        except TypeError:
+            self.unindexed.add(key)
+            return
+        entry = (_sort_tag(value), value)
+        try:
+            position = bisect.bisect_right(self.sorted_values, entry)
+        except TypeError:
+            # Hashable but unorderable (e.g. complex): equality lookups only
+            return
+        self.sorted_values.insert(position, entry)
+        self.sorted_keys.insert(position, key)
+
+    def remove(self, key: str, value: Any):
+        try:
+            keys = self.by_value.get(value)
+        except TypeError:
+            self.unindexed.discard(key)
+            return
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self.by_value[value]
+        entry = (_sort_tag(value), value)
+        try:
+            start = bisect.bisect_left(self.sorted_values, entry)
+            stop = bisect.bisect_right(self.sorted_values, entry)
+        except TypeError:
+            return
+        for position in range(start, stop):
+            if self.sorted_keys[position] == key:
+                del self.sorted_values[position]
+                del self.sorted_keys[position]
+                return
+
+    def lookup(self, lookup: str, value: Any) -> Set[str]:
+        """
+        Keys whose indexed value matches, without the unindexed keys.
+
+        :raises TypeError: if value cannot be looked up (unhashable)
+        """
+        if lookup == "exact":
+            return set(self.by_value.get(value, ()))
+        if lookup == "in":
+            return set().union(*(self.by_value.get(item, ()) for item in value))
+        tag = _sort_tag(value)
+        entry = (tag, value)
+        if lookup in ("gt", "gte"):
+            start = (bisect.bisect_right if lookup == "gt" else bisect.bisect_left)(self.sorted_values, entry)
+            stop = bisect.bisect_left(self.sorted_values, (tag + "\0",))
+        else:
+            start = bisect.bisect_left(self.sorted_values, (tag,))
+            stop = (bisect.bisect_left if lookup == "lt" else bisect.bisect_right)(self.sorted_values, entry)
+        return set(self.sorted_keys[start:stop])
+
+
+class MetadataIndex:
+    def __init__(self, indexed_fields: Iterable[str] = (), path: Optional[str] = None):
+        """
+        Per-key metadata with secondary indexes on declared fields. Behaves like a dict
+        of key -> metadata dict, and adds filtered lookups:
+
+            index.query(session_id="abc", created_at__gt=t)
+
+        Conditions use Django-style lookups (exact, in, gt, gte, lt, lte). Conditions on
+        indexed fields are answered from the indexes; the rest only filter the candidates,
+        so a query should name at least one indexed field to avoid a full scan.
+
+        :param indexed_fields: Metadata fields to build secondary indexes on
+        :param path: SQLite database to persist metadata to; loaded on start-up when it exists
+        """
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.indexes: Dict[str, FieldIndex] = {field: FieldIndex(field) for field in indexed_fields}
+        self._lock = threading.RLock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+            for key, value in self._db.execute("SELECT key, value FROM metadata"):
+                self._insert(key, json.loads(value, object_hook=json_object_hook))
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        return self.entries[key]
+
+    def __setitem__(self, key: str, metadata: Dict[str, Any]):
+        self.set(key, metadata)
+
+    def __delitem__(self, key: str):
+        if not self.delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.entries))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.entries.get(key, default)
+
+    def set(self, key: str, metadata: Dict[str, Any]):
+        metadata = dict(metadata or {})
+        with self._lock:
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                                     (key, json.dumps(metadata, default=json_default)))
+            self._remove(key)
+            self._insert(key, metadata)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self.entries:
+                return False
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self._remove(key)
+            return True
+
+    def add_index(self, field: str):
+        """
+        Declare a new indexed field, indexing the metadata already stored.
+        """
+        with self._lock:
+            if field in self.indexes:
+                return
+            index = FieldIndex(field)
+            for key, metadata in self.entries.items():
+                if field in metadata:
+                    index.add(key, metadata[field])
+            self.indexes[field] = index
+
+    def query(self, **conditions: Any) -> List[str]:
+        """
+        :param conditions: field=value or field__lookup=value, all of which must match
+        :return: Matching keys, sorted
+        :raises ValueError: on an unknown lookup
+        """
+        parsed = []
+        for name, value in conditions.items():
+            field, _, lookup = name.partition("__")
+            lookup = lookup or "exact"
+            if lookup not in LOOKUPS:
+                raise ValueError(f"Unsupported lookup: {lookup}")
+            parsed.append((field, lookup, value))
+        with self._lock:
+            candidates = None
+            remaining = []
+            for field, lookup, value in parsed:
+                index = self.indexes.get(field)
+                try:
+                    keys = index.lookup(lookup, value) if index is not None else None
+                except TypeError:
+                    keys = None
+                if keys is None:
+                    remaining.append((field, lookup, value))
+                    continue
+                if index.unindexed:
+                    keys = keys | index.unindexed
+                    remaining.append((field, lookup, value))
+                candidates = keys if candidates is None else candidates & keys
+            if candidates is None:
+                candidates = set(self.entries)
+            return sorted(key for key in candidates
+                          if all(self._matches(self.entries[key], field, lookup, value) for field, lookup, value in remaining))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _matches(metadata: Dict[str, Any], field: str, lookup: str, value: Any) -> bool:
+        if field not in metadata:
+            return False
+        actual = metadata[field]
+        try:
+            if lookup == "exact":
+                return actual == value
+            if lookup == "in":
+                return actual in value
+            if _sort_tag(actual) != _sort_tag(value):
+                return False
+            if lookup == "gt":
+                return actual > value
+            if lookup == "gte":
+                return actual >= value
+            if lookup == "lt":
+                return actual < value
+            return actual <= value
+        except TypeError:
+            return False
+
+    def _insert(self, key: str, metadata: Dict[str, Any]):
+        self.entries[key] = metadata
+        for field, index in self.indexes.items():
+            if field in metadata:
+                index.add(key, metadata[field])
+
+    def _remove(self, key: str):
+        metadata = self.entries.pop(key, None)
+        if metadata is None:
+            return
+        for field, index in self.indexes.items():
+            if field in metadata:
+                index.remove(key, metadata[field])
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from connections.db import redis_client, RedisBatch
+from connections.pubsub import AsyncPubSubTransport, Subscription
+from synapse.settings import READY_INLINE_BYTES
+
+READY_PREFIX = "synapse:ready:"
+
+
+def ready_channel(channel: str) -> str:
+    return f"{READY_PREFIX}{channel}"
+
+
+def _last_event_key(channel: str, key: str) -> str:
+    return f"{READY_PREFIX}{channel}:last:{key}"
+
+
+class KeyReady:
+    def __init__(self, key: str, version: int, size: int, kind: str = "text", data: Optional[str] = None):
+        """
+        Announcement that a version of key was committed.
+
+        :param size: Size of the stored value in bytes (before compression)
+        :param data: The value itself when it was small enough to send inline
+        """
+        self.key = key
+        self.version = version
+        self.size = size
+        self.kind = kind
+        self.data = data
+
+    def to_json(self) -> str:
+        event = {"key": self.key, "version": self.version, "size": self.size, "kind": self.kind}
+        if self.data is not None:
+            event["data"] = self.data
+        return json.dumps(event)
+
+    @classmethod
+    def from_json(cls, payload) -> "KeyReady":
+        return cls(**json.loads(payload))
+
+    def satisfies(self, version: Optional[int]) -> bool:
+        return version is None or self.version >= version
+
+    def inline_data(self, version: Optional[int] = None) -> Optional[str]:
+        """
+        :return: The inline value if it is the requested version (None accepts any), else None;
+                 a waiter for version n can be resolved by a later version whose data is not n's
+        """
+        if version is not None and self.version != version:
+            return None
+        return self.data
+
+
+class ReadyNotifier:
+    def __init__(self, client=None, inline_bytes: int = READY_INLINE_BYTES, ttl: int = 3600):
+        """
+        Publishes KeyReady events for a writer. The last event per key is also kept in Redis
+        for ttl seconds so a waiter that subscribes after the write still finds it.
+
+        :param inline_bytes: Values up to this size travel inside the event
+        """
+        self.client = client or redis_client()
+        self.inline_bytes = inline_bytes
+        self.ttl = ttl
+
+    def notify(self, channel: str, key: str, version: int, value: Optional[bytes], kind: str = "text"):
+        """
+        :param value: Raw value, sent inline when small enough; None to announce without it
+        """
+        data = value.decode("utf-8") if value is not None and len(value) <= self.inline_bytes else None
+        payload = KeyReady(key, version, len(value or b""), kind, data).to_json()
+        # One round trip for both commands
+        with RedisBatch(self.client) as batch:
+            batch.set(_last_event_key(channel, key), payload, ex=self.ttl)
+            batch.publish(ready_channel(channel), payload)
+
+
+class KeyWaiter:
+    _instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, KeyWaiter]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, transport: Optional[AsyncPubSubTransport] = None):
+        """
+        Resolves futures waiting for keys to become ready. Each channel has one subscription
+        and one dispatch task however many keys are awaited on it; the subscription is
+        closed when its last waiter is done.
+        """
+        self.transport = transport or AsyncPubSubTransport.instance()
+        self.waiters: Dict[str, Dict[str, List[Tuple[Optional[int], asyncio.Future]]]] = {}
+        self.channels: Dict[str, Tuple[Subscription, asyncio.Task]] = {}
+        self._subscribing = asyncio.Lock()
+
+    @classmethod
+    def instance(cls) -> "KeyWaiter":
+        loop = asyncio.get_running_loop()
+        if loop not in cls._instances:
+            cls._instances[loop] = cls()
+        return cls._instances[loop]
+
+    async def wait(self, channel: str, key: str, version: Optional[int] = None, timeout: Optional[float] = None) -> KeyReady:
+        """
+        :param version: Wait for at least this version, which may already have been announced;
+                        None waits for the next announcement after the call
+        :raises asyncio.TimeoutError: if no matching event arrives within timeout
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(channel, {}).setdefault(key, []).append((version, future))
+        try:
+            async with self._subscribing:
+                if channel not in self.channels:
+                    subscription = await self.transport.subscribe(ready_channel(channel))
+                    self.channels[channel] = (subscription, asyncio.create_task(self._dispatch(channel, subscription)))
+            # Subscribed before looking, so a write in between is seen one way or the other.
+            # Without a version there is no telling whether the stored event is fresh.
+            if version is not None:
+                await self._resolve_stored(channel, key)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            await self._discard(channel, key, future)
+
+    async def _dispatch(self, channel: str, subscription: Subscription):
+        dropped = 0
+        async for payload in subscription:
+            self._resolve(channel, KeyReady.from_json(payload))
+            if subscription.dropped != dropped:
+                # Events were dropped while the queue was full; recover from the stored ones
+                dropped = subscription.dropped
+                for key in list(self.waiters.get(channel, {})):
+                    await self._resolve_stored(channel, key)
+
+    async def _resolve_stored(self, channel: str, key: str):
+        last = await self.transport.client.get(_last_event_key(channel, key))
+        if last is not None:
+            self._resolve(channel, KeyReady.from_json(last), stored=True)
+
+    def _resolve(self, channel: str, event: KeyReady, stored: bool = False):
+        for version, future in self.waiters.get(channel, {}).get(event.key, ()):
+            if not future.done() and (version is not None or not stored) and event.satisfies(version):
+                future.set_result(event)
+
+    async def _discard(self, channel: str, key: str, future: asyncio.Future):
+        keys = self.waiters.get(channel, {})
+        keys[key] = [waiter for waiter in keys.get(key, ()) if waiter[1] is not future]
+        if not keys[key]:
+            del keys[key]
+        if keys:
+            return
+        self.waiters.pop(channel, None)
+        if channel not in self.channels:
+            return
+        subscription, task = self.channels.pop(channel)
+        task.cancel()
+        await subscription.close()
+
+
+async def wait_for_key(channel: str, key: str, version: Optional[int] = None, timeout: Optional[float] = None) -> KeyReady:
+    """
+    Wait until a writer announces key on channel (see SharedMemoryManager.store_text's notify).
+    The returned event carries the value in data when it was sent inline.
+    """
+    return await KeyWaiter.instance().wait(channel, key, version, timeout)
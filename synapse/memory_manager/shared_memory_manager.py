@@ -1,110 +1,727 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
 import numpy as np
-import torch
-from typing import Union, Tuple, Dict, Any, List
+import redis
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING, Union, Tuple, Dict, Any, List, Optional, Set
 
 from synapse.memory_manager.synchronization import SynchronizationService
 from synapse.memory_manager.compression_service import CompressionService
-from synapse.memory_manager.data_type_manager import DataTypeManager
-from synapse.memory_manager.control import PartitioningService, VersionControl, AccessControl, MemoryAllocator
+from synapse.memory_manager.data_type_manager import DataTypeManager, QuantizedArray
+from synapse.memory_manager.control import PartitioningService, VersionControl, AccessControl, MemoryAllocator, MemoryBudgetExceeded, Reservation
+from synapse.memory_manager.control import MemoryPartitionBackend, MmapPartitionBackend, CachePartitionBackend
 from synapse.memory_manager.file_manager import MemoryMappedFileManager
+from synapse.memory_manager.metadata_index import MetadataIndex, json_default, json_object_hook
+from synapse.memory_manager.journal import Journal, OP_TEXT, OP_VECTOR, OP_METADATA, OP_OBJECT, OP_VERSIONS, OP_DELETE
+from synapse.memory_manager.journal import pack_object, unpack_object, pack_versions, unpack_versions
 from synapse.memory_manager.cache_manager import CacheManager
-from synapse.memory_manager.gpu_manager import GPUMemoryManager
-from synapse.memory_manager.synchronization import DistributedLockManager
+from synapse.memory_manager.device_pool import DevicePool
+from synapse.memory_manager.shared_tensor_store import SharedTensorStore
+from synapse.memory_manager.tiering import TieringEngine
+from synapse.memory_manager.synchronization import DistributedLockManager, Lease, LeaseLostError
+from synapse.memory_manager.torch_compat import is_tensor
+from synapse.memory_manager.access_stats import AccessStats
+from synapse.memory_manager.notifications import ReadyNotifier
+from connections.db import redis_client
+from synapse.settings import MEMORY_MANAGER_WORKERS
 from connections.pubsub import Publisher
 
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
 class SharedMemoryManager:
-    def __init__(self, service_id: str, cache_capacity: int, cache_expire_time:int):
+    def __init__(self, service_id: str, cache_capacity: int, cache_expire_time:int, shared_tensor_dir: Optional[str] = None,
+                 mmap_directory: Optional[str] = None, num_partitions: int = 4, partition_backends: Optional[List[str]] = None,
+                 distributed_locks: bool = False, memory_budget: Optional[int] = None,
+                 prefix_budgets: Optional[Dict[str, int]] = None, budget_policy: str = "evict",
+                 vector_quantization: Optional[str] = None, metadata_fields: Optional[List[str]] = None,
+                 metadata_path: Optional[str] = None, persistence_dir: Optional[str] = None,
+                 snapshot_bytes: int = 256 * 1024 * 1024, device_pool: Optional[DevicePool] = None,
+                 stats_publish_interval: Optional[float] = None, notify_channel: Optional[str] = None,
+                 version_keep_last: Optional[int] = None, version_keep_for: Optional[float] = None,
+                 max_workers: Optional[int] = None):
+        """
+        Reads never lock: stored values are immutable and replaced wholesale, so readers see
+        the last committed version. Writers serialise on a striped in-process lock and
+        additionally take the Redis lock when cross-node consistency is requested.
+
+        :param distributed_locks: Default for the per-call distributed flag on writes
+        :param memory_budget: Bytes of in-process memory the manager may hold; also enables hot/cold
+                              tiering of tensors, which the "evict" policy demotes to make room
+        :param prefix_budgets: Budgets in bytes for keys starting with each prefix
+        :param budget_policy: What writes do when a budget is exceeded: "reject", "block" or "evict"
+        :param vector_quantization: Default storage mode for vectors: "float16", "bfloat16", "int8" or None
+        :param metadata_fields: Metadata fields to index for find_keys (e.g. ["session_id", "created_at"])
+        :param metadata_path: SQLite file to persist metadata to; None keeps it in memory only
+        :param persistence_dir: Journal texts, vectors, metadata and versions here (write-behind) and
+                                warm-start from it; tensors persist through their mmap/shared stores
+        :param snapshot_bytes: Journal size after which a compact snapshot is written
+        :param device_pool: Devices for store_on_device, e.g. DevicePool.cpu(capacity) or GPUMemoryManager(ids).pool
+        :param stats_publish_interval: Seconds between publishing access stats to Redis for the
+                                       memory_stats command and endpoint; None keeps them local
+        :param notify_channel: Default channel store_text announces committed keys on (see
+                               notifications.wait_for_key); None announces only when asked per call
+        :param partition_backends: Where tensor partitions live, assigned round-robin:
+                                   any of "memory", "mmap" and "cache" (default ["memory"])
+        :param version_keep_last: Versions kept per key; None keeps every version
+        :param version_keep_for: Seconds versions are kept; None keeps them regardless of age
+        :param max_workers: Threads for batch compression and AsyncSharedMemoryManager calls
+                            (default MEMORY_MANAGER_WORKERS)
+        """
         self.tensor_storage = {}
+        # Where each tensor was last written: "tiering", "mmap", "partition" or "shared"
+        self.tensor_locations: Dict[str, str] = {}
         self.vector_storage = {}
-        self.metadata_store = {}
+        self.metadata_store = MetadataIndex(metadata_fields or (), metadata_path)
         self.text_storage = {}
         self.service_id = service_id
-        self.version_control = VersionControl()
+        self.version_control = VersionControl(keep_last=version_keep_last, keep_for=version_keep_for)
         self.compression_service = CompressionService()
         self.access_control = AccessControl()
         self.synchronization_service = SynchronizationService()
-        self.memory_allocator = MemoryAllocator()
+        self.memory_allocator = MemoryAllocator(budget=memory_budget, prefix_budgets=prefix_budgets, policy=budget_policy)
         self.data_type_manager = DataTypeManager()
-        # self.partitioning_service = PartitioningService(num_partitions)
-        # self.mmap_manager = MemoryMappedFileManager(mmap_directory)
+        self.vector_quantization = vector_quantization
+        self.mmap_manager = MemoryMappedFileManager(mmap_directory or os.path.join(tempfile.gettempdir(), "synapse_mmap", str(service_id)))
         self.cache_manager = CacheManager(capacity=cache_capacity, expire_time=cache_expire_time)
-        # self.gpu_memory_manager = GPUMemoryManager(gpu_device_ids)
+        self.partitioning_service = PartitioningService(num_partitions, self._partition_backends(partition_backends or ["memory"]))
+        self.device_pool = device_pool
         self.distributed_lock_manager = DistributedLockManager()
+        self.distributed_locks = distributed_locks
+        self.fencing_tokens = {}
+        self.shared_tensor_store = SharedTensorStore(shared_tensor_dir) if shared_tensor_dir else None
+        self.tiering = None
+        if memory_budget is not None:
+            self.tiering = TieringEngine(self.memory_allocator, self.cache_manager, self.mmap_manager,
+                                         self.compression_service, ram_budget=memory_budget)
+            self.memory_allocator.evictor = self.tiering.free
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or MEMORY_MANAGER_WORKERS, thread_name_prefix=f"memory-{service_id}")
+        self.access_stats = AccessStats(service_id)
+        self.notify_channel = notify_channel
+        self._notifier = None
+        if stats_publish_interval is not None:
+            threading.Thread(target=self._publish_stats, args=(stats_publish_interval,),
+                             name=f"stats-{service_id}", daemon=True).start()
+        self.journal = None
+        if persistence_dir is not None:
+            self.journal = Journal(persistence_dir, snapshot_bytes=snapshot_bytes, on_snapshot=self.snapshot)
+            self._warm_start()
+            self.journal.start()
+
+    @contextmanager
+    def _write_lock(self, key: str, distributed: Optional[bool] = None, lease: Optional[Lease] = None):
+        """
+        :param lease: A lease on key the caller already holds, used instead of taking one
+        :return: The distributed Lease when one is held, else None
+        """
+        started = time.perf_counter()
+        with self.synchronization_service.lock(key):
+            if lease is None and (self.distributed_locks if distributed is None else distributed):
+                with self.distributed_lock_manager.lock(key) as lease:
+                    self.access_stats.record_lock_wait(key, time.perf_counter() - started)
+                    yield lease
+            else:
+                self.access_stats.record_lock_wait(key, time.perf_counter() - started)
+                yield lease
 
-    def store_text(self, key:str, text: str, metadata: Dict[str, Any] = None):
-        with self.distributed_lock_manager.lock(key):
-            compressed_text = self.compression_service.compress(text.encode('utf-8'))
+    def _check_fence(self, lease: Optional[Lease]):
+        """
+        :raises LeaseLostError: if the write holding lease must not commit (see _fence)
+        """
+        if lease is not None and self._fence([lease]):
+            raise LeaseLostError(f"Lease on {lease.key} was lost before the write committed")
+
+    def _fence(self, leases: List[Lease]) -> Set[str]:
+        """
+        Fence writes about to commit. Call with the keys' stripe locks held, once the values
+        are prepared and immediately before they are applied, so check and write form one
+        critical section: Redis compares each holder and token and records the token in one
+        script, and here the token is compared with the last one applied to the key, so a
+        write from an older holder never lands after a newer holder's.
+
+        :return: Keys whose write must be rejected
+        """
+        stale = {lease.key for lease in leases if lease.fencing_token < self.fencing_tokens.get(lease.key, 0)}
+        fresh = [lease for lease in leases if lease.key not in stale]
+        accepted = self.distributed_lock_manager.lease_manager.validate_many(fresh) if fresh else {}
+        for lease in fresh:
+            if accepted[lease.key]:
+                self.fencing_tokens[lease.key] = lease.fencing_token
+        return stale | {key for key, ok in accepted.items() if not ok}
+
+    @contextmanager
+    def _write_lock_many(self, keys: List[str], distributed: Optional[bool] = None):
+        """
+        :return: The distributed Leases by key when they were taken, else an empty dict
+        """
+        started = time.perf_counter()
+        with self.synchronization_service.lock_many(keys):
+            if self.distributed_locks if distributed is None else distributed:
+                with self.distributed_lock_manager.lock_many(keys) as leases:
+                    self._record_lock_waits(keys, time.perf_counter() - started)
+                    yield leases
+            else:
+                self._record_lock_waits(keys, time.perf_counter() - started)
+                yield {}
+
+    def _record_lock_waits(self, keys: List[str], waited: float):
+        for key in keys:
+            self.access_stats.record_lock_wait(key, waited)
+
+    def store_text(self, key:str, text: str, metadata: Dict[str, Any] = None, distributed: Optional[bool] = None,
+                   notify: Optional[str] = None, lease: Optional[Lease] = None):
+        """
+        :param distributed: Also hold the Redis lock for cross-node consistency (defaults to distributed_locks)
+        :param notify: Channel to announce the new version on once committed (defaults to notify_channel)
+        :param lease: A held lease on key (e.g. from lease_manager.lease) to fence the write with instead of taking one
+        """
+        encoded_text = text.encode('utf-8')
+        compressed_text = self.compression_service.compress(encoded_text)
+        with self._write_lock(key, distributed, lease) as lease, self.memory_allocator.reserve(key, len(compressed_text)) as reservation, \
+                self._reserve_versions(key, len(encoded_text)) as versions:
+            self._check_fence(lease)
             self.text_storage[key] = compressed_text
-            self.cache_manager.put(key, compressed_text)
+            reservation.commit()
+            # text_storage is the in-process copy, so only Memcached gets another one
+            self.cache_manager.put(key, compressed_text, local=False)
             self.metadata_store[key] = metadata or {}
-            self.version_control.create_version(key)
+            version = self.version_control.create_version(key, encoded_text)
+            self._commit_versions(key, versions)
+            self._journal(OP_TEXT, key, compressed_text, metadata)
+        self.access_stats.record_write(key, len(encoded_text), len(compressed_text))
+        self._notify_ready(notify, key, version, encoded_text, compressed_text)
+        return version
+
+    def _notify_ready(self, channel: Optional[str], key: str, version: int, value: bytes, compressed: bytes):
+        channel = channel or self.notify_channel
+        if channel is None:
+            return
+        if self._notifier is None:
+            self._notifier = ReadyNotifier()
+        if len(value) > self._notifier.inline_bytes:
+            # Too large to travel in the event: share this version with other nodes' retrieve_text
+            self.cache_manager.put(self._announced_key(key, version), compressed, local=False)
+        self._notifier.notify(channel, key, version, value)
+
+    @staticmethod
+    def _announced_key(key: str, version: int) -> str:
+        return f"{key}@v{version}"
+
+    @staticmethod
+    def _versions_key(key: str) -> str:
+        # Allocation holding the version store's bytes for key; shares key's prefix budgets
+        return f"{key}@versions"
+
+    def _reserve_versions(self, key: str, size: int) -> Reservation:
+        """
+        Hold room for one more version of key of up to size bytes (a full copy; deltas and
+        deduplicated content need less). Settle it with _commit_versions once recorded.
+        """
+        return self.memory_allocator.reserve(self._versions_key(key), self.version_control.footprint(key) + size)
+
+    def _commit_versions(self, key: str, reservation: Reservation):
+        reservation.commit(self.version_control.footprint(key))
 
     def retrieve_text(self, key: str, version: int = None) -> str:
-        with self.distributed_lock_manager.lock(key):
+        """
+        :param version: A version written through this manager, or one another node announced
+                        (see store_text's notify) while the cache still holds it
+        """
+        if version is not None:
+            try:
+                return self.version_control.get_version(key, version).decode('utf-8')
+            except KeyError:
+                text_data = self.cache_manager.get(self._announced_key(key, version))
+                if text_data is None:
+                    raise
+                return bytes(self.compression_service.decompress(text_data)).decode('utf-8')
+        text_data = self.text_storage.get(key)
+        hit = None
+        if text_data is None:
+            # Written by another node: only the shared cache has it
             text_data = self.cache_manager.get(key)
-            if text_data is None:
-                raise KeyError(f"No data found for key: {key}")
-            if version is not None:
-                text_data = self.version_control.get_version(key, version)
-            decompressed_text = self.compression_service.decompress(text_data)
-            return decompressed_text.decode('utf-8')
-
-    def store_tensor(self, key: str, tensor: Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None):
-        with self.distributed_lock_manager.lock(key):
-            if tensor.nbytes > self.cache_manager.capacity:
+            hit = text_data is not None
+        if text_data is None:
+            raise KeyError(f"No data found for key: {key}")
+        decompressed_text = self.compression_service.decompress(text_data)
+        self.access_stats.record_read(key, len(decompressed_text), hit)
+        return decompressed_text.decode('utf-8')
+
+    def store_tensor(self, key: str, tensor: Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None, shared: bool = False,
+                     distributed: Optional[bool] = None, lease: Optional[Lease] = None):
+        """
+        :param shared: Write the tensor once into the cross-process shared store instead of
+                       the cache, so every worker maps the same copy (needs shared_tensor_dir)
+        :param distributed: Also hold the Redis lock for cross-node consistency (defaults to distributed_locks)
+        :param lease: A held lease on key to fence the write with instead of taking one
+        """
+        # Every path records the version's content, delta-encoded against the previous one;
+        # large tensors are compressed frame by frame straight into that one buffer
+        compressed_tensor = self.compression_service.compress(tensor)
+        if shared:
+            return self._store_shared(key, tensor, compressed_tensor, metadata, distributed, lease)
+        with self._write_lock(key, distributed, lease) as lease, self._reserve_versions(key, len(compressed_tensor)) as versions:
+            self._check_fence(lease)
+            if self.tiering is not None:
+                self._evict_tensor(key, "tiering")
+                self.tiering.put(key, tensor)
+            elif tensor.nbytes > self.cache_manager.capacity:
+                if is_tensor(tensor):
+                    tensor = tensor.cpu().numpy()
+                self._evict_tensor(key, "mmap")
                 self.mmap_manager.store_mmap(key, tensor)
+                self.memory_allocator.allocate(key, tensor.nbytes, "mmap")
             else:
-                compressed_tensor = self.compression_service.compress(tensor)
-                self.partitioning_service.store_partitioned(key, compressed_tensor)
-                self.cache_manager.put(key, compressed_tensor)
+                with self.memory_allocator.reserve(key, tensor.nbytes) as reservation:
+                    self._evict_tensor(key, "partition")
+                    self.partitioning_service.store_partitioned(key, tensor)
+                    reservation.commit()
+                self.cache_manager.put(key, compressed_tensor, local=False)
+            version = self.version_control.create_version(key, compressed_tensor)
+            self._commit_versions(key, versions)
             self.metadata_store[key] = metadata or {}
-            stored_version = self.version_control.create_version(key)
+        self.access_stats.record_write(key, tensor.nbytes, self.memory_allocator.get_allocation(key) or tensor.nbytes)
+        return version
+
+    def _evict_tensor(self, key: str, location: Optional[str] = None):
+        """
+        Remove key's tensor from where it was last written unless that is location, so a
+        write that takes a different path leaves no older copy for reads to find first.
+        Called with the key's write lock held.
+        """
+        previous = self.tensor_locations.get(key)
+        if location is None:
+            self.tensor_locations.pop(key, None)
+        else:
+            self.tensor_locations[key] = location
+        if previous is None or previous == location:
+            return
+        if previous == "tiering":
+            self.tiering.delete(key)
+        elif previous == "shared":
+            self.shared_tensor_store.delete(key)
+        else:
+            if previous == "partition":
+                self.partitioning_service.delete_partitioned(key)
+                self.cache_manager.evict(key)
+            else:
+                self.mmap_manager.delete_mmap(key)
+            self.memory_allocator.deallocate(key)
 
     def retrieve_tensor(self, key: str, version: int = None) -> Union[np.ndarray, torch.Tensor]:
-        with self.distributed_lock_manager.lock(key):
-            cached_tensor = self.cache_manager.get(key)
-            if cached_tensor is not None:
-                tensor_data = cached_tensor
+        tensor, hit = self._read_tensor(key, version)
+        self.access_stats.record_read(key, tensor.nbytes, hit)
+        return tensor
+
+    def _read_tensor(self, key: str, version: Optional[int]) -> Tuple[np.ndarray, Optional[bool]]:
+        """
+        :return: The tensor and whether the cache served it (None if the cache was not consulted)
+        """
+        if version is not None:
+            return self.compression_service.decompress(self.version_control.get_version(key, version)), None
+        if self.shared_tensor_store is not None and key in self.shared_tensor_store:
+            return self.shared_tensor_store.get(key), None
+        if self.tiering is not None and self.tiering.tier_of(key) is not None:
+            return self.tiering.get(key), None
+        if key in self.partitioning_service.layouts:
+            return self.partitioning_service.retrieve_partitioned(key), None
+        cached_tensor = self.cache_manager.get(key)
+        if cached_tensor is not None:
+            return self.compression_service.decompress(cached_tensor), True
+        return self.mmap_manager.retrieve_mmap(key), False
+
+    def retrieve_rows(self, key: str, start: int, stop: int) -> np.ndarray:
+        """
+        Read rows [start, stop) of a stored tensor, touching only the partitions (or mmap
+        pages) that hold them instead of materialising the whole tensor.
+        """
+        if self.shared_tensor_store is not None and key in self.shared_tensor_store:
+            rows = self.shared_tensor_store.get(key)[start:stop]
+        elif self.tiering is not None and self.tiering.tier_of(key) is not None:
+            rows = self.tiering.get(key)[start:stop]
+        else:
+            try:
+                rows = self.partitioning_service.retrieve_rows(key, start, stop)
+            except KeyError:
+                rows = self.mmap_manager.retrieve_mmap(key)[start:stop]
+        self.access_stats.record_read(key, rows.nbytes)
+        return rows
+
+    def _partition_backends(self, names: List[str]) -> list:
+        backends = []
+        for name in names:
+            if name == "memory":
+                backends.append(MemoryPartitionBackend())
+            elif name == "mmap":
+                backends.append(MmapPartitionBackend(self.mmap_manager))
+            elif name == "cache":
+                backends.append(CachePartitionBackend(self.cache_manager, self.compression_service))
             else:
-                try:
-                    tensor_data = self.partitioning_service.retrieve_partitioned(key)
-                except KeyError:
-                    tensor_data = self.mmap_manager.retrieve_mmap(key)
-            
-            if version is not None:
-                tensor_data = self.version_control.get_version(key, version)
-            
-            return self.compression_service.decompress(tensor_data)
-
-    def store_vector(self, key:str, vector:Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None):
-        vector_data = self.compression_service.compress(vector)
-        self.vector_storage[key] = vector_data
-        self.metadata_store[key] = metadata or {}
-        self.version_control.create_version(key)
+                raise ValueError(f"Unknown partition backend: {name}")
+        return backends
+
+    def store_vector(self, key:str, vector:Union[np.ndarray, torch.Tensor], metadata: Dict[str, Any] = None, shared: bool = False,
+                     distributed: Optional[bool] = None, quantize: Optional[str] = None, lease: Optional[Lease] = None):
+        """
+        :param quantize: Store as "float16", "bfloat16" or "int8" (per-row scales); defaults to vector_quantization
+        :param lease: A held lease on key to fence the write with instead of taking one
+        """
+        if shared:
+            return self._store_shared(key, vector, self.compression_service.compress(vector), metadata, distributed, lease)
+        vector_data = self._encode_vector(vector, quantize)
+        with self._write_lock(key, distributed, lease) as lease, self.memory_allocator.reserve(key, len(vector_data)) as reservation, \
+                self._reserve_versions(key, len(vector_data)) as versions:
+            self._check_fence(lease)
+            self.vector_storage[key] = vector_data
+            reservation.commit()
+            self.metadata_store[key] = metadata or {}
+            version = self.version_control.create_version(key, vector_data)
+            self._commit_versions(key, versions)
+            self._journal(OP_VECTOR, key, vector_data, metadata)
+        self.access_stats.record_write(key, vector.nbytes, len(vector_data))
+        return version
     
     
-    def retrieve_vector(self, key:str, version:int =None) -> Union[np.ndarray, torch.Tensor]:
-        vector_data = self.vector_storage[key]
+    def retrieve_vector(self, key:str, version:int =None, dequantize: bool = True) -> Union[np.ndarray, torch.Tensor, QuantizedArray]:
+        """
+        :param dequantize: Return quantized vectors as a QuantizedArray (e.g. for QuantizedArray.dot) when False
+        """
         if version is not None:
             vector_data = self.version_control.get_version(key,version)
-        return self.compression_service.decompress(vector_data)
+        elif self.shared_tensor_store is not None and key not in self.vector_storage and key in self.shared_tensor_store:
+            vector = self.shared_tensor_store.get(key)
+            self.access_stats.record_read(key, vector.nbytes)
+            return vector
+        else:
+            vector_data = self.vector_storage[key]
+        vector = self._decode_vector(vector_data, dequantize)
+        self.access_stats.record_read(key, vector.nbytes)
+        return vector
+
+    def delete(self, key: str, distributed: Optional[bool] = None, lease: Optional[Lease] = None) -> bool:
+        """
+        Remove a text, vector or tensor with its versions and metadata.
+
+        :param lease: A held lease on key to fence the delete with instead of taking one
+        :return: Whether the key held a value
+        """
+        with self._write_lock(key, distributed, lease) as lease:
+            self._check_fence(lease)
+            existed = self.text_storage.pop(key, None) is not None
+            existed = self.vector_storage.pop(key, None) is not None or existed
+            existed = key in self.tensor_locations or existed
+            self._evict_tensor(key)
+            self.cache_manager.evict(key)
+            self.memory_allocator.deallocate(key)
+            self.metadata_store.delete(key)
+            self.version_control.delete(key)
+            self.memory_allocator.deallocate(self._versions_key(key))
+            if self.journal is not None:
+                self.journal.append(OP_DELETE, key, b"")
+        return existed
+
+    def _encode_vector(self, vector: Union[np.ndarray, torch.Tensor], quantize: Optional[str] = None) -> bytes:
+        mode = quantize or self.vector_quantization
+        if mode is None:
+            return self.compression_service.compress(vector)
+        quantized = self.data_type_manager.quantize(vector, mode)
+        return self.data_type_manager.pack_quantized(quantized, self.compression_service)
+
+    def _decode_vector(self, vector_data: bytes, dequantize: bool = True) -> Union[np.ndarray, QuantizedArray]:
+        if not self.data_type_manager.is_quantized(vector_data):
+            return self.compression_service.decompress(vector_data)
+        quantized = self.data_type_manager.unpack_quantized(vector_data, self.compression_service)
+        return quantized.dequantize() if dequantize else quantized
     
+    def _store_shared(self, key: str, tensor: Union[np.ndarray, torch.Tensor], compressed: bytes, metadata: Dict[str, Any] = None,
+                      distributed: Optional[bool] = None, lease: Optional[Lease] = None) -> int:
+        if self.shared_tensor_store is None:
+            raise ValueError("shared_tensor_dir must be set to store shared tensors")
+        with self._write_lock(key, distributed, lease) as lease, self._reserve_versions(key, len(compressed)) as versions:
+            self._check_fence(lease)
+            self._evict_tensor(key, "shared")
+            self.shared_tensor_store.put(key, tensor)
+            self.metadata_store[key] = metadata or {}
+            version = self.version_control.create_version(key, compressed)
+            self._commit_versions(key, versions)
+            return version
+
+    def store_many(self, items: List[Tuple[str, Union[str, np.ndarray, torch.Tensor]]], metadata: Dict[str, Any] = None,
+                   distributed: Optional[bool] = None) -> List[Optional[Exception]]:
+        """
+        Store several texts and/or vectors at once. Distributed locks, when requested, are
+        taken in one pipelined batch, payloads are compressed in the thread pool and texts
+        are written to the cache with a single set_multi call. A key given more than once
+        is stored once, with its last value. Texts the cache fails to take are logged, not
+        reported: like store_text, the write has committed and is readable here.
+
+        :param items: (key, value) pairs; str values are stored as text, arrays as vectors
+        :param metadata: Metadata applied to every key
+        :return: One entry per item, in input order: None on success or the exception raised
+        """
+        errors: List[Optional[Exception]] = [None] * len(items)
+        # Index of the value stored for each key
+        latest = {key: index for index, (key, _) in enumerate(items)}
+        keys = list(latest)
+        compressed = list(self.executor.map(self._compress_item, [items[latest[key]][1] for key in keys]))
+        with self._write_lock_many(keys, distributed) as leases, ExitStack() as reservations:
+            prepared = []
+            for key, payload in zip(keys, compressed):
+                index = latest[key]
+                value = items[index][1]
+                if isinstance(payload, Exception):
+                    errors[index] = payload
+                    continue
+                content = value.encode('utf-8') if isinstance(value, str) else payload
+                with ExitStack() as item_reservations:
+                    try:
+                        reservation = item_reservations.enter_context(self.memory_allocator.reserve(key, len(payload)))
+                        versions = item_reservations.enter_context(self._reserve_versions(key, len(content)))
+                    except MemoryBudgetExceeded as e:
+                        errors[index] = e
+                        continue
+                    # Released with the batch unless committed below
+                    reservations.enter_context(item_reservations.pop_all())
+                prepared.append((index, key, value, payload, content, reservation, versions))
+            # One pipelined fence check for the whole batch, right before it is applied
+            rejected = self._fence([leases[item[1]] for item in prepared]) if leases else set()
+            texts = {}
+            for index, key, value, payload, content, reservation, versions in prepared:
+                if key in rejected:
+                    errors[index] = LeaseLostError(f"Lease on {key} was lost before the write committed")
+                    continue
+                reservation.commit()
+                if isinstance(value, str):
+                    self.text_storage[key] = payload
+                    texts[key] = payload
+                    self.access_stats.record_write(key, len(content), len(payload))
+                else:
+                    self.vector_storage[key] = payload
+                    self.access_stats.record_write(key, value.nbytes, len(payload))
+                self.version_control.create_version(key, content)
+                self._commit_versions(key, versions)
+                self.metadata_store[key] = metadata or {}
+                self._journal(OP_TEXT if isinstance(value, str) else OP_VECTOR, key, payload, metadata)
+            failed = self.cache_manager.put_many(texts, local=False) if texts else []
+        if failed:
+            logger.warning("Memcached did not take %s; other nodes cannot read them until rewritten", failed)
+        for index, (key, _) in enumerate(items):
+            errors[index] = errors[latest[key]]
+        return errors
+
+    def retrieve_many(self, keys: List[str]) -> List[Union[str, np.ndarray, Exception]]:
+        """
+        Retrieve several texts and/or vectors at once with a single get_multi call,
+        decompressing in the thread pool.
+
+        :param keys: Keys to retrieve
+        :return: One entry per key, in input order: the value or the exception raised (KeyError if missing)
+        """
+        cached = self.cache_manager.get_many([key for key in keys if key not in self.vector_storage and key not in self.text_storage])
+        payloads = []
+        for key in keys:
+            if key in self.vector_storage:
+                payloads.append((False, self.vector_storage[key]))
+            elif key in self.text_storage:
+                payloads.append((True, self.text_storage[key]))
+            elif key in cached:
+                payloads.append((True, cached[key]))
+            else:
+                payloads.append((None, KeyError(f"No data found for key: {key}")))
+        values = list(self.executor.map(self._decompress_item, payloads))
+        for key, value in zip(keys, values):
+            if isinstance(value, str):
+                self.access_stats.record_read(key, len(value), True if key in cached else None)
+            elif not isinstance(value, Exception):
+                self.access_stats.record_read(key, value.nbytes)
+        return values
+
+    def _compress_item(self, value: Union[str, np.ndarray, torch.Tensor]) -> Union[bytes, Exception]:
+        try:
+            if isinstance(value, str):
+                return self.compression_service.compress(value.encode('utf-8'))
+            return self._encode_vector(value)
+        except Exception as e:
+            return e
+
+    def _decompress_item(self, item: Tuple[Optional[bool], Any]) -> Union[str, np.ndarray, Exception]:
+        is_text, payload = item
+        if isinstance(payload, Exception):
+            return payload
+        try:
+            if not is_text:
+                return self._decode_vector(payload)
+            return bytes(self.compression_service.decompress(payload)).decode('utf-8')
+        except Exception as e:
+            return e
+
     def update_tensor(self, key:str, tensor:Union[np.ndarray, torch.Tensor]):
         with self.synchronization_service.lock(key):
             self.store_tensor(key, tensor)
-            self.version_control.create_version(key)
+
+    def store_on_device(self, key: str, tensor: Union[np.ndarray, torch.Tensor], device_index: Optional[int] = None) -> int:
+        """
+        Place tensor on a device of device_pool (the least loaded one by default).
+
+        :return: Index of the device holding it
+        """
+        if self.device_pool is None:
+            raise ValueError("device_pool must be set to place tensors on devices")
+        with self._write_lock(f"device:{key}"):
+            return self.device_pool.store(key, tensor, device_index)
+
+    def retrieve_from_device(self, key: str, device_index: Optional[int] = None) -> Union[np.ndarray, torch.Tensor]:
+        if self.device_pool is None:
+            raise KeyError(f"No device data for key: {key}")
+        return self.device_pool.retrieve(key, device_index)
 
     def store_on_gpu(self, key: str, tensor: torch.Tensor, device_index: int):
-        with self.distributed_lock_manager.lock(f"gpu:{key}"):
-            self.gpu_memory_manager.store_on_gpu(key, tensor, device_index)
+        self.store_on_device(key, tensor, device_index)
 
     def retrieve_from_gpu(self, key: str, device_index: int) -> torch.Tensor:
-        with self.distributed_lock_manager.lock(f"gpu:{key}"):
-            return self.gpu_memory_manager.retrieve_from_gpu(key, device_index)
+        return self.retrieve_from_device(key, device_index)
 
     
+    def get_memory_usage(self) -> Dict[str, Any]:
+        """
+        Current allocator accounting: budget, bytes used and reserved, usage per tier and
+        prefix, and back-pressure counters.
+        """
+        return self.memory_allocator.get_metrics()
+
+    def get_access_stats(self) -> Dict[str, Any]:
+        """
+        Per-prefix reads, writes, bytes in/out, compression ratio, lock wait and cache hit
+        rate, plus the hottest and most lock-contended keys.
+        """
+        return self.access_stats.snapshot()
+
+    def _publish_stats(self, interval: float):
+        client = redis_client()
+        while True:
+            time.sleep(interval)
+            try:
+                self.access_stats.publish(client, ttl=max(int(interval * 3), 1))
+            except redis.exceptions.RedisError:
+                # Stats are best effort; try again next interval
+                continue
+
     def get_metadata(self,key:str)-> Dict[str, Any]:
         return self.metadata_store[key]
     
     def set_metadata(self, key: str, metadata: Dict[str, Any]):
-        self.metadata_store[key] = metadata
\ No newline at end of file
+        with self.synchronization_service.lock(key):
+            self.metadata_store[key] = metadata
+            self._journal(OP_METADATA, key, None, metadata)
+
+    def find_keys(self, **conditions: Any) -> List[str]:
+        """
+        Keys whose metadata matches every condition, e.g.
+        find_keys(session_id="abc", created_at__gt=t). Supported lookups: exact, in, gt,
+        gte, lt, lte; conditions on metadata_fields are served from the index.
+        """
+        return self.metadata_store.query(**conditions)
+
+    def snapshot(self):
+        """
+        Write a compact snapshot of texts, vectors, metadata and versions, and drop the
+        journal segments it replaces. Writes are paused only while state is captured.
+        """
+        if self.journal is None:
+            raise ValueError("persistence_dir must be set to take snapshots")
+        with self.journal.snapshot_lock:
+            with self.synchronization_service.lock_all():
+                segment = self.journal.rotate()
+                texts = dict(self.text_storage)
+                vectors = dict(self.vector_storage)
+                metadata = {key: self.metadata_store[key] for key in self.metadata_store}
+                versions = self.version_control.export_state()
+            self.journal.write_snapshot(self._snapshot_records(texts, vectors, metadata, versions), segment)
+
+    def _journal(self, op: int, key: str, payload: Optional[bytes], metadata: Optional[Dict[str, Any]]):
+        if self.journal is None:
+            return
+        if payload is not None:
+            self.journal.append(op, key, payload)
+        self.journal.append(OP_METADATA, key, json.dumps(metadata or {}, default=json_default).encode('utf-8'))
+
+    @staticmethod
+    def _snapshot_records(texts: Dict[str, bytes], vectors: Dict[str, bytes], metadata: Dict[str, Dict[str, Any]], versions):
+        records, next_version, objects, refcounts = versions
+        for digest, obj in objects.items():
+            yield OP_OBJECT, digest, pack_object(refcounts[digest], obj)
+        for key, key_records in records.items():
+            yield OP_VERSIONS, key, pack_versions(next_version.get(key, 0), key_records)
+        for key, payload in texts.items():
+            yield OP_TEXT, key, payload
+        for key, payload in vectors.items():
+            yield OP_VECTOR, key, payload
+        for key, value in metadata.items():
+            yield OP_METADATA, key, json.dumps(value, default=json_default).encode('utf-8')
+
+    def _warm_start(self):
+        """
+        Rebuild state from the snapshot, then replay journal records written after it.
+        Replayed writes create their versions again; snapshot versions are restored as-is.
+        """
+        records, next_version, objects, refcounts = {}, {}, {}, {}
+        restored = False
+        for op, key, payload, from_snapshot in self.journal.replay():
+            if op == OP_OBJECT:
+                refcounts[key], objects[key] = unpack_object(payload)
+                continue
+            if op == OP_VERSIONS:
+                next_version[key], records[key] = unpack_versions(payload)
+                continue
+            if not from_snapshot and not restored:
+                self.version_control.import_state(records, next_version, objects, refcounts)
+                restored = True
+            if op == OP_TEXT:
+                if self._restore_value(key, payload, self.text_storage) and not from_snapshot:
+                    self.version_control.create_version(key, bytes(self.compression_service.decompress(payload)))
+            elif op == OP_VECTOR:
+                if self._restore_value(key, payload, self.vector_storage) and not from_snapshot:
+                    self.version_control.create_version(key, payload)
+            elif op == OP_METADATA:
+                self.metadata_store[key] = json.loads(payload, object_hook=json_object_hook)
+            elif op == OP_DELETE:
+                self.text_storage.pop(key, None)
+                self.vector_storage.pop(key, None)
+                self.memory_allocator.deallocate(key)
+                self.metadata_store.delete(key)
+                self.version_control.delete(key)
+        if not restored:
+            self.version_control.import_state(records, next_version, objects, refcounts)
+        for key in list(self.version_control.versions):
+            try:
+                self.memory_allocator.allocate(self._versions_key(key), self.version_control.footprint(key))
+            except MemoryBudgetExceeded:
+                logger.warning("Dropped the versions of %s on warm start: they no longer fit the memory budget", key)
+                self.version_control.delete(key)
+
+    def _restore_value(self, key: str, payload: bytes, storage: Dict[str, bytes]) -> bool:
+        """
+        Put a replayed value back with its allocation. A value the budget no longer fits
+        (budgets may have shrunk since it was written) is dropped instead.
+
+        :return: Whether the value was restored
+        """
+        try:
+            self.memory_allocator.allocate(key, len(payload))
+        except MemoryBudgetExceeded:
+            logger.warning("Dropped %s on warm start: it no longer fits the memory budget", key)
+            self.text_storage.pop(key, None)
+            self.vector_storage.pop(key, None)
+            self.memory_allocator.deallocate(key)
+            return False
+        storage[key] = payload
+        return True
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import fcntl
+import json
+import mmap
+import os
+import uuid
+import numpy as np
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Union
+
+from synapse.memory_manager.torch_compat import is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+
+class SharedTensorStore:
+    def __init__(self, directory: str = "/dev/shm/synapse"):
+        """
+        Cross-process tensor store backed by memory-mapped files (tmpfs under /dev/shm).
+        A tensor is written once into an immutable segment file and every worker maps it
+        read-only, so all processes share the same physical pages.
+
+        The index file maps key -> (segment, offset, dtype, shape) and counts references
+        per segment: one for the key pointing at it and one per attach() from a reader.
+        A segment is unlinked once nothing references it.
+
+        :param directory: Directory holding the segments and the index; use a tmpfs path
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._index = {"keys": {}, "segments": {}}
+        self._index_stamp = None
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._attached: Dict[str, int] = {}
+
+    def put(self, key: str, tensor: Union[np.ndarray, torch.Tensor]):
+        """
+        Write tensor into a new segment and point key at it. Readers holding views of the
+        previous value keep them; that segment is removed when its last reference goes.
+        """
+        if is_tensor(tensor):
+            tensor = tensor.cpu().numpy()
+        if tensor.dtype.hasobject:
+            raise TypeError("Object arrays cannot be stored in shared memory")
+        segment = f"{uuid.uuid4().hex}.seg"
+        path = os.path.join(self.directory, segment)
+        tmp_path = path + ".tmp"
+        size = max(tensor.nbytes, 1)
+        with open(tmp_path, "wb+") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mm:
+                np.ndarray(tensor.shape, dtype=tensor.dtype, buffer=mm)[...] = tensor
+                mm.flush()
+        os.rename(tmp_path, path)
+        with self._locked_index() as index:
+            previous = index["keys"].get(key)
+            index["keys"][key] = {"segment": segment, "offset": 0, "dtype": tensor.dtype.str, "shape": list(tensor.shape)}
+            index["segments"][segment] = 1
+            if previous is not None:
+                self._decref(index, previous["segment"])
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        :return: A read-only numpy view over the shared segment
+        :raises KeyError: if key is not stored
+        """
+        entry = self._read_index()["keys"].get(key)
+        if entry is None:
+            raise KeyError(f"No shared tensor for key: {key}")
+        try:
+            return self._view(entry)
+        except FileNotFoundError:
+            pass
+        # Overwritten or deleted since the index was read; segments are only unlinked
+        # under the lock, so the entry read while holding it can be mapped
+        with self._index_lock(fcntl.LOCK_SH):
+            self._index_stamp = None
+            entry = self._read_index()["keys"].get(key)
+            if entry is None:
+                raise KeyError(f"No shared tensor for key: {key}")
+            return self._view(entry)
+
+    def attach(self, key: str) -> np.ndarray:
+        """
+        Like get(), but holds a reference on the segment so it survives an overwrite or
+        delete of key until release() is called.
+        """
+        with self._locked_index() as index:
+            entry = index["keys"].get(key)
+            if entry is None:
+                raise KeyError(f"No shared tensor for key: {key}")
+            index["segments"][entry["segment"]] += 1
+        self._attached[entry["segment"]] = self._attached.get(entry["segment"], 0) + 1
+        return self._view(entry)
+
+    def release(self, array: np.ndarray):
+        """
+        Drop the reference taken by attach() for the segment backing array.
+        """
+        segment = next((name for name, mm in self._maps.items() if _shares_buffer(array, mm)), None)
+        if segment is None or not self._attached.get(segment):
+            raise ValueError("Array was not attached from this store")
+        self._attached[segment] -= 1
+        with self._locked_index() as index:
+            self._decref(index, segment)
+
+    def delete(self, key: str):
+        with self._locked_index() as index:
+            entry = index["keys"].pop(key, None)
+            if entry is not None:
+                self._decref(index, entry["segment"])
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._read_index()["keys"]
+
+    def keys(self):
+        return list(self._read_index()["keys"])
+
+    def close(self):
+        """
+        Release this process's attachments and unmap its segments.
+        """
+        attached = {segment: count for segment, count in self._attached.items() if count}
+        if attached:
+            with self._locked_index() as index:
+                for segment, count in attached.items():
+                    for _ in range(count):
+                        self._decref(index, segment)
+        self._attached.clear()
+        for mm in self._maps.values():
+            try:
+                mm.close()
+            except BufferError:
+                # Views handed out are still alive; the mapping goes away with them.
+                pass
+        self._maps.clear()
+
+    def _view(self, entry: dict) -> np.ndarray:
+        mm = self._map(entry["segment"])
+        shape = tuple(entry["shape"])
+        # frombuffer holds a buffer export, so the mapping cannot be closed under a live view
+        count = int(np.prod(shape))
+        return np.frombuffer(mm, dtype=np.dtype(entry["dtype"]), count=count, offset=entry["offset"]).reshape(shape)
+
+    def _map(self, segment: str) -> mmap.mmap:
+        mm = self._maps.get(segment)
+        if mm is None:
+            with open(os.path.join(self.directory, segment), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mm
+        return mm
+
+    def _decref(self, index: dict, segment: str):
+        index["segments"][segment] -= 1
+        if index["segments"][segment] <= 0:
+            del index["segments"][segment]
+            try:
+                os.unlink(os.path.join(self.directory, segment))
+            except FileNotFoundError:
+                pass
+            mm = self._maps.pop(segment, None)
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass
+
+    def _read_index(self) -> dict:
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return self._index
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp != self._index_stamp:
+            with open(self.index_path) as f:
+                self._index = json.load(f)
+            self._index_stamp = stamp
+            self._drop_stale_maps()
+        return self._index
+
+    def _drop_stale_maps(self):
+        """
+        Unmap segments other processes removed from the index, so their pages are freed.
+        """
+        for segment in [segment for segment in self._maps if segment not in self._index["segments"]]:
+            try:
+                self._maps[segment].close()
+            except BufferError:
+                # Views handed out still use it; retried on the next reload
+                continue
+            del self._maps[segment]
+
+    @contextmanager
+    def _index_lock(self, operation: int = fcntl.LOCK_EX):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked_index(self):
+        with self._index_lock():
+            self._index_stamp = None
+            index = self._read_index()
+            yield index
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_stamp = None
+
+
+def _shares_buffer(array: np.ndarray, mm: mmap.mmap) -> bool:
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    return base is mm
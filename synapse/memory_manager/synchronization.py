@@ -1,30 +1,454 @@
-from threading import Lock
+import asyncio
+import random
+import time
+import uuid
+from threading import Condition, Lock, RLock, Thread
 import redis
 from connections.db import redis_client
-from contextlib import contextmanager
+from synapse.memory_manager.access_stats import key_prefix
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional
 
-class SynchronizationService:
-    def __init__(self):
-        self.locks = {}
+# Deletes the lock only if it is still held by the caller's token.
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
-    def lock(self, key:str):
-        if key not in self.locks:
-            self.locks[key] = Lock()
-        return self.locks[key]
-    
+# Takes the lease and hands out the next fencing token in one step.
+ACQUIRE_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('incr', KEYS[2])
+end
+return false
+"""
 
-class DistributedLockManager:
+# Extends the lease only if it is still held by the caller's token.
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Accepts a write only from the current holder and never from an older fencing token.
+FENCE_SCRIPT = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+local last = tonumber(redis.call('get', KEYS[2]) or '0')
+if tonumber(ARGV[2]) < last then
+    return 0
+end
+redis.call('set', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+class LeaseLostError(redis.exceptions.LockError):
+    pass
+
+
+class LockMetrics:
     def __init__(self):
-        self.redis = redis_client()
+        """
+        Wait time and contention per key prefix (the part of the key before the first ':',
+        or '*' for keys without one).
+        """
+        self._lock = Lock()
+        self.prefixes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, key: str, waited: float, attempts: int, acquired: bool):
+        with self._lock:
+            stats = self._stats(key)
+            stats["acquisitions" if acquired else "timeouts"] += 1
+            stats["contended"] += attempts > 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def record_lost(self, key: str):
+        with self._lock:
+            self._stats(key)["lost"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {prefix: dict(stats) for prefix, stats in self.prefixes.items()}
+
+    def _stats(self, key: str) -> Dict[str, float]:
+        prefix = key_prefix(key)
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = {"acquisitions": 0, "timeouts": 0, "contended": 0, "lost": 0, "wait_total": 0.0, "wait_max": 0.0}
+        return self.prefixes[prefix]
+
+
+class Lease:
+    def __init__(self, manager: "LeaseManager", key: str, token: str, fencing_token: int, ttl: float):
+        self.manager = manager
+        self.key = key
+        self.token = token
+        self.fencing_token = fencing_token
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+        self.lost = False
+
+    @property
+    def valid(self) -> bool:
+        """
+        Local view of whether the lease is still held; no Redis round trip.
+        """
+        return not self.lost and time.monotonic() < self.expires_at
+
+    def release(self):
+        self.manager.release(self)
+
+
+class LeaseManager:
+    def __init__(self, clients: Optional[List[redis.Redis]] = None, ttl: float = 10, renew: bool = True, metrics: Optional[LockMetrics] = None):
+        """
+        Redlock-style leases. A lease is held when a majority of clients granted it within
+        its ttl; with a single client this is a plain Redis lock. Held leases are renewed
+        in the background at a third of their ttl, and every lease carries a fencing token
+        that only grows per key, so writes from a holder that lost its lease can be rejected.
+
+        :param clients: Independent Redis instances; defaults to the shared client
+        :param ttl: Default lease duration in seconds
+        :param renew: Renew held leases in a background thread
+        :param metrics: Where to record wait time and contention
+        """
+        self.clients = clients or [redis_client()]
+        self.quorum = len(self.clients) // 2 + 1
+        self.ttl = ttl
+        self.renew = renew
+        self.metrics = metrics or LockMetrics()
+        self._acquire_scripts = [client.register_script(ACQUIRE_SCRIPT) for client in self.clients]
+        self._renew_scripts = [client.register_script(RENEW_SCRIPT) for client in self.clients]
+        self._release_scripts = [client.register_script(RELEASE_SCRIPT) for client in self.clients]
+        self._fence_scripts = [client.register_script(FENCE_SCRIPT) for client in self.clients]
+        self._leases: Dict[str, Lease] = {}
+        self._condition = Condition()
+        self._renewer: Optional[Thread] = None
+
+    def try_acquire(self, key: str, ttl: Optional[float] = None) -> Optional[Lease]:
+        """
+        Make a single attempt at the lease.
+
+        :return: The lease, or None if a quorum could not be reached
+        """
+        ttl = ttl or self.ttl
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+        fences = []
+        for script in self._acquire_scripts:
+            try:
+                fence = script(keys=[f"lock:{key}", f"fence:{key}"], args=[token, int(ttl * 1000)])
+            except redis.exceptions.ConnectionError:
+                fence = None
+            if fence:
+                fences.append(int(fence))
+        elapsed = time.monotonic() - started
+        if len(fences) < self.quorum or elapsed >= ttl:
+            self._release_tokens({key: token})
+            return None
+        lease = Lease(self, key, token, max(fences), ttl - elapsed)
+        if self.renew:
+            self._track(lease)
+        return lease
+
+    def try_acquire_many(self, keys: List[str], ttl: Optional[float] = None) -> Optional[Dict[str, Lease]]:
+        """
+        Make a single all-or-nothing attempt at the leases of several keys: one pipelined
+        round trip per client, keys in sorted order. If any key misses its quorum, every
+        lease granted in the attempt is released.
+
+        :return: Leases by key, or None if the attempt failed
+        """
+        ttl = ttl or self.ttl
+        tokens = {key: uuid.uuid4().hex for key in sorted(set(keys))}
+        started = time.monotonic()
+        fences: Dict[str, List[int]] = {key: [] for key in tokens}
+        for client, script in zip(self.clients, self._acquire_scripts):
+            pipe = client.pipeline(transaction=False)
+            for key, token in tokens.items():
+                script(keys=[f"lock:{key}", f"fence:{key}"], args=[token, int(ttl * 1000)], client=pipe)
+            try:
+                replies = pipe.execute()
+            except redis.exceptions.ConnectionError:
+                continue
+            for key, fence in zip(tokens, replies):
+                if fence:
+                    fences[key].append(int(fence))
+        elapsed = time.monotonic() - started
+        if elapsed >= ttl or any(len(granted) < self.quorum for granted in fences.values()):
+            self._release_tokens(tokens)
+            return None
+        leases = {key: Lease(self, key, token, max(fences[key]), ttl - elapsed) for key, token in tokens.items()}
+        if self.renew:
+            for lease in leases.values():
+                self._track(lease)
+        return leases
+
+    def acquire(self, key: str, ttl: Optional[float] = None, timeout: float = 10, backoff: float = 0.01, max_backoff: float = 0.5) -> Lease:
+        """
+        Retry with jittered exponential backoff until the lease is acquired.
+
+        :raises redis.exceptions.LockError: if it could not be acquired within timeout
+        """
+        started = time.monotonic()
+        attempts = 0
+        delay = backoff
+        while True:
+            attempts += 1
+            lease = self.try_acquire(key, ttl)
+            waited = time.monotonic() - started
+            if lease is not None:
+                self.metrics.record(key, waited, attempts, True)
+                return lease
+            if waited >= timeout:
+                self.metrics.record(key, waited, attempts, False)
+                raise redis.exceptions.LockError(f"Timed out acquiring lease for: {key}")
+            time.sleep(min(delay * random.uniform(0.5, 1.5), max(timeout - waited, 0)))
+            delay = min(delay * 2, max_backoff)
+
+    def acquire_many(self, keys: List[str], ttl: Optional[float] = None, timeout: float = 10, backoff: float = 0.01,
+                     max_backoff: float = 0.5) -> Dict[str, Lease]:
+        """
+        Retry try_acquire_many with jittered exponential backoff. Failed attempts hold
+        nothing while backing off, so overlapping batches cannot livelock.
+
+        :raises redis.exceptions.LockError: if the leases could not be acquired within timeout
+        """
+        started = time.monotonic()
+        attempts = 0
+        delay = backoff
+        while True:
+            attempts += 1
+            leases = self.try_acquire_many(keys, ttl)
+            waited = time.monotonic() - started
+            if leases is not None:
+                for key in leases:
+                    self.metrics.record(key, waited, attempts, True)
+                return leases
+            if waited >= timeout:
+                for key in set(keys):
+                    self.metrics.record(key, waited, attempts, False)
+                raise redis.exceptions.LockError(f"Timed out acquiring leases for: {sorted(set(keys))}")
+            time.sleep(min(delay * random.uniform(0.5, 1.5), max(timeout - waited, 0)))
+            delay = min(delay * 2, max_backoff)
+
+    async def acquire_async(self, key: str, ttl: Optional[float] = None, timeout: float = 10, backoff: float = 0.01, max_backoff: float = 0.5) -> Lease:
+        """
+        Like acquire(), but waits with asyncio.sleep and runs Redis calls off the event loop.
+        """
+        started = time.monotonic()
+        attempts = 0
+        delay = backoff
+        while True:
+            attempts += 1
+            lease = await asyncio.to_thread(self.try_acquire, key, ttl)
+            waited = time.monotonic() - started
+            if lease is not None:
+                self.metrics.record(key, waited, attempts, True)
+                return lease
+            if waited >= timeout:
+                self.metrics.record(key, waited, attempts, False)
+                raise redis.exceptions.LockError(f"Timed out acquiring lease for: {key}")
+            await asyncio.sleep(min(delay * random.uniform(0.5, 1.5), max(timeout - waited, 0)))
+            delay = min(delay * 2, max_backoff)
+
+    def release(self, lease: Lease):
+        self.release_many([lease])
+
+    def release_many(self, leases: List[Lease]):
+        with self._condition:
+            for lease in leases:
+                if self._leases.get(lease.token) is lease:
+                    del self._leases[lease.token]
+        self._release_tokens({lease.key: lease.token for lease in leases})
+        for lease in leases:
+            lease.lost = True
+
+    def validate(self, lease: Lease) -> bool:
+        """
+        Fencing check for a write: succeeds only if the lease is still held on a quorum and no
+        write with a newer fencing token has been accepted for the key. The comparison and
+        recording the token as the key's latest happen in one script.
+        """
+        return self.validate_many([lease])[lease.key]
+
+    def validate_many(self, leases: List[Lease]) -> Dict[str, bool]:
+        """
+        validate() for several leases in one pipelined round trip per client.
+
+        :return: Whether the write may commit, by key
+        """
+        accepted = {lease.key: 0 for lease in leases}
+        live = [lease for lease in leases if lease.valid]
+        for client, script in zip(self.clients, self._fence_scripts):
+            pipe = client.pipeline(transaction=False)
+            for lease in live:
+                script(keys=[f"lock:{lease.key}", f"fence:last:{lease.key}"], args=[lease.token, lease.fencing_token], client=pipe)
+            try:
+                replies = pipe.execute()
+            except redis.exceptions.ConnectionError:
+                continue
+            for lease, reply in zip(live, replies):
+                accepted[lease.key] += bool(reply)
+        return {key: count >= self.quorum for key, count in accepted.items()}
 
     @contextmanager
-    def lock(self, key: str, timeout: int = 10):
-        lock = self.redis.lock(f"lock:{key}", timeout=timeout)
+    def lease(self, key: str, ttl: Optional[float] = None, timeout: float = 10):
+        lease = self.acquire(key, ttl, timeout)
         try:
-            lock.acquire()
+            yield lease
+        finally:
+            lease.release()
+
+    @contextmanager
+    def leases(self, keys: List[str], ttl: Optional[float] = None, timeout: float = 10):
+        leases = self.acquire_many(keys, ttl, timeout)
+        try:
+            yield leases
+        finally:
+            self.release_many(list(leases.values()))
+
+    @asynccontextmanager
+    async def lease_async(self, key: str, ttl: Optional[float] = None, timeout: float = 10):
+        lease = await self.acquire_async(key, ttl, timeout)
+        try:
+            yield lease
+        finally:
+            await asyncio.to_thread(lease.release)
+
+    def _release_tokens(self, tokens: Dict[str, str]):
+        if not tokens:
+            return
+        for client, script in zip(self.clients, self._release_scripts):
+            pipe = client.pipeline(transaction=False)
+            for key, token in tokens.items():
+                script(keys=[f"lock:{key}"], args=[token], client=pipe)
+            try:
+                pipe.execute()
+            except redis.exceptions.ConnectionError:
+                pass
+
+    def _track(self, lease: Lease):
+        with self._condition:
+            self._leases[lease.token] = lease
+            if self._renewer is None or not self._renewer.is_alive():
+                self._renewer = Thread(target=self._renew_loop, name="lease-renewer", daemon=True)
+                self._renewer.start()
+            self._condition.notify()
+
+    def _renew_loop(self):
+        while True:
+            with self._condition:
+                while not self._leases:
+                    self._condition.wait()
+                now = time.monotonic()
+                due = [lease for lease in self._leases.values() if lease.expires_at - lease.ttl * 2 / 3 <= now]
+                if not due:
+                    next_due = min(lease.expires_at - lease.ttl * 2 / 3 for lease in self._leases.values())
+                    self._condition.wait(max(next_due - now, 0.001))
+                    continue
+            for lease in due:
+                self._renew(lease)
+
+    def _renew(self, lease: Lease):
+        started = time.monotonic()
+        renewed = 0
+        for script in self._renew_scripts:
+            try:
+                renewed += bool(script(keys=[f"lock:{lease.key}"], args=[lease.token, int(lease.ttl * 1000)]))
+            except redis.exceptions.ConnectionError:
+                pass
+        with self._condition:
+            if self._leases.get(lease.token) is not lease:
+                return
+            if renewed >= self.quorum:
+                lease.expires_at = started + lease.ttl
+            else:
+                lease.lost = True
+                del self._leases[lease.token]
+                self.metrics.record_lost(lease.key)
+
+
+class SynchronizationService:
+    def __init__(self, num_stripes: int = 64):
+        """
+        Striped in-process locks: keys hash onto a fixed set of reentrant locks, so memory
+        stays bounded and no shared dict is mutated on the lock path.
+
+        :param num_stripes: Number of locks keys are spread over
+        """
+        self.stripes = [RLock() for _ in range(num_stripes)]
+
+    def lock(self, key:str) -> RLock:
+        return self.stripes[self._stripe(key)]
+
+    @contextmanager
+    def lock_many(self, keys: list[str]):
+        """
+        Hold the stripes of all keys, acquired in stripe order so concurrent batches cannot deadlock.
+        """
+        with self._hold(sorted({self._stripe(key) for key in keys})):
+            yield
+
+    @contextmanager
+    def lock_all(self):
+        """
+        Hold every stripe, e.g. to take a consistent snapshot while no write is in flight.
+        """
+        with self._hold(range(len(self.stripes))):
+            yield
+
+    @contextmanager
+    def _hold(self, stripes):
+        acquired = []
+        try:
+            for stripe in stripes:
+                self.stripes[stripe].acquire()
+                acquired.append(stripe)
             yield
         finally:
-            lock.release()
+            for stripe in reversed(acquired):
+                self.stripes[stripe].release()
+
+    def _stripe(self, key: str) -> int:
+        return hash(key) % len(self.stripes)
+
+
+class DistributedLockManager:
+    def __init__(self, lease_manager: Optional[LeaseManager] = None):
+        self.redis = redis_client()
+        self.lease_manager = lease_manager or LeaseManager([self.redis])
+
+    @contextmanager
+    def lock(self, key: str, timeout: int = 10, blocking_timeout: float = 10):
+        """
+        Hold a renewed lease on key for the duration of the block.
+
+        :param timeout: Lease ttl in seconds; the lease is renewed while held
+        :param blocking_timeout: Maximum time in seconds to wait for the lease
+        :return: The Lease, whose fencing_token identifies this holder's writes
+        """
+        with self.lease_manager.lease(key, ttl=timeout, timeout=blocking_timeout) as lease:
+            yield lease
+
+    @contextmanager
+    def lock_many(self, keys: list[str], timeout: int = 10, blocking_timeout: float = 10):
+        """
+        Hold renewed leases on several keys for the duration of the block, acquired
+        all-or-nothing (see LeaseManager.acquire_many).
+
+        :param keys: Keys to lock; duplicates are ignored
+        :param timeout: Lease ttl in seconds; the leases are renewed while held
+        :param blocking_timeout: Maximum time in seconds to wait for all leases
+        :return: Leases by key, each with its own fencing token
+        """
+        with self.lease_manager.leases(keys, ttl=timeout, timeout=blocking_timeout) as leases:
+            yield leases
 
     def is_locked(self, key: str) -> bool:
-        return self.redis.exists(f"lock:{key}")
\ No newline at end of file
+        return self.redis.exists(f"lock:{key}")
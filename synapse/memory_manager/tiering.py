@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import io
+import logging
+import time
+import numpy as np
+import pylibmc
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+from synapse.memory_manager.control import MemoryAllocator, MemoryBudgetExceeded
+from synapse.memory_manager.synchronization import SynchronizationService
+from synapse.memory_manager.torch_compat import is_tensor
+
+if TYPE_CHECKING:
+    import torch
+
+RAM = "ram"
+CACHE = "cache"
+MMAP = "mmap"
+
+logger = logging.getLogger(__name__)
+
+
+class AccessTracker:
+    def __init__(self, half_life: float = 300):
+        """
+        Exponentially decayed access counts: a key's score halves every half_life seconds
+        without access, so it reflects both frequency and recency.
+
+        Scores are updated without locking; concurrent touches of a key may lose an
+        increment, which only makes the heuristic slightly slower to promote.
+        """
+        self.half_life = half_life
+        self.scores: Dict[str, float] = {}
+        self.last_access: Dict[str, float] = {}
+
+    def touch(self, key: str, now: Optional[float] = None) -> float:
+        now = now or time.monotonic()
+        score = self.score(key, now) + 1
+        self.scores[key] = score
+        self.last_access[key] = now
+        return score
+
+    def score(self, key: str, now: Optional[float] = None) -> float:
+        score = self.scores.get(key)
+        if score is None:
+            return 0.0
+        now = now or time.monotonic()
+        return score * 0.5 ** ((now - self.last_access.get(key, now)) / self.half_life)
+
+    def forget(self, key: str):
+        self.scores.pop(key, None)
+        self.last_access.pop(key, None)
+
+
+class TieringEngine:
+    def __init__(self, allocator: MemoryAllocator, cache_manager, mmap_manager, compression_service,
+                 ram_budget: int, cache_item_limit: int = 1000000, promote_threshold: float = 3.0, half_life: float = 300,
+                 num_stripes: int = 64):
+        """
+        Places arrays in one of three tiers and moves them as access patterns change:
+        hot keys live decompressed in process memory, cold keys are demoted to memcached
+        (compressed) or, when too large for a memcached item, to mmap files.
+
+        Demoting always writes the key's mmap file first, the durable copy; memcached only
+        holds an extra compressed copy that reads use while it keeps it, and a set memcached
+        did not acknowledge leaves the key on mmap. A RAM copy is dropped only once its
+        durable copy is written.
+
+        The allocator accounts the bytes of each tier and the RAM tier is kept under
+        ram_budget by demoting the lowest-scoring keys. Keys lock individually (striped):
+        reading a RAM-resident key takes no lock, and loading, promoting or demoting a key
+        holds only that key's stripe; keys busy in another thread are skipped as victims.
+
+        :param ram_budget: Bytes of in-process memory the RAM tier may use
+        :param cache_item_limit: Largest compressed payload sent to memcached
+        :param promote_threshold: Access score at which a key is promoted to RAM
+        :param half_life: Seconds for an idle key's access score to halve
+        :param num_stripes: Number of locks keys are spread over
+        """
+        self.allocator = allocator
+        self.cache_manager = cache_manager
+        self.mmap_manager = mmap_manager
+        self.compression_service = compression_service
+        self.ram_budget = ram_budget
+        self.cache_item_limit = cache_item_limit
+        self.promote_threshold = promote_threshold
+        self.tracker = AccessTracker(half_life)
+        self.ram: Dict[str, np.ndarray] = {}
+        # Tier of every key the engine holds; other users of the allocator are not listed
+        self.tiers: Dict[str, str] = {}
+        self._locks = SynchronizationService(num_stripes)
+
+    def put(self, key: str, data: Union[np.ndarray, torch.Tensor]):
+        """
+        Store data in RAM when it fits the budget (possibly after demoting colder keys),
+        otherwise directly in the highest lower tier that accepts it.
+        """
+        if is_tensor(data):
+            data = data.cpu().numpy()
+        with self._locks.lock(key):
+            self._remove(key)
+            self.tracker.touch(key)
+            if data.nbytes <= self.ram_budget:
+                self._place_in_ram(key, data)
+            else:
+                self._demote_value(key, data)
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        :raises KeyError: if key is not stored in any tier
+        """
+        score = self.tracker.touch(key)
+        data = self.ram.get(key)
+        if data is not None:
+            return data
+        with self._locks.lock(key):
+            tier = self.tiers.get(key)
+            if tier is None:
+                self.tracker.forget(key)
+                raise KeyError(f"No tiered data for key: {key}")
+            if tier == RAM:
+                return self.ram[key]
+            data = self._load(key, tier)
+            if score >= self.promote_threshold and data.nbytes <= self.ram_budget:
+                self._promote(key, data, score)
+            return data
+
+    def delete(self, key: str):
+        with self._locks.lock(key):
+            self._remove(key)
+            self.tracker.forget(key)
+
+    def rebalance(self):
+        """
+        Demote RAM keys until usage fits the budget, coldest first. Call after lowering
+        ram_budget or periodically to let idle keys decay out of RAM.
+        """
+        self._enforce_budget(0)
+
+    def free(self, nbytes: int, prefix: Optional[str] = None) -> int:
+        """
+        Demote the coldest RAM keys (only those starting with prefix, if given) until nbytes
+        are freed. Used as the allocator's evictor.
+
+        :return: Bytes freed from the RAM tier
+        """
+        now = time.monotonic()
+        freed = 0
+        candidates = [key for key in list(self.ram) if prefix is None or key.startswith(prefix)]
+        for key in sorted(candidates, key=lambda ram_key: self.tracker.score(ram_key, now)):
+            if freed >= nbytes:
+                break
+            freed += self._demote_from_ram(key)
+        return freed
+
+    def tier_of(self, key: str) -> Optional[str]:
+        """
+        :return: The tier holding key, or None if the engine does not hold it
+        """
+        return self.tiers.get(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {tier: sum(self.allocator.get_allocation(key) for key, key_tier in list(self.tiers.items()) if key_tier == tier)
+                for tier in (RAM, CACHE, MMAP)}
+
+    def _promote(self, key: str, data: np.ndarray, score: float):
+        now = time.monotonic()
+        victims = self._coldest_ram_keys(data.nbytes, now)
+        if victims is None or any(self.tracker.score(victim, now) >= score for victim in victims):
+            return
+        old_tier = self.tiers[key]
+        if self._place_in_ram(key, np.array(data)):
+            self._drop_from(key, old_tier)
+
+    def _place_in_ram(self, key: str, data: np.ndarray) -> bool:
+        self._enforce_budget(data.nbytes)
+        try:
+            self.allocator.allocate(key, data.nbytes, RAM)
+        except MemoryBudgetExceeded:
+            # Other RAM users hold the budget; keep the value in a lower tier instead
+            if key not in self.tiers:
+                self._demote_value(key, data)
+            return False
+        self.ram[key] = data
+        self.tiers[key] = RAM
+        return True
+
+    def _enforce_budget(self, incoming: int):
+        for victim in self._coldest_ram_keys(incoming, time.monotonic()) or []:
+            self._demote_from_ram(victim)
+
+    def _coldest_ram_keys(self, incoming: int, now: float) -> Optional[List[str]]:
+        """
+        :return: The coldest RAM keys whose removal makes room for incoming bytes, or None
+                 if even an empty RAM tier could not hold them
+        """
+        if incoming > self.ram_budget:
+            return None
+        excess = self.allocator.get_usage(RAM) + incoming - self.ram_budget
+        victims = []
+        for key in sorted(list(self.ram), key=lambda ram_key: self.tracker.score(ram_key, now)):
+            if excess <= 0:
+                break
+            victims.append(key)
+            excess -= self.allocator.get_allocation(key)
+        return victims
+
+    def _demote_from_ram(self, key: str) -> int:
+        """
+        Move a RAM key down a tier, unless another thread holds its lock.
+
+        :return: Bytes freed from the RAM tier
+        """
+        lock = self._locks.lock(key)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            data = self.ram.get(key)
+            if data is None or self.tiers.get(key) != RAM:
+                return 0
+            size = self.allocator.get_allocation(key)
+            try:
+                self._demote_value(key, data)
+            except OSError:
+                logger.exception("Demoting %s failed; kept in RAM", key)
+                return 0
+            del self.ram[key]
+            return size
+        finally:
+            lock.release()
+
+    def _demote_value(self, key: str, data: np.ndarray):
+        """
+        Write data's mmap copy, then try memcached, and account data to the tier reads use.
+
+        :raises OSError: if the mmap copy could not be written; nothing is changed then
+        """
+        self.mmap_manager.store_mmap(key, data)
+        # Compression stops as soon as the payload outgrows a memcached item
+        sink = io.BytesIO()
+        size = self.compression_service.compress_into(data, sink, limit=self.cache_item_limit)
+        if size is not None and self._cache_set(key, sink.getvalue()):
+            self.allocator.allocate(key, size, CACHE)
+            self.tiers[key] = CACHE
+        else:
+            self.allocator.allocate(key, data.nbytes, MMAP)
+            self.tiers[key] = MMAP
+
+    def _cache_set(self, key: str, payload: bytes) -> bool:
+        try:
+            return bool(self.cache_manager.client.set(key, payload, time=self.cache_manager.expire_time))
+        except pylibmc.Error:
+            return False
+
+    def _load(self, key: str, tier: str) -> np.ndarray:
+        if tier == CACHE:
+            try:
+                payload = self.cache_manager.client.get(key)
+            except pylibmc.Error:
+                payload = None
+            if payload is not None:
+                return self.compression_service.decompress(payload)
+        data = self.mmap_manager.retrieve_mmap(key)
+        if tier == CACHE:
+            # memcached dropped its copy; serve the key from mmap from now on
+            self.allocator.allocate(key, data.nbytes, MMAP)
+            self.tiers[key] = MMAP
+        return data
+
+    def _drop_from(self, key: str, tier: Optional[str]):
+        if tier == CACHE:
+            try:
+                self.cache_manager.client.delete(key)
+            except pylibmc.Error:
+                pass
+        if tier in (CACHE, MMAP):
+            self.mmap_manager.delete_mmap(key)
+
+    def _remove(self, key: str):
+        tier = self.tiers.pop(key, None)
+        if tier is None:
+            return
+        if tier == RAM:
+            self.ram.pop(key, None)
+        else:
+            self._drop_from(key, tier)
+        self.allocator.deallocate(key)
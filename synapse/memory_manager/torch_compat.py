@@ -0,0 +1,19 @@
+import importlib
+import sys
+
+
+def get_torch():
+    """
+    Import torch on first use, so modules that only handle text or numpy never pay its
+    import time and memory.
+    """
+    return importlib.import_module("torch")
+
+
+def is_tensor(value) -> bool:
+    """
+    isinstance(value, torch.Tensor) without importing torch: if torch was never imported,
+    value cannot be a tensor.
+    """
+    torch = sys.modules.get("torch")
+    return torch is not None and isinstance(value, torch.Tensor)
@@ -95,6 +95,42 @@ DATABASES = {
 }
 
 
+# Redis (one connection pool per URL and db, see connections.db.redis_client)
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '100'))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', '20'))
+
+
+# Memcached (shared by every CacheManager in the process, see connections.db.memcached_client)
+
+MEMCACHED_SERVERS = os.getenv('MEMCACHED_SERVERS', '127.0.0.1:11211').split(',')
+MEMCACHED_POOL_SIZE = int(os.getenv('MEMCACHED_POOL_SIZE', '8'))
+MEMCACHED_HEALTH_CHECK_INTERVAL = float(os.getenv('MEMCACHED_HEALTH_CHECK_INTERVAL', '5'))
+
+
+# Channels carried on Redis Streams with consumer groups instead of pub/sub (comma separated);
+# publishers and subscribers both decide from this list
+
+DURABLE_CHANNELS = [channel for channel in os.getenv('DURABLE_CHANNELS', 'url_processor_channel').split(',') if channel]
+STREAM_MAXLEN = int(os.getenv('STREAM_MAXLEN', '100000'))
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '100'))
+STREAM_CLAIM_IDLE_MS = int(os.getenv('STREAM_CLAIM_IDLE_MS', '30000'))
+
+
+# Threads per memory manager for blocking work (memcached, compression, mmap and partition
+# I/O); this is also how many AsyncSharedMemoryManager calls can run at once per manager
+
+MEMORY_MANAGER_WORKERS = int(os.getenv('MEMORY_MANAGER_WORKERS', str(min(32, (os.cpu_count() or 1) + 4))))
+
+
+# Key-ready notifications: values up to this many bytes are sent inside the event, and
+# node input handlers give up waiting for a key after this many seconds
+
+READY_INLINE_BYTES = int(os.getenv('READY_INLINE_BYTES', '4096'))
+READY_WAIT_TIMEOUT = float(os.getenv('READY_WAIT_TIMEOUT', '30'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
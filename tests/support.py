@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import unittest
+
+import fakeredis
+import redis
+
+from connections import db
+from connections.pubsub import AsyncPubSubTransport
+from synapse.settings import REDIS_URL, MEMCACHED_SERVERS
+
+
+class FakeMemcached:
+    def __init__(self):
+        """
+        In-process stand-in for PooledMemcachedClient. Set accepting to False to make every
+        write fail the way a full or unreachable server does (set returns False).
+        """
+        self.data = {}
+        self.accepting = True
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self.data.get(key)
+
+    def set(self, key, value, time: int = 0):
+        with self._lock:
+            if not self.accepting:
+                return False
+            self.data[key] = value
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return self.data.pop(key, None) is not None
+
+    def get_multi(self, keys):
+        with self._lock:
+            return {key: self.data[key] for key in keys if key in self.data}
+
+    def set_multi(self, mapping, time: int = 0):
+        with self._lock:
+            if not self.accepting:
+                return list(mapping)
+            self.data.update(mapping)
+            return []
+
+    def delete_multi(self, keys):
+        with self._lock:
+            for key in keys:
+                self.data.pop(key, None)
+            return True
+
+
+class BackendTestCase(unittest.TestCase):
+    """
+    Runs each test against a fresh fakeredis server and FakeMemcached, installed as the
+    process-wide Redis pool and memcached client of connections.db.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        self.memcached = FakeMemcached()
+        install_backends(self, self.redis_server, self.memcached)
+        self.redis = db.redis_client()
+
+
+class AsyncBackendTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    BackendTestCase for coroutines: the loop's AsyncPubSubTransport also talks to the fake server.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        self.memcached = FakeMemcached()
+        install_backends(self, self.redis_server, self.memcached)
+        self.redis = db.redis_client()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.async_redis = fakeredis.FakeAsyncRedis(server=self.redis_server)
+        self.transport = AsyncPubSubTransport(client=self.async_redis)
+        AsyncPubSubTransport._instances[asyncio.get_running_loop()] = self.transport
+
+    async def asyncTearDown(self):
+        await self.transport.close()
+        await super().asyncTearDown()
+
+
+def install_backends(test: unittest.TestCase, server: fakeredis.FakeServer, memcached: FakeMemcached):
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=server)
+    redis_key, memcached_key = (REDIS_URL, None), tuple(MEMCACHED_SERVERS)
+    previous = db._redis_pools.get(redis_key), db._memcached_clients.get(memcached_key)
+    db._redis_pools[redis_key] = pool
+    db._memcached_clients[memcached_key] = memcached
+
+    def restore():
+        for registry, key, value in ((db._redis_pools, redis_key, previous[0]),
+                                     (db._memcached_clients, memcached_key, previous[1])):
+            if value is None:
+                registry.pop(key, None)
+            else:
+                registry[key] = value
+    test.addCleanup(restore)
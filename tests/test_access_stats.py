@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.access_stats import AccessStats, CountMinSketch, TopK, collect, key_prefix
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class SketchTest(unittest.TestCase):
+    def test_count_min_never_undercounts(self):
+        sketch = CountMinSketch(width=16, depth=3)
+        for i in range(200):
+            sketch.add(f"k{i % 40}", 1 + i % 3)
+        self.assertGreaterEqual(sketch.estimate("k0"), sum(1 + i % 3 for i in range(0, 200, 40)))
+        self.assertEqual(CountMinSketch().estimate("unseen"), 0)
+
+    def test_top_k_keeps_the_heaviest_keys(self):
+        top = TopK(k=2)
+        for key, count in (("a", 5), ("b", 1), ("c", 9), ("d", 2)):
+            top.add(key, count)
+        self.assertEqual(top.items(), [("c", 9), ("a", 5)])
+        self.assertEqual(len(top.top), 2)
+
+
+class AccessStatsTest(BackendTestCase):
+    def test_counts_per_prefix(self):
+        stats = AccessStats()
+        stats.record_write("user:1", 100, 25)
+        stats.record_read("user:1", 100, hit=True)
+        stats.record_read("user:2", 50, hit=False)
+        stats.record_read("plain", 10)
+        snapshot = stats.snapshot()
+        user = snapshot["prefixes"]["user"]
+        self.assertEqual((user["reads"], user["writes"], user["bytes_out"]), (2, 1, 150))
+        self.assertEqual((user["compression_ratio"], user["cache_hit_rate"]), (4.0, 0.5))
+        self.assertIsNone(snapshot["prefixes"]["*"]["cache_hit_rate"])
+        self.assertEqual(snapshot["hot_keys"][0], {"key": "user:1", "accesses": 2})
+        self.assertEqual(key_prefix("a:b:c"), "a")
+
+    def test_lock_waits_rank_contended_keys(self):
+        stats = AccessStats()
+        stats.record_lock_wait("a", 0.002)
+        stats.record_lock_wait("b", 0.5)
+        stats.record_lock_wait("a", 0.001)
+        snapshot = stats.snapshot()
+        self.assertEqual([entry["key"] for entry in snapshot["contended_keys"]], ["b", "a"])
+        self.assertEqual(snapshot["prefixes"]["*"]["lock_waits"], 3)
+        self.assertAlmostEqual(snapshot["prefixes"]["*"]["lock_wait_max"], 0.5)
+
+    def test_collect_merges_published_and_local_stats(self):
+        remote = AccessStats("remote")
+        remote.record_read("x", 1)
+        remote.publish(self.redis)
+        del remote
+        local = AccessStats("local")
+        local.record_write("y", 1, 1)
+        snapshots = collect(self.redis)
+        self.assertEqual(set(snapshots) & {"remote", "local"}, {"remote", "local"})
+        self.assertEqual(snapshots["remote"]["prefixes"]["*"]["reads"], 1)
+        self.assertGreater(self.redis.ttl("synapse:stats:remote"), 0)
+
+    def test_manager_records_its_traffic(self):
+        memory = SharedMemoryManager("stats", cache_capacity=1 << 20, cache_expire_time=60)
+        memory.store_text("doc:1", "hello " * 100)
+        memory.retrieve_text("doc:1")
+        memory.store_vector("vec:1", np.ones(8, np.float32))
+        memory.retrieve_vector("vec:1")
+        prefixes = memory.access_stats.snapshot()["prefixes"]
+        self.assertEqual((prefixes["doc"]["reads"], prefixes["doc"]["writes"]), (1, 1))
+        self.assertGreater(prefixes["doc"]["compression_ratio"], 1)
+        self.assertEqual(prefixes["vec"]["bytes_out"], 32)
+        self.assertIn("stats", collect())
@@ -0,0 +1,189 @@
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.control import MemoryAllocator, MemoryBudgetExceeded, VersionControl
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class MemoryAllocatorTest(unittest.TestCase):
+    def test_reserve_and_commit(self):
+        allocator = MemoryAllocator(budget=100)
+        with allocator.reserve("a", 60) as reservation:
+            self.assertEqual(allocator.get_metrics()["reserved"], 60)
+            reservation.commit()
+        self.assertEqual(allocator.get_usage("ram"), 60)
+        self.assertEqual(allocator.get_metrics()["reserved"], 0)
+
+    def test_commit_settles_actual_size(self):
+        allocator = MemoryAllocator(budget=100)
+        allocator.reserve("a", 80).commit(30)
+        self.assertEqual(allocator.get_allocation("a"), 30)
+        allocator.allocate("b", 70)
+
+    def test_released_reservation_frees_its_bytes(self):
+        allocator = MemoryAllocator(budget=100)
+        with allocator.reserve("a", 80):
+            pass
+        allocator.allocate("b", 100)
+
+    def test_rewriting_a_key_counts_its_own_bytes_as_free(self):
+        allocator = MemoryAllocator(budget=100)
+        allocator.allocate("a", 80)
+        allocator.allocate("a", 90)
+        self.assertEqual(allocator.get_usage(), 90)
+
+    def test_reject_policy(self):
+        allocator = MemoryAllocator(budget=100, policy="reject")
+        allocator.allocate("a", 80)
+        with self.assertRaises(MemoryBudgetExceeded):
+            allocator.allocate("b", 30)
+        self.assertEqual(allocator.get_metrics()["rejections"], 1)
+
+    def test_prefix_budgets(self):
+        allocator = MemoryAllocator(prefix_budgets={"session:": 50})
+        allocator.allocate("session:1", 40)
+        with self.assertRaises(MemoryBudgetExceeded):
+            allocator.allocate("session:2", 20)
+        allocator.allocate("other", 1000)
+
+    def test_block_policy_waits_for_deallocation(self):
+        allocator = MemoryAllocator(budget=100, policy="block", block_timeout=5)
+        allocator.allocate("a", 80)
+        timer = threading.Timer(0.1, allocator.deallocate, ["a"])
+        timer.start()
+        allocator.allocate("b", 50)
+        timer.join()
+        self.assertEqual(allocator.get_usage(), 50)
+
+    def test_block_policy_times_out(self):
+        allocator = MemoryAllocator(budget=100, policy="block", block_timeout=0.1)
+        allocator.allocate("a", 80)
+        with self.assertRaises(MemoryBudgetExceeded):
+            allocator.allocate("b", 50)
+
+    def test_evict_policy_calls_evictor(self):
+        allocator = MemoryAllocator(budget=100, policy="evict")
+        allocator.evictor = lambda needed, prefix: allocator.deallocate("a")
+        allocator.allocate("a", 80)
+        allocator.allocate("b", 50)
+        self.assertEqual(allocator.get_allocation("a"), 0)
+
+    def test_only_budget_tiers_count(self):
+        allocator = MemoryAllocator(budget=100)
+        allocator.allocate("a", 1000, "mmap")
+        allocator.allocate("b", 100)
+        self.assertEqual(allocator.get_metrics()["used"], 100)
+
+
+class VersionFootprintTest(unittest.TestCase):
+    def test_footprint_covers_stored_objects(self):
+        versions = VersionControl()
+        versions.create_version("k", b"a" * 1000)
+        self.assertEqual(versions.footprint("k"), 1000)
+        versions.create_version("k", b"a" * 1000 + b"b")
+        stored = sum(len(payload) for _, payload, _ in versions.objects.values())
+        self.assertEqual(versions.footprint("k"), stored)
+
+    def test_retention_and_delete_shrink_footprint(self):
+        versions = VersionControl(keep_last=1, keyframe_interval=1)
+        for i in range(5):
+            versions.create_version("k", str(i).encode() * 100)
+        self.assertEqual(versions.footprint("k"), 100)
+        versions.delete("k")
+        self.assertEqual(versions.footprint("k"), 0)
+
+    def test_repeated_content_is_counted_once_per_key(self):
+        versions = VersionControl()
+        versions.create_version("k", b"same" * 10)
+        versions.create_version("k", b"same" * 10)
+        versions.create_version("j", b"same" * 10)
+        self.assertEqual(versions.footprint("k"), 40)
+        self.assertEqual(versions.footprint("j"), 40)
+
+    def test_imported_state_keeps_footprints(self):
+        versions = VersionControl()
+        versions.create_version("k", b"x" * 300)
+        restored = VersionControl()
+        restored.import_state(*versions.export_state())
+        self.assertEqual(restored.footprint("k"), 300)
+
+
+class ManagerAccountingTest(BackendTestCase):
+    def manager(self, **kwargs):
+        kwargs.setdefault("cache_capacity", 1 << 20)
+        return SharedMemoryManager("accounting", cache_expire_time=60, mmap_directory=tempfile.mkdtemp(), **kwargs)
+
+    def resident(self, memory: SharedMemoryManager, key: str) -> int:
+        return (len(memory.text_storage.get(key, b"")) + len(memory.vector_storage.get(key, b""))
+                + memory.version_control.footprint(key))
+
+    def test_text_copies_are_all_accounted(self):
+        memory = self.manager()
+        memory.store_text("doc", "some text " * 500)
+        self.assertNotIn("doc", memory.cache_manager.local)
+        self.assertEqual(memory.memory_allocator.get_usage("ram"), self.resident(memory, "doc"))
+        self.assertEqual(memory.retrieve_text("doc"), "some text " * 500)
+
+    def test_text_written_elsewhere_is_read_from_cache(self):
+        memory, other = self.manager(), self.manager()
+        other.store_text("doc", "remote")
+        self.assertEqual(memory.retrieve_text("doc"), "remote")
+        self.assertEqual(memory.retrieve_many(["doc"]), ["remote"])
+
+    def test_tensor_copies_are_all_accounted(self):
+        memory = self.manager()
+        tensor = np.random.rand(64, 32).astype(np.float32)
+        memory.store_tensor("t", tensor)
+        self.assertNotIn("t", memory.cache_manager.local)
+        self.assertEqual(memory.memory_allocator.get_usage("ram"), tensor.nbytes + memory.version_control.footprint("t"))
+        np.testing.assert_array_equal(memory.retrieve_tensor("t"), tensor)
+
+    def test_mmap_tensor_versions_are_accounted_in_ram(self):
+        memory = self.manager(cache_capacity=1024)
+        tensor = np.random.rand(64, 32).astype(np.float32)
+        memory.store_tensor("t", tensor)
+        self.assertEqual(memory.memory_allocator.get_usage("mmap"), tensor.nbytes)
+        self.assertEqual(memory.memory_allocator.get_usage("ram"), memory.version_control.footprint("t"))
+
+    def test_versions_count_against_the_budget(self):
+        memory = self.manager(memory_budget=16 * 1024, budget_policy="reject")
+        with self.assertRaises(MemoryBudgetExceeded):
+            for i in range(100):
+                memory.store_text("doc", np.random.bytes(1024).hex())
+        self.assertLessEqual(memory.memory_allocator.get_usage("ram"), 16 * 1024)
+
+    def test_store_many_accounts_versions(self):
+        memory = self.manager()
+        errors = memory.store_many([("a", "alpha " * 100), ("v", np.arange(64, dtype=np.float32))])
+        self.assertEqual(errors, [None, None])
+        self.assertEqual(memory.memory_allocator.get_usage("ram"), self.resident(memory, "a") + self.resident(memory, "v"))
+
+    def test_rejected_batch_item_holds_nothing(self):
+        memory = self.manager(prefix_budgets={"big": 100}, budget_policy="reject")
+        errors = memory.store_many([("big", np.random.bytes(400).hex()), ("small", "x")])
+        self.assertIsInstance(errors[0], MemoryBudgetExceeded)
+        self.assertEqual(memory.memory_allocator.get_metrics()["reserved"], 0)
+        self.assertEqual(memory.memory_allocator.get_usage("ram"), self.resident(memory, "small"))
+
+    def test_delete_frees_every_copy(self):
+        memory = self.manager()
+        memory.store_text("doc", "text")
+        memory.store_tensor("t", np.ones((8, 8), np.float32))
+        memory.delete("doc")
+        memory.delete("t")
+        self.assertEqual(memory.memory_allocator.get_usage(), 0)
+
+    def test_warm_start_restores_accounting(self):
+        directory = tempfile.mkdtemp()
+        memory = self.manager(persistence_dir=directory)
+        memory.store_text("doc", "persisted " * 50)
+        memory.store_text("doc", "persisted " * 60)
+        memory.journal.close()
+        expected = memory.memory_allocator.get_usage("ram")
+        restored = self.manager(persistence_dir=directory)
+        self.assertEqual(restored.memory_allocator.get_usage("ram"), expected)
+        restored.journal.close()
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from synapse.memory_manager.async_shared_memory_manager import AsyncSharedMemoryManager
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.settings import MEMORY_MANAGER_WORKERS
+from tests.support import AsyncBackendTestCase
+
+
+class AsyncManagerTest(AsyncBackendTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.memory = AsyncSharedMemoryManager("async", cache_capacity=1 << 20, cache_expire_time=60)
+
+    async def test_round_trips(self):
+        await self.memory.store_text("t", "hello")
+        self.assertEqual(await self.memory.retrieve_text("t"), "hello")
+        vector = np.arange(8, dtype=np.float32)
+        await self.memory.store_vector("v", vector)
+        np.testing.assert_array_equal(await self.memory.retrieve_vector("v"), vector)
+        tensor = np.ones((4, 4), np.float32)
+        self.assertEqual(await self.memory.store_tensor("m", tensor), 0)
+        np.testing.assert_array_equal(await self.memory.retrieve_tensor("m"), tensor)
+
+    async def test_shares_storage_with_sync_manager(self):
+        self.memory.sync.store_text("t", "from sync")
+        self.assertEqual(await self.memory.retrieve_text("t"), "from sync")
+        wrapped = AsyncSharedMemoryManager.wrap(self.memory.sync)
+        self.assertEqual(await wrapped.retrieve_text("t"), "from sync")
+
+    async def test_small_local_texts_are_read_on_the_loop(self):
+        await self.memory.store_text("t", "inline")
+
+        def pooled_read(key, version):
+            raise AssertionError("read went through the pool")
+
+        self.memory.sync.retrieve_text = pooled_read
+        self.assertEqual(await self.memory.retrieve_text("t"), "inline")
+
+    async def test_metadata_io_runs_on_the_pool(self):
+        memory = AsyncSharedMemoryManager("indexed", cache_capacity=1 << 20, cache_expire_time=60, metadata_fields=["session"])
+        await memory.store_text("t", "x")
+        loop_thread = threading.get_ident()
+        calls = []
+        for name in ("set_metadata", "find_keys"):
+            original = getattr(memory.sync, name)
+
+            def recorded(*args, original=original, **kwargs):
+                calls.append(threading.get_ident())
+                return original(*args, **kwargs)
+
+            setattr(memory.sync, name, recorded)
+        await memory.set_metadata("t", {"session": "s"})
+        self.assertEqual(await memory.find_keys(session="s"), ["t"])
+        self.assertEqual(len(calls), 2)
+        self.assertNotIn(loop_thread, calls)
+
+    async def test_pool_size_is_configurable(self):
+        self.assertEqual(self.memory.sync.executor._max_workers, MEMORY_MANAGER_WORKERS)
+        memory = AsyncSharedMemoryManager("async", cache_capacity=1 << 20, cache_expire_time=60, max_workers=16)
+        running, peak = 0, 0
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def slow_read(key, version):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            release.wait(1)
+            with lock:
+                running -= 1
+            return key
+
+        memory.sync.retrieve_text = slow_read
+        tasks = [asyncio.ensure_future(memory.retrieve_text(f"k{i}")) for i in range(16)]
+        await asyncio.sleep(0.2)
+        release.set()
+        self.assertEqual(await asyncio.gather(*tasks), [f"k{i}" for i in range(16)])
+        self.assertEqual(peak, 16)
+        self.assertEqual(SharedMemoryManager("small", 1024, 60, max_workers=2).executor._max_workers, 2)
@@ -0,0 +1,112 @@
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import redis
+
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.synchronization import DistributedLockManager
+from tests.support import BackendTestCase
+
+
+class StoreManyTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = SharedMemoryManager("batch", cache_capacity=1 << 20, cache_expire_time=60)
+
+    def test_round_trip_in_input_order(self):
+        vector = np.arange(16, dtype=np.float32)
+        errors = self.memory.store_many([("a", "first"), ("v", vector), ("b", "second")])
+        self.assertEqual(errors, [None, None, None])
+        text_a, stored, text_b, missing = self.memory.retrieve_many(["a", "v", "b", "missing"])
+        self.assertEqual((text_a, text_b), ("first", "second"))
+        np.testing.assert_array_equal(stored, vector)
+        self.assertIsInstance(missing, KeyError)
+
+    def test_failed_items_do_not_abort_the_batch(self):
+        errors = self.memory.store_many([("a", "text"), ("bad", object())])
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], Exception)
+        self.assertEqual(self.memory.retrieve_many(["a"]), ["text"])
+
+    def test_distributed_batch(self):
+        self.assertEqual(self.memory.store_many([("a", "x"), ("b", "y")], distributed=True), [None, None])
+        self.assertEqual(self.memory.retrieve_many(["a", "b"]), ["x", "y"])
+
+    def test_repeated_keys_store_the_last_value_once(self):
+        self.assertEqual(self.memory.store_many([("a", "first"), ("b", "other"), ("a", "second")]), [None, None, None])
+        self.assertEqual(self.memory.retrieve_text("a"), "second")
+        self.assertEqual(self.memory.version_control.list_versions("a"), [0])
+        allocator = self.memory.memory_allocator
+        self.assertEqual(allocator.get_allocation("a"), len(self.memory.text_storage["a"]))
+        self.assertEqual(allocator.get_metrics()["reserved"], 0)
+
+    def test_failed_apply_releases_every_reservation(self):
+        with mock.patch.object(self.memory.version_control, "create_version", side_effect=RuntimeError("disk")):
+            with self.assertRaises(RuntimeError):
+                self.memory.store_many([("a", "x"), ("b", "y")])
+        self.assertEqual(self.memory.memory_allocator.get_metrics()["reserved"], 0)
+
+    def test_cache_failures_are_not_write_errors(self):
+        self.memcached.accepting = False
+        with self.assertLogs("synapse.memory_manager.shared_memory_manager", "WARNING"):
+            self.assertEqual(self.memory.store_many([("a", "x")]), [None])
+        self.assertEqual(self.memory.retrieve_text("a"), "x")
+        self.assertEqual(self.memory.version_control.get_latest_version("a"), 0)
+
+
+class LockManyTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.locks = DistributedLockManager()
+
+    def test_partial_acquisition_is_released(self):
+        self.redis.set("lock:b", "other")
+        with self.assertRaises(redis.exceptions.LockError):
+            with self.locks.lock_many(["c", "a", "b"], blocking_timeout=0.05):
+                pass
+        self.assertFalse(self.locks.is_locked("a"))
+        self.assertFalse(self.locks.is_locked("c"))
+
+    def test_waiting_batch_holds_none_of_its_keys(self):
+        self.redis.set("lock:b", "other")
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(self._lock_and_exit(["a", "b"])))
+        waiter.start()
+        time.sleep(0.1)
+        # Between attempts the waiter holds nothing, so "a" can be taken from outside
+        deadline = time.monotonic() + 2
+        while not self.redis.set("lock:a", "other", nx=True):
+            self.assertLess(time.monotonic(), deadline, "lock:a stayed held while waiting for lock:b")
+            time.sleep(0.001)
+        self.redis.delete("lock:a", "lock:b")
+        waiter.join()
+        self.assertEqual(result, [True])
+
+    def _lock_and_exit(self, keys):
+        with self.locks.lock_many(keys, blocking_timeout=5):
+            return True
+
+    def test_locks_released_after_block(self):
+        with self.locks.lock_many(["a", "b", "a"]):
+            self.assertTrue(self.locks.is_locked("a"))
+            self.assertTrue(self.locks.is_locked("b"))
+        self.assertFalse(self.locks.is_locked("a"))
+        self.assertFalse(self.locks.is_locked("b"))
+
+    def test_overlapping_batches_both_complete(self):
+        done = []
+
+        def worker(keys):
+            for _ in range(20):
+                with self.locks.lock_many(keys, blocking_timeout=5):
+                    pass
+            done.append(keys)
+
+        threads = [threading.Thread(target=worker, args=(keys,)) for keys in (["a", "b", "c"], ["c", "d", "a"], ["b", "d"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(done), 3)
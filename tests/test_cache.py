@@ -0,0 +1,86 @@
+import time
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.cache_manager import CacheManager, LocalCache, sizeof
+from tests.support import BackendTestCase
+
+
+class LocalCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used_by_size(self):
+        cache = LocalCache(capacity=10)
+        cache.put("a", b"xxxx")
+        cache.put("b", b"xxxx")
+        cache.get("a")
+        cache.put("c", b"xxxx")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.current_capacity, 8)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_oversized_values_are_not_admitted(self):
+        cache = LocalCache(capacity=4)
+        cache.put("a", b"xx")
+        self.assertFalse(cache.put("a", b"xxxxx"))
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.current_capacity, 0)
+
+    def test_replacing_updates_the_size(self):
+        cache = LocalCache(capacity=100)
+        cache.put("a", b"x" * 10)
+        cache.put("a", b"x" * 3)
+        self.assertEqual((len(cache), cache.current_capacity), (1, 3))
+
+    def test_expiry(self):
+        cache = LocalCache(capacity=100, expire_time=1)
+        cache.put("a", b"x")
+        entry = cache._entries["a"]
+        cache._entries["a"] = (entry[0], entry[1], time.monotonic() - 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.stats.expirations, cache.stats.misses, cache.current_capacity), (1, 1, 0))
+
+    def test_sizeof(self):
+        self.assertEqual(sizeof(np.ones(4, np.float32)), 16)
+        self.assertEqual(sizeof("é"), 2)
+        with self.assertRaises(TypeError):
+            sizeof(object())
+
+
+class CacheManagerTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = CacheManager(capacity=1 << 16, expire_time=60)
+
+    def test_writes_reach_both_tiers(self):
+        self.cache.put("k", b"value")
+        self.assertEqual(self.memcached.data["k"], b"value")
+        self.assertEqual(self.cache.local.get("k"), b"value")
+
+    def test_l1_miss_fills_from_memcached(self):
+        self.memcached.data["k"] = b"remote"
+        self.assertEqual(self.cache.get("k"), b"remote")
+        self.assertIn("k", self.cache.local)
+        del self.memcached.data["k"]
+        self.assertEqual(self.cache.get("k"), b"remote")
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["l1"]["hits"], stats["l2"]["hits"]), (1, 1))
+
+    def test_non_local_put_drops_the_l1_copy(self):
+        self.cache.put("k", b"old")
+        self.cache.put("k", b"new", local=False)
+        self.assertNotIn("k", self.cache.local)
+        self.assertEqual(self.cache.get("k"), b"new")
+
+    def test_many(self):
+        self.cache.put("a", b"1")
+        self.memcached.data["b"] = b"2"
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": b"1", "b": b"2"})
+        self.memcached.accepting = False
+        self.assertEqual(self.cache.put_many({"x": b"3"}), ["x"])
+
+    def test_evict_removes_both_tiers(self):
+        self.cache.put("k", b"v")
+        self.cache.evict("k")
+        self.assertIsNone(self.cache.get("k"))
+        self.assertNotIn("k", self.memcached.data)
@@ -0,0 +1,141 @@
+import io
+import os
+import unittest
+import zlib
+
+import numpy as np
+
+from synapse.memory_manager.compression_service import (CODECS, DECODERS, HEADER, ChunkedDecompressor, Codec,
+                                                        CompressionService, register_codec)
+
+
+def codec_of(compressed: bytes) -> str:
+    return DECODERS[HEADER.unpack_from(compressed)[2]].name
+
+
+class CodecSelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.service = CompressionService()
+
+    def test_arrays_keep_dtype_and_shape(self):
+        for data in (np.arange(600, dtype=np.int16).reshape(20, 30), np.zeros((0, 3), np.float64),
+                     np.asfortranarray(np.ones((40, 40), np.float32))):
+            with self.subTest(dtype=data.dtype, shape=data.shape):
+                restored = self.service.decompress(self.service.compress(data))
+                self.assertEqual((restored.dtype, restored.shape), (data.dtype, data.shape))
+                np.testing.assert_array_equal(restored, data)
+
+    def test_small_and_incompressible_payloads_are_stored_raw(self):
+        self.assertEqual(codec_of(self.service.compress(b"tiny")), "raw")
+        self.assertEqual(codec_of(self.service.compress(os.urandom(4096))), "raw")
+        self.assertEqual(codec_of(self.service.compress(b"a" * 4096)), "zlib")
+
+    def test_cold_data_uses_the_cold_codec(self):
+        compressed = self.service.compress(b"a" * 4096, cold=True)
+        self.assertEqual(codec_of(compressed), "lzma")
+        self.assertEqual(self.service.decompress(compressed), b"a" * 4096)
+
+    def test_named_codec(self):
+        compressed = self.service.compress(b"a" * 4096, codec="zlib-best")
+        self.assertEqual(self.service.decompress(compressed), b"a" * 4096)
+        with self.assertRaises(KeyError):
+            self.service.compress(b"x", codec="missing")
+
+    def test_registered_codecs_are_selectable(self):
+        class Reversed(Codec):
+            id = 200
+            name = "reversed"
+
+            def compress(self, data):
+                return bytes(data)[::-1]
+
+            def decompress(self, data):
+                return bytes(data)[::-1]
+
+        self.addCleanup(lambda: (CODECS.pop("reversed"), DECODERS.pop(200)))
+        register_codec(Reversed())
+        compressed = self.service.compress(b"abc", codec="reversed")
+        self.assertTrue(compressed.endswith(b"cba"))
+        self.assertEqual(self.service.decompress(compressed), b"abc")
+
+    def test_legacy_payloads_are_read(self):
+        vector = np.arange(4, dtype=np.float32)
+        np.testing.assert_array_equal(self.service.decompress(zlib.compress(vector.tobytes())), vector)
+
+    def test_truncated_headers_are_rejected(self):
+        compressed = self.service.compress(np.arange(4, dtype=np.float32))
+        for length in (3, HEADER.size + 2, HEADER.size + 6):
+            with self.subTest(length=length), self.assertRaises(ValueError):
+                self.service.decompress(compressed[:length])
+
+    def test_object_arrays_are_rejected(self):
+        with self.assertRaises(TypeError):
+            self.service.compress(np.array([object()]))
+
+
+class ChunkedCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.service = CompressionService(chunk_size=1000, stream_threshold=4000)
+        self.array = np.arange(5000, dtype=np.float32).reshape(50, 100)
+
+    def test_frames_decode_from_arbitrary_splits(self):
+        stream = b"".join(self.service.compress_chunks(self.array))
+        pieces = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+        np.testing.assert_array_equal(self.service.decompress_chunks(pieces), self.array)
+
+    def test_one_frame_per_chunk(self):
+        frames = list(self.service.compress_chunks(b"a" * 2500))
+        self.assertEqual(len(frames), 4)
+        self.assertEqual(self.service.decompress_chunks(frames), b"a" * 2500)
+
+    def test_decompresses_into_a_given_buffer(self):
+        out = np.empty_like(self.array)
+        result = self.service.decompress_chunks(self.service.compress_chunks(self.array), out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, self.array)
+        with self.assertRaises(ValueError):
+            self.service.decompress_chunks(self.service.compress_chunks(self.array), out=np.empty(5000, np.float32))
+
+    def test_large_payloads_are_chunked_by_compress(self):
+        compressed = self.service.compress(self.array)
+        self.assertEqual(compressed, b"".join(self.service.compress_chunks(self.array)))
+        np.testing.assert_array_equal(self.service.decompress(compressed), self.array)
+
+    def test_only_a_split_frame_is_buffered(self):
+        stream = b"".join(self.service.compress_chunks(self.array))
+        largest = max(len(frame) for frame in self.service.compress_chunks(self.array))
+        decompressor = ChunkedDecompressor()
+        decompressor.feed(stream)
+        self.assertEqual(len(decompressor._buffer), 0)
+        decompressor = ChunkedDecompressor()
+        for start in range(0, len(stream), 7):
+            decompressor.feed(stream[start:start + 7])
+            self.assertLess(len(decompressor._buffer), largest)
+        np.testing.assert_array_equal(decompressor.result(), self.array)
+
+    def test_compress_into_streams_frames_to_the_sink(self):
+        class Sink:
+            def __init__(self):
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        sink = Sink()
+        size = self.service.compress_into(self.array, sink)
+        self.assertEqual(len(sink.writes), 1 + self.array.nbytes // 1000)
+        self.assertEqual(b"".join(sink.writes), self.service.compress(self.array))
+        self.assertEqual(size, sum(map(len, sink.writes)))
+
+    def test_compress_into_stops_at_the_limit(self):
+        sink = io.BytesIO()
+        self.assertIsNone(self.service.compress_into(np.random.rand(5000), sink, limit=10000))
+        self.assertLessEqual(sink.tell(), 10000)
+        self.assertEqual(self.service.compress_into(b"a" * 500, io.BytesIO(), limit=10000), len(self.service.compress(b"a" * 500)))
+
+    def test_truncated_streams_are_rejected(self):
+        stream = b"".join(self.service.compress_chunks(self.array))
+        with self.assertRaises(ValueError):
+            self.service.decompress_chunks([stream[:-1]])
+        with self.assertRaises(ValueError):
+            self.service.decompress_chunks([self.service.compress(b"a" * 500)])
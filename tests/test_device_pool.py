@@ -0,0 +1,131 @@
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.device_pool import Arena, CPUDevice, Device, DevicePool, ALIGNMENT
+
+
+class ArenaTest(unittest.TestCase):
+    def test_first_fit_and_coalescing(self):
+        arena = Arena(4 * ALIGNMENT)
+        offsets = [arena.alloc(ALIGNMENT) for _ in range(4)]
+        self.assertEqual(offsets, [0, ALIGNMENT, 2 * ALIGNMENT, 3 * ALIGNMENT])
+        self.assertIsNone(arena.alloc(1))
+        arena.release(offsets[1], ALIGNMENT)
+        arena.release(offsets[2], ALIGNMENT)
+        self.assertEqual(arena.free, [(ALIGNMENT, 2 * ALIGNMENT)])
+        self.assertEqual(arena.alloc(2 * ALIGNMENT), ALIGNMENT)
+
+
+class DeviceTest(unittest.TestCase):
+    def test_devices_must_implement_copy_in(self):
+        class Incomplete(Device):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete(0, 1024)
+
+    def test_round_trip_and_lru_eviction(self):
+        device = CPUDevice(0, 2048)
+        first, second = np.ones(256, np.float32), np.full(256, 2, np.float32)
+        self.assertEqual(device.put("a", first), [])
+        device.put("b", second)
+        device.get("a")
+        self.assertEqual(device.put("c", first), ["b"])
+        np.testing.assert_array_equal(device.read("a"), first)
+
+    def test_stored_values_are_read_only(self):
+        device = CPUDevice(0, 4096)
+        device.put("a", np.ones(16, np.float32))
+        with self.assertRaises(ValueError):
+            device.get("a")[0] = 5
+
+    def test_pinned_block_is_not_reused_after_eviction(self):
+        device = CPUDevice(0, 1024)
+        device.put("a", np.ones(256, np.float32))
+        view = device.pin("a")
+        device.remove("a")
+        self.assertEqual(device.stats()["pending_blocks"], 1)
+        self.assertRaises(MemoryError, device.put, "b", np.zeros(256, np.float32))
+        np.testing.assert_array_equal(view, np.ones(256, np.float32))
+        device.unpin(view)
+        self.assertEqual(device.stats()["pending_blocks"], 0)
+        device.put("b", np.zeros(256, np.float32))
+
+    def test_unpinned_block_is_reused_at_once(self):
+        device = CPUDevice(0, 1024)
+        device.put("a", np.ones(256, np.float32))
+        view = device.pin("a")
+        device.unpin(view)
+        device.remove("a")
+        device.put("b", np.zeros(256, np.float32))
+
+    def test_copies_stay_valid_after_reuse(self):
+        device = CPUDevice(0, 1024)
+        device.put("a", np.ones(256, np.float32))
+        copy = device.read("a")
+        device.put("b", np.zeros(256, np.float32))
+        np.testing.assert_array_equal(copy, np.ones(256, np.float32))
+
+
+class DevicePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.pool = DevicePool([CPUDevice(0, 4096), CPUDevice(1, 4096)], on_evict=self.evicted.append)
+
+    def test_store_picks_least_loaded_device(self):
+        self.assertEqual(self.pool.store("a", np.ones(512, np.float32)), 0)
+        self.assertEqual(self.pool.store("b", np.ones(16, np.float32)), 1)
+        np.testing.assert_array_equal(self.pool.retrieve("a"), np.ones(512, np.float32))
+        with self.assertRaises(KeyError):
+            self.pool.retrieve("a", device_index=1)
+
+    def test_moving_a_key_removes_it_from_the_old_device(self):
+        self.pool.store("a", np.ones(16, np.float32), 0)
+        self.pool.store("a", np.ones(16, np.float32), 1)
+        self.assertNotIn("a", self.pool.devices[0].entries)
+        self.assertEqual(self.pool.device_of("a"), 1)
+
+    def test_evictions_are_reported(self):
+        self.pool.store("a", np.ones(768, np.float32), 0)
+        self.pool.store("b", np.ones(768, np.float32), 0)
+        self.assertEqual(self.evicted, ["a"])
+        self.assertIsNone(self.pool.device_of("a"))
+
+    def test_oversized_store_keeps_previous_value(self):
+        self.pool.store("a", np.ones(16, np.float32), 0)
+        with self.assertRaises(MemoryError):
+            self.pool.store("a", np.ones(4096, np.float32), 0)
+        self.assertEqual(self.pool.device_of("a"), 0)
+        np.testing.assert_array_equal(self.pool.retrieve("a"), np.ones(16, np.float32))
+
+    def test_failed_store_leaves_no_dangling_placement(self):
+        device = self.pool.devices[0]
+        self.pool.store("a", np.ones(256, np.float32), 0)
+        self.pool.store("b", np.ones(256, np.float32), 0)
+        with self.pool.lease("a") as view:
+            self.pool.evict("a")
+            # a's block is still pinned: b is evicted to make room and c still does not fit
+            with self.assertRaises(MemoryError):
+                self.pool.store("c", np.ones(1000, np.float32), 0)
+            np.testing.assert_array_equal(view, np.ones(256, np.float32))
+        self.assertIsNone(self.pool.device_of("b"))
+        self.assertIsNone(self.pool.device_of("c"))
+        self.assertEqual(self.evicted, ["b"])
+        for key, index in self.pool.placement.items():
+            self.assertIn(key, self.pool.devices[index].entries)
+        self.assertEqual(device.used, 0)
+
+    def test_lease_survives_overwrite(self):
+        self.pool.store("a", np.ones(512, np.float32), 0)
+        with self.pool.lease("a") as view:
+            self.pool.store("a", np.zeros(512, np.float32), 0)
+            np.testing.assert_array_equal(view, np.ones(512, np.float32))
+        np.testing.assert_array_equal(self.pool.retrieve("a"), np.zeros(512, np.float32))
+
+    def test_clear(self):
+        self.pool.store("a", np.ones(16, np.float32), 0)
+        self.pool.store("b", np.ones(16, np.float32), 1)
+        self.pool.clear(0)
+        self.assertIsNone(self.pool.device_of("a"))
+        self.assertEqual(self.pool.device_of("b"), 1)
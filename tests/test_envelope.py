@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from connections.envelope import Envelope, SchemaError, decode_message, is_envelope, register_schema, _schemas
+from connections.node import NodeRegistry
+from connections.pubsub import Publisher, Subscriber
+from tests.support import AsyncBackendTestCase
+
+
+class EnvelopeTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(lambda: [_schemas.pop(name, None) for name in ("test.vector", "test.blob", "test.plain")])
+        register_schema("test.vector", {"collection": str}, payload="array", dtype="float32")
+        register_schema("test.blob", payload="bytes")
+        register_schema("test.plain", {"count": int})
+
+    def test_round_trip(self):
+        vector = np.arange(8, dtype=np.float64)
+        envelope = Envelope("test.vector", key="k", version=3, fields={"collection": "c"}, payload=vector, source="node")
+        decoded = Envelope.decode(envelope.encode())
+        self.assertEqual((decoded.type, decoded.key, decoded.version, decoded.source), ("test.vector", "k", 3, "node"))
+        self.assertEqual(decoded.trace_id, envelope.trace_id)
+        self.assertEqual(decoded.payload.dtype, np.float32)
+        np.testing.assert_array_equal(decoded.payload, vector)
+        self.assertFalse(decoded.payload.flags.writeable)
+
+    def test_array_payload_is_aligned(self):
+        data = Envelope("test.vector", fields={"collection": "c"}, payload=np.ones(4, np.float32)).encode()
+        self.assertEqual((len(data) - 16) % 16, 0)
+
+    def test_bytes_payload(self):
+        decoded = Envelope.decode(Envelope("test.blob", payload=b"\x00\xff").encode())
+        self.assertEqual(decoded.payload, b"\x00\xff")
+
+    def test_missing_and_mistyped_fields(self):
+        with self.assertRaises(SchemaError):
+            Envelope("test.plain").encode()
+        with self.assertRaises(SchemaError):
+            Envelope("test.plain", fields={"count": "3"}).encode()
+
+    def test_payload_kind_is_checked(self):
+        with self.assertRaises(SchemaError):
+            Envelope("test.vector", fields={"collection": "c"}, payload=b"raw").encode()
+        with self.assertRaises(SchemaError):
+            Envelope("test.vector", fields={"collection": "c"}).encode()
+        with self.assertRaises(SchemaError):
+            Envelope("test.blob", payload=np.ones(2)).encode()
+        with self.assertRaises(SchemaError):
+            Envelope("test.plain", fields={"count": 1}, payload=b"x").encode()
+
+    def test_unregistered_types_are_not_checked(self):
+        Envelope("test.unknown", payload=b"x").validate()
+
+    def test_reply_keeps_trace(self):
+        envelope = Envelope("test.plain", fields={"count": 1})
+        self.assertEqual(envelope.reply("test.blob", payload=b"").trace_id, envelope.trace_id)
+
+    def test_decode_rejects_other_data(self):
+        with self.assertRaises(SchemaError):
+            Envelope.decode(b"plain text message")
+        self.assertFalse(is_envelope(b"plain"))
+        self.assertEqual(decode_message(b"plain"), b"plain")
+
+
+class SubscriberEnvelopeTest(AsyncBackendTestCase):
+    async def test_get_returns_envelopes_and_bytes(self):
+        async with Subscriber("events") as subscriber:
+            publisher = Publisher("events", service_id="sender")
+            publisher.send("test.untyped", key="k", payload=np.ones(3, np.float32))
+            publisher.publish(b"\xffraw")
+            envelope = await asyncio.wait_for(subscriber.get(), 2)
+            self.assertIsInstance(envelope, Envelope)
+            self.assertEqual((envelope.key, envelope.source), ("k", "sender"))
+            self.assertEqual(await asyncio.wait_for(subscriber.get(), 2), b"\xffraw")
+
+    async def test_durable_get_returns_envelopes(self):
+        subscriber = Subscriber("jobs", durable=True)
+        await subscriber.subscribe()
+        Publisher("jobs", durable=True).send("test.untyped", key="k", payload=b"\x00")
+        envelope = await asyncio.wait_for(subscriber.get(), 2)
+        self.assertEqual((envelope.key, envelope.payload), ("k", b"\x00"))
+        await subscriber.close()
+
+    async def test_node_registry_callbacks_get_envelopes(self):
+        received = asyncio.Queue()
+
+        async def callback(message):
+            await received.put(message)
+
+        registry = NodeRegistry()
+        registry.register_node("node", "events", callback)
+        self.addAsyncCleanup(registry.unregister_node, "node")
+        publisher = Publisher("events")
+        for _ in range(100):
+            if self.transport._pubsub is not None:
+                break
+            await asyncio.sleep(0.01)
+        publisher.send("test.untyped", key="k")
+        message = await asyncio.wait_for(received.get(), 2)
+        self.assertIsInstance(message, Envelope)
+        self.assertEqual(message.key, "k")
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.file_manager import DATA_OFFSET, HEADER, MemoryMappedFileManager
+
+
+class MemoryMappedFileManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.files = MemoryMappedFileManager(self.directory)
+
+    def test_header_keeps_dtype_and_shape(self):
+        for data in (np.arange(24, dtype=np.int64).reshape(2, 3, 4), np.ones(5, np.float16), np.zeros((0, 3), np.float32)):
+            with self.subTest(dtype=data.dtype, shape=data.shape):
+                self.files.store_mmap("k", data)
+                restored = self.files.retrieve_mmap("k")
+                self.assertEqual((restored.dtype, restored.shape), (data.dtype, data.shape))
+                np.testing.assert_array_equal(restored, data)
+                self.assertTrue(self.files.verify("k"))
+
+    def test_data_is_page_aligned(self):
+        self.files.store_mmap("k", np.ones(3, np.float32))
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, "k.mmap")), DATA_OFFSET + 12)
+
+    def test_legacy_files_are_read_as_float32(self):
+        np.arange(4, dtype=np.float32).tofile(os.path.join(self.directory, "old.mmap"))
+        self.assertIsNone(self.files.read_header("old"))
+        np.testing.assert_array_equal(self.files.retrieve_mmap("old"), np.arange(4, dtype=np.float32))
+
+    def test_corrupted_header_is_rejected(self):
+        self.files.store_mmap("k", np.ones(4))
+        with open(os.path.join(self.directory, "k.mmap"), "r+b") as f:
+            f.seek(HEADER.size - 1)
+            f.write(b"\xff")
+        with self.assertRaises(ValueError):
+            self.files.read_header("k")
+
+    def test_row_updates_are_partial(self):
+        self.files.store_mmap("k", np.zeros((4, 2), np.float32))
+        self.files.update_mmap("k", np.ones((2, 2), np.float32), start_row=1)
+        header = self.files.read_header("k")
+        self.assertEqual((header.data_version, header.checksum_valid), (1, False))
+        np.testing.assert_array_equal(self.files.retrieve_mmap("k")[:, 0], [0, 1, 1, 0])
+        self.assertTrue(self.files.verify("k"))
+        self.assertTrue(self.files.read_header("k").checksum_valid)
+        with self.assertRaises(IndexError):
+            self.files.update_rows("k", 3, np.ones((2, 2), np.float32))
+        with self.assertRaises(ValueError):
+            self.files.update_rows("k", 0, np.ones((1, 3), np.float32))
+
+    def test_whole_updates_rewrite_only_on_shape_change(self):
+        self.files.store_mmap("k", np.zeros(4, np.float32))
+        inode = os.stat(os.path.join(self.directory, "k.mmap")).st_ino
+        self.files.update_mmap("k", np.ones(4, np.float32))
+        self.assertEqual(os.stat(os.path.join(self.directory, "k.mmap")).st_ino, inode)
+        self.files.update_mmap("k", np.ones(6, np.float64))
+        self.assertEqual(self.files.retrieve_mmap("k").shape, (6,))
+
+    def test_append_rows_extends_the_checksum(self):
+        self.files.store_mmap("k", np.zeros((2, 3), np.int32))
+        self.files.append_rows("k", np.ones((3, 3), np.int32))
+        restored = self.files.retrieve_mmap("k")
+        self.assertEqual(restored.shape, (5, 3))
+        self.assertEqual(int(restored.sum()), 9)
+        self.assertTrue(self.files.read_header("k").checksum_valid)
+        self.assertTrue(self.files.verify("k", repair=False))
+
+    def test_verify_detects_changed_data(self):
+        self.files.store_mmap("k", np.zeros(8, np.uint8))
+        with open(os.path.join(self.directory, "k.mmap"), "r+b") as f:
+            f.seek(DATA_OFFSET)
+            f.write(b"\x01")
+        self.assertFalse(self.files.verify("k"))
+
+    def test_maps_are_reopened_after_changes(self):
+        self.files.store_mmap("k", np.zeros(4))
+        first = self.files.retrieve_mmap("k")
+        self.assertIs(self.files.retrieve_mmap("k"), first)
+        MemoryMappedFileManager(self.directory).store_mmap("k", np.ones(4))
+        np.testing.assert_array_equal(self.files.retrieve_mmap("k"), np.ones(4))
+        self.files.delete_mmap("k")
+        with self.assertRaises(FileNotFoundError):
+            self.files.retrieve_mmap("k")
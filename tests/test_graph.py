@@ -0,0 +1,173 @@
+import asyncio
+import json
+import types
+import unittest
+
+import numpy as np
+
+from components.llms.node import LLMNode
+from components.prompts.node import PromptNode
+from connections.nodes.base import NodeBase
+from connections.nodes.factory import NodeFactory
+from connections.nodes.graph import GraphError, GraphExecutor, NodeGraph
+from synapse.memory_manager.async_shared_memory_manager import AsyncSharedMemoryManager
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import AsyncBackendTestCase
+
+
+class UpperNode(NodeBase):
+    async def input(self, inputs):
+        pass
+
+    async def execute(self, run, inputs):
+        return " ".join([(await run.fetch(ref)).upper() for _, ref in sorted(inputs.items())])
+
+
+class SlowNode(NodeBase):
+    running = 0
+    peak = 0
+
+    async def input(self, inputs):
+        pass
+
+    async def execute(self, run, inputs):
+        SlowNode.running += 1
+        SlowNode.peak = max(SlowNode.peak, SlowNode.running)
+        await asyncio.sleep(0.05)
+        SlowNode.running -= 1
+        return np.full(4, len(inputs), np.float32)
+
+
+class FakeLLM:
+    def __init__(self, reply: str = "reply"):
+        """
+        Stand-in for the OpenAI clients: records each chat completion request.
+        """
+        self.reply = reply
+        self.requests = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        message = types.SimpleNamespace(content=self.reply)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def register_test_nodes(test: unittest.TestCase):
+    previous = dict(NodeFactory.node_types)
+    NodeFactory.register("Upper", UpperNode)
+    NodeFactory.register("Slow", SlowNode)
+    test.addCleanup(lambda: (NodeFactory.node_types.clear(), NodeFactory.node_types.update(previous)))
+
+
+class NodeGraphTest(unittest.TestCase):
+    def setUp(self):
+        register_test_nodes(self)
+
+    def test_orders_nodes_after_their_inputs(self):
+        graph = NodeGraph.from_config({"inputs": ["q"], "nodes": [
+            {"id": "c", "type": "Upper", "inputs": {"a": "a", "b": "b"}},
+            {"id": "a", "type": "Upper", "inputs": {"q": "q"}},
+            {"id": "b", "type": "Upper", "inputs": {"a": "a"}}]})
+        self.assertEqual(graph.order, ["a", "b", "c"])
+        self.assertEqual(graph.outputs, ["c"])
+
+    def test_invalid_graphs(self):
+        for nodes in ([{"id": "a", "type": "Upper"}, {"id": "a", "type": "Upper"}],
+                      [{"id": "a", "type": "Upper", "inputs": {"x": "missing"}}],
+                      [{"id": "a", "type": "Upper", "inputs": {"x": "b"}}, {"id": "b", "type": "Upper", "inputs": {"x": "a"}}],
+                      [{"id": "a", "type": "Unknown"}],
+                      [{"type": "Upper"}]):
+            with self.subTest(nodes=nodes), self.assertRaises(GraphError):
+                NodeGraph.from_config({"nodes": nodes})
+
+    def test_nodes_must_implement_execute(self):
+        class Incomplete(NodeBase):
+            async def input(self, inputs):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete("n", "c")
+
+
+class GraphExecutorTest(AsyncBackendTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        register_test_nodes(self)
+        self.memory = AsyncSharedMemoryManager("graph", cache_capacity=1 << 20, cache_expire_time=60)
+
+    async def test_passes_values_between_nodes(self):
+        graph = NodeGraph.from_config({"name": "g", "inputs": ["q"], "nodes": [
+            {"id": "a", "type": "Upper", "inputs": {"q": "q"}},
+            {"id": "b", "type": "Upper", "inputs": {"x": "a", "y": "q"}}]})
+        outputs = await GraphExecutor(graph, self.memory).run(q="hi")
+        self.assertEqual(outputs, {"b": "HI HI"})
+
+    async def test_run_values_are_deleted(self):
+        graph = NodeGraph.from_config({"name": "g", "inputs": ["q"], "nodes": [{"id": "a", "type": "Upper", "inputs": {"q": "q"}}]})
+        await GraphExecutor(graph, self.memory).run(q="hi")
+        self.assertEqual([key for key in self.memory.sync.text_storage if key.startswith("g:")], [])
+
+    async def test_independent_branches_run_concurrently(self):
+        SlowNode.running = SlowNode.peak = 0
+        nodes = [{"id": f"s{i}", "type": "Slow", "inputs": {"q": "q"}} for i in range(3)]
+        graph = NodeGraph.from_config({"inputs": ["q"], "nodes": nodes})
+        outputs = await GraphExecutor(graph, self.memory).run(q="x")
+        self.assertEqual(sorted(outputs), ["s0", "s1", "s2"])
+        np.testing.assert_array_equal(outputs["s0"], np.ones(4, np.float32))
+        self.assertEqual(SlowNode.peak, 3)
+        SlowNode.peak = 0
+        await GraphExecutor(graph, self.memory, max_concurrency=1).run(q="x")
+        self.assertEqual(SlowNode.peak, 1)
+
+    async def test_missing_inputs(self):
+        graph = NodeGraph.from_config({"inputs": ["q"], "nodes": [{"id": "a", "type": "Upper", "inputs": {"q": "q"}}]})
+        with self.assertRaises(GraphError):
+            await GraphExecutor(graph, self.memory).run()
+
+    async def test_prompt_and_llm_nodes_read_the_run_memory(self):
+        llm = FakeLLM("42")
+        graph = NodeGraph.from_config({"inputs": ["question", "facts"], "nodes": [
+            {"id": "prompt", "type": "Prompt", "config": {"system_prompt": "Use {source}"},
+             "inputs": {"User": "question", "Context": "facts"}},
+            {"id": "llm", "type": "LLM", "config": {"llm_source": "openai", "model": "m", "llm": llm},
+             "inputs": {"Prompt": "prompt"}}]})
+        outputs = await GraphExecutor(graph, self.memory).run(question="Ask {topic}",
+                                                             facts=json.dumps({"source": "docs", "topic": "x"}))
+        self.assertEqual(outputs, {"llm": "42"})
+        self.assertEqual(llm.requests, [{"model": "m", "messages": [{"role": "system", "content": "Use docs"},
+                                                                    {"role": "user", "content": "Ask x"}]}])
+
+    async def test_llm_node_takes_plain_prompts_and_context(self):
+        llm = FakeLLM()
+        graph = NodeGraph.from_config({"inputs": ["q", "kb"], "nodes": [
+            {"id": "llm", "type": "LLM", "config": {"llm_source": "openai", "model": "m", "llm": llm},
+             "inputs": {"Prompt": "q", "Context": "kb"}}]})
+        await GraphExecutor(graph, self.memory).run(q="hello", kb="facts")
+        self.assertEqual(llm.requests[0]["messages"], [{"role": "system", "content": "Context:\nfacts"},
+                                                       {"role": "user", "content": "hello"}])
+
+
+class NodeInputTest(AsyncBackendTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.writer = SharedMemoryManager("writer", cache_capacity=1 << 20, cache_expire_time=60)
+
+    async def test_prompt_node_renders_announced_inputs(self):
+        node = PromptNode("prompt", "out", user_prompt="About {context}")
+        version = self.writer.store_text("ctx", "cats", notify="in")
+        stored = await node.input([{"input": "Context", "channel": "in", "key": "ctx", "version": version}])
+        self.assertEqual(json.loads(node.memory.retrieve_text("prompt", stored)),
+                         [{"role": "system", "content": ""}, {"role": "user", "content": "About cats"}])
+
+    async def test_prompt_node_rejects_unknown_inputs(self):
+        with self.assertRaises(ValueError):
+            await PromptNode("prompt", "out").input([{"input": "Other", "channel": "in", "key": "k", "version": 0}])
+
+    async def test_llm_node_awaits_its_prompt(self):
+        llm = FakeLLM("done")
+        node = LLMNode("llm", "out", "openai", "m", llm=llm)
+        version = self.writer.store_text("p", "question", notify="in")
+        stored = await node.input([{"input": "Prompt", "channel": "in", "key": "p", "version": version}])
+        self.assertEqual(node.memory.retrieve_text("llm", stored), "done")
+        self.assertEqual(llm.requests[0]["messages"], [{"role": "user", "content": "question"}])
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.journal import OP_TEXT, Journal, iter_records, pack_record
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def open(self, **kwargs):
+        journal = Journal(self.directory, flush_interval=0.01, **kwargs)
+        records = [(op, key, payload) for op, key, payload, _ in journal.replay()]
+        journal.start()
+        self.addCleanup(journal.close)
+        return journal, records
+
+    def test_records_survive_a_restart(self):
+        journal, records = self.open()
+        self.assertEqual(records, [])
+        journal.append(OP_TEXT, "k", b"one")
+        journal.append(OP_TEXT, "k", b"two")
+        journal.close()
+        _, records = self.open()
+        self.assertEqual(records, [(OP_TEXT, "k", b"one"), (OP_TEXT, "k", b"two")])
+
+    def test_torn_tail_is_cut_off(self):
+        journal, _ = self.open()
+        journal.append(OP_TEXT, "k", b"whole")
+        journal.close()
+        path = os.path.join(self.directory, "journal.00000000.log")
+        with open(path, "ab") as file:
+            file.write(pack_record(OP_TEXT, "k", b"torn")[:-2])
+        journal, records = self.open()
+        self.assertEqual(records, [(OP_TEXT, "k", b"whole")])
+        journal.append(OP_TEXT, "k", b"after")
+        journal.close()
+        _, records = self.open()
+        self.assertEqual([payload for _, _, payload in records], [b"whole", b"after"])
+
+    def test_corrupt_records_stop_the_replay(self):
+        record = bytearray(pack_record(OP_TEXT, "k", b"payload"))
+        record[-1] ^= 0xFF
+        self.assertEqual(list(iter_records(bytes(record))), [])
+
+    def test_snapshot_replaces_covered_segments(self):
+        journal, _ = self.open()
+        journal.append(OP_TEXT, "a", b"old")
+        with journal.snapshot_lock:
+            segment = journal.rotate()
+            journal.write_snapshot(iter([(OP_TEXT, "a", b"snap")]), segment)
+        journal.append(OP_TEXT, "b", b"new")
+        journal.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["journal.00000001.log", "snapshot.bin"])
+        _, records = self.open()
+        self.assertEqual(records, [(OP_TEXT, "a", b"snap"), (OP_TEXT, "b", b"new")])
+
+    def test_snapshot_is_requested_past_the_size_limit(self):
+        requested = []
+        journal, _ = self.open(snapshot_bytes=64, on_snapshot=lambda: requested.append(True))
+        journal.append(OP_TEXT, "k", b"x" * 100)
+        journal.flush()
+        journal.close()
+        self.assertEqual(requested, [True])
+
+
+class WarmRestartTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def manager(self, **kwargs) -> SharedMemoryManager:
+        memory = SharedMemoryManager("persisted", cache_capacity=1 << 20, cache_expire_time=60,
+                                     persistence_dir=self.directory, metadata_fields=["session"], **kwargs)
+        self.addCleanup(memory.journal.close)
+        return memory
+
+    def fill(self, memory: SharedMemoryManager):
+        memory.store_text("t", "first", metadata={"session": "s"})
+        memory.store_text("t", "second", metadata={"session": "s"})
+        memory.store_vector("v", np.arange(4, dtype=np.float32))
+        memory.store_text("gone", "deleted")
+        memory.delete("gone")
+
+    def check(self, memory: SharedMemoryManager):
+        self.assertEqual(memory.retrieve_text("t"), "second")
+        self.assertEqual(memory.retrieve_text("t", 0), "first")
+        np.testing.assert_array_equal(memory.retrieve_vector("v"), np.arange(4, dtype=np.float32))
+        self.assertEqual(memory.find_keys(session="s"), ["t"])
+        self.assertNotIn("gone", memory.text_storage)
+        self.assertEqual(memory.memory_allocator.get_allocation("t"), len(memory.text_storage["t"]))
+
+    def test_replays_the_journal(self):
+        memory = self.manager()
+        self.fill(memory)
+        memory.journal.close()
+        self.check(self.manager())
+
+    def test_restores_a_snapshot_and_later_writes(self):
+        memory = self.manager()
+        self.fill(memory)
+        memory.snapshot()
+        memory.store_text("t", "third")
+        memory.journal.close()
+        restarted = self.manager()
+        self.assertEqual(restarted.retrieve_text("t"), "third")
+        self.assertEqual(restarted.retrieve_text("t", 1), "second")
+        self.assertEqual(restarted.version_control.get_latest_version("t"), 2)
+
+    def test_values_over_a_shrunk_budget_are_dropped(self):
+        memory = self.manager()
+        memory.store_text("small", "s")
+        memory.store_text("big", np.random.bytes(2048).hex())
+        memory.snapshot()
+        memory.store_text("later", np.random.bytes(2048).hex())
+        memory.journal.close()
+        with self.assertLogs("synapse.memory_manager.shared_memory_manager", "WARNING"):
+            restarted = self.manager(prefix_budgets={"big": 256, "later": 256}, budget_policy="reject")
+        self.assertEqual(restarted.retrieve_text("small"), "s")
+        self.assertEqual(restarted.retrieve_text("small", 0), "s")
+        for key in ("big", "later"):
+            self.assertNotIn(key, restarted.text_storage)
+            self.assertEqual(restarted.version_control.list_versions(key), [])
+        self.assertEqual(restarted.memory_allocator.get_metrics()["by_prefix"]["big"]["used"], 0)
+
+    def test_snapshot_needs_persistence(self):
+        with self.assertRaises(ValueError):
+            SharedMemoryManager("volatile", cache_capacity=1 << 20, cache_expire_time=60).snapshot()
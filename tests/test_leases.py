@@ -0,0 +1,130 @@
+import time
+
+from synapse.memory_manager.async_shared_memory_manager import AsyncSharedMemoryManager
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.synchronization import LeaseManager, LeaseLostError
+from tests.support import BackendTestCase, AsyncBackendTestCase
+
+
+class LeaseManagerTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.leases = LeaseManager(ttl=5)
+
+    def test_single_holder(self):
+        lease = self.leases.try_acquire("k")
+        self.assertIsNotNone(lease)
+        self.assertIsNone(self.leases.try_acquire("k"))
+        lease.release()
+        self.assertIsNotNone(self.leases.try_acquire("k"))
+
+    def test_fencing_tokens_grow(self):
+        first = self.leases.try_acquire("k")
+        first.release()
+        second = self.leases.try_acquire("k")
+        self.assertGreater(second.fencing_token, first.fencing_token)
+
+    def test_validate_rejects_expired_holder(self):
+        old = self.leases.try_acquire("k")
+        self.assertTrue(self.leases.validate(old))
+        self.redis.delete("lock:k")
+        new = self.leases.try_acquire("k")
+        self.assertTrue(self.leases.validate(new))
+        self.assertFalse(self.leases.validate(old))
+
+    def test_validate_rejects_older_token_after_newer_write(self):
+        old = self.leases.try_acquire("k")
+        self.redis.delete("lock:k")
+        new = self.leases.try_acquire("k")
+        self.assertTrue(self.leases.validate(new))
+        # Even if the old holder's token were reinstated, the newer write fences it out
+        self.redis.set("lock:k", old.token)
+        self.assertFalse(self.leases.validate(old))
+
+    def test_held_leases_are_renewed(self):
+        lease = self.leases.try_acquire("k", ttl=0.3)
+        time.sleep(0.6)
+        self.assertTrue(lease.valid)
+        self.assertGreater(self.redis.pttl("lock:k"), 0)
+        lease.release()
+
+    def test_lost_lease_is_detected_on_renewal(self):
+        lease = self.leases.try_acquire("k", ttl=0.3)
+        self.redis.delete("lock:k")
+        time.sleep(0.4)
+        self.assertTrue(lease.lost)
+        self.assertFalse(lease.valid)
+
+    def test_acquire_many_gives_each_key_a_renewed_fenced_lease(self):
+        leases = self.leases.acquire_many(["b", "a", "b"], ttl=0.3)
+        self.assertEqual(sorted(leases), ["a", "b"])
+        self.assertTrue(all(lease.fencing_token >= 1 for lease in leases.values()))
+        time.sleep(0.6)
+        self.assertTrue(all(lease.valid for lease in leases.values()))
+        self.assertTrue(all(self.leases.validate(lease) for lease in leases.values()))
+        self.leases.release_many(list(leases.values()))
+        self.assertFalse(self.redis.exists("lock:a", "lock:b"))
+
+    def test_try_acquire_many_is_all_or_nothing(self):
+        held = self.leases.try_acquire("b")
+        self.assertIsNone(self.leases.try_acquire_many(["a", "b", "c"]))
+        self.assertFalse(self.redis.exists("lock:a", "lock:c"))
+        held.release()
+
+
+class FencedWriteTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = SharedMemoryManager("fenced", cache_capacity=1 << 20, cache_expire_time=60)
+        self.lease_manager = self.memory.distributed_lock_manager.lease_manager
+
+    def test_write_from_replaced_holder_is_rejected(self):
+        old = self.lease_manager.try_acquire("k")
+        self.redis.delete("lock:k")
+        new = self.lease_manager.try_acquire("k")
+        self.memory.store_text("k", "new", lease=new)
+        with self.assertRaises(LeaseLostError):
+            self.memory.store_text("k", "old", lease=old)
+        self.assertEqual(self.memory.retrieve_text("k"), "new")
+
+    def test_older_token_is_rejected_locally(self):
+        old = self.lease_manager.try_acquire("k")
+        self.redis.delete("lock:k")
+        new = self.lease_manager.try_acquire("k")
+        self.memory.store_text("k", "new", lease=new)
+        new.release()
+        # The old holder's token is back in Redis, but this store has applied a newer one
+        self.redis.set("lock:k", old.token)
+        self.redis.delete("fence:last:k")
+        with self.assertRaises(LeaseLostError):
+            self.memory.store_text("k", "old", lease=old)
+
+    def test_store_many_fences_each_key(self):
+        validate_many = self.lease_manager.validate_many
+
+        def lose_b(leases):
+            self.redis.delete("lock:b")
+            return validate_many(leases)
+
+        self.lease_manager.validate_many = lose_b
+        errors = self.memory.store_many([("a", "x"), ("b", "y")], distributed=True)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], LeaseLostError)
+        self.assertEqual(self.memory.retrieve_many(["a"]), ["x"])
+        self.assertNotIn("b", self.memory.text_storage)
+        self.assertEqual(self.memory.memory_allocator.get_allocation("b"), 0)
+
+    def test_lock_many_leases_are_fenced(self):
+        with self.memory.distributed_lock_manager.lock_many(["a", "b"]) as leases:
+            self.assertEqual(set(leases), {"a", "b"})
+            self.assertIn(leases["a"].token, self.lease_manager._leases)
+        self.assertFalse(self.redis.exists("lock:a", "lock:b"))
+
+
+class AsyncFencedWriteTest(AsyncBackendTestCase):
+    async def test_distributed_async_write(self):
+        memory = AsyncSharedMemoryManager("fenced", cache_capacity=1 << 20, cache_expire_time=60)
+        version = await memory.store_text("k", "value", distributed=True)
+        self.assertEqual(version, 0)
+        self.assertEqual(await memory.retrieve_text("k"), "value")
+        self.assertIsNotNone(self.redis.get("fence:last:k"))
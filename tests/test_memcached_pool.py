@@ -0,0 +1,103 @@
+import socket
+import tempfile
+import threading
+import unittest
+
+import pylibmc
+
+from connections import db
+from connections.db import PooledMemcachedClient, _memcached_alive, memcached_client
+from synapse.memory_manager.cache_manager import CacheManager
+
+
+class VersionServer:
+    def __init__(self, port: int = 0):
+        """
+        Answers memcached's version command, enough for the health check to see a live server.
+        """
+        self.socket = socket.create_server(("127.0.0.1", port))
+        self.address = f"127.0.0.1:{self.socket.getsockname()[1]}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            with connection:
+                connection.recv(64)
+                connection.sendall(b"VERSION 1.6.0\r\n")
+
+    def close(self):
+        try:
+            # Wakes the accept() blocked in _serve
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def unused_address() -> str:
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        return f"127.0.0.1:{server.getsockname()[1]}"
+
+
+class PooledMemcachedClientTest(unittest.TestCase):
+    def setUp(self):
+        self.live = VersionServer()
+        self.addCleanup(self.live.close)
+        self.dead = unused_address()
+
+    def test_health_check_drops_and_restores_servers(self):
+        client = PooledMemcachedClient([self.live.address, self.dead], pool_size=2, health_check_interval=0)
+        self.assertEqual(client.check_health(), [self.live.address])
+        pool = client._pool
+        self.assertEqual(client.check_health(), [self.live.address])
+        self.assertIs(client._pool, pool)
+        revived = VersionServer(int(self.dead.rpartition(":")[2]))
+        self.addCleanup(revived.close)
+        self.assertEqual(client.check_health(), [self.live.address, self.dead])
+        self.assertIsNot(client._pool, pool)
+        # With every server down the full ring is kept
+        self.live.close()
+        revived.close()
+        self.assertEqual(client.check_health(), [self.live.address, self.dead])
+
+    def test_pooled_clients_use_consistent_hashing(self):
+        client = PooledMemcachedClient([self.live.address], pool_size=2, health_check_interval=0)
+        with client._reserve() as reserved:
+            self.assertTrue(reserved.behaviors["ketama"])
+            self.assertTrue(reserved.binary)
+
+    def test_unreachable_servers_fail_fast(self):
+        client = PooledMemcachedClient([self.dead], pool_size=1, health_check_interval=0)
+        with self.assertRaises(pylibmc.Error):
+            client.get("k")
+
+    def test_liveness_probe(self):
+        self.assertTrue(_memcached_alive(self.live.address))
+        self.assertFalse(_memcached_alive(self.dead))
+        with tempfile.NamedTemporaryFile() as file:
+            self.assertTrue(_memcached_alive(file.name))
+        self.assertFalse(_memcached_alive("/nonexistent/memcached.sock"))
+
+
+class MemcachedRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = [unused_address()]
+        self.addCleanup(db._memcached_clients.pop, tuple(self.servers), None)
+
+    def test_clients_are_shared_per_server_list(self):
+        self.assertIs(memcached_client(self.servers), memcached_client(list(self.servers)))
+        self.assertIsNot(memcached_client(self.servers), memcached_client(self.servers + ["127.0.0.1:2"]))
+        db._memcached_clients.pop(tuple(self.servers + ["127.0.0.1:2"]))
+
+    def test_cache_manager_survives_an_unreachable_memcached(self):
+        cache = CacheManager(servers=self.servers, capacity=1 << 10, expire_time=60)
+        cache.put("k", b"v")
+        self.assertEqual(cache.get("k"), b"v")
+        cache.local.clear()
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.put_many({"a": b"1"}), ["a"])
+        self.assertEqual(cache.get_many(["a"]), {"a": b"1"})
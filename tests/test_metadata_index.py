@@ -0,0 +1,97 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from synapse.memory_manager.metadata_index import MetadataIndex
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class MetadataIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = MetadataIndex(["session", "score"])
+        self.index["a"] = {"session": "s1", "score": 3, "tag": "x"}
+        self.index["b"] = {"session": "s1", "score": 7.5}
+        self.index["c"] = {"session": "s2", "score": 10, "tag": "y"}
+        self.index["d"] = {"session": "s2", "score": "high"}
+
+    def test_equality_and_in(self):
+        self.assertEqual(self.index.query(session="s1"), ["a", "b"])
+        self.assertEqual(self.index.query(session__in=["s2", "s3"]), ["c", "d"])
+        self.assertEqual(self.index.query(session="missing"), [])
+
+    def test_ranges_only_compare_like_types(self):
+        self.assertEqual(self.index.query(score__gt=3), ["b", "c"])
+        self.assertEqual(self.index.query(score__gte=3), ["a", "b", "c"])
+        self.assertEqual(self.index.query(score__lt=10), ["a", "b"])
+        self.assertEqual(self.index.query(score__lte="z"), ["d"])
+
+    def test_unindexed_fields_filter_the_candidates(self):
+        self.assertEqual(self.index.query(session="s1", tag="x"), ["a"])
+        self.assertEqual(self.index.query(tag__in=["x", "y"]), ["a", "c"])
+        self.assertEqual(self.index.query(tag__gt=1), [])
+
+    def test_updates_and_deletes_keep_the_indexes_current(self):
+        self.index["a"] = {"session": "s2", "score": 100}
+        self.assertEqual(self.index.query(session="s1"), ["b"])
+        self.assertEqual(self.index.query(score__gt=50), ["a"])
+        del self.index["a"]
+        self.assertEqual(self.index.query(score__gt=50), [])
+        self.assertNotIn("a", self.index.indexes["score"].sorted_keys)
+        with self.assertRaises(KeyError):
+            del self.index["a"]
+
+    def test_unhashable_values_are_scanned(self):
+        self.index["e"] = {"session": ["s1"], "score": 1}
+        self.assertEqual(self.index.query(session=["s1"]), ["e"])
+        self.assertEqual(self.index.query(session__in=[["s1"], "s2"]), ["c", "d", "e"])
+        self.assertEqual(self.index.query(score=1), ["e"])
+        self.assertEqual(self.index.query(session="s1"), ["a", "b"])
+        del self.index["e"]
+        self.assertEqual(self.index.indexes["session"].unindexed, set())
+
+    def test_add_index_covers_existing_entries(self):
+        self.index.add_index("tag")
+        self.assertEqual(self.index.indexes["tag"].lookup("exact", "y"), {"c"})
+
+    def test_unknown_lookup(self):
+        with self.assertRaises(ValueError):
+            self.index.query(score__between=(1, 2))
+
+
+class PersistentMetadataIndexTest(unittest.TestCase):
+    def test_reloads_from_sqlite(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, "metadata.db")
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        index = MetadataIndex(["created"], path)
+        index["a"] = {"created": created}
+        index["b"] = {"created": created + datetime.timedelta(days=1)}
+        index.delete("b")
+        index.close()
+        reloaded = MetadataIndex(["created"], path)
+        self.addCleanup(reloaded.close)
+        self.assertEqual(reloaded["a"], {"created": created})
+        self.assertEqual(reloaded.query(created__gte=created), ["a"])
+        self.assertNotIn("b", reloaded)
+
+    def test_values_must_be_persistable(self):
+        index = MetadataIndex(path=":memory:")
+        self.addCleanup(index.close)
+        with self.assertRaises(TypeError):
+            index["a"] = {"value": object()}
+        self.assertNotIn("a", index)
+
+
+class FindKeysTest(BackendTestCase):
+    def test_find_keys(self):
+        memory = SharedMemoryManager("meta", cache_capacity=1 << 20, cache_expire_time=60, metadata_fields=["session"])
+        memory.store_text("a", "first", metadata={"session": "s1", "turn": 1})
+        memory.store_text("b", "second", metadata={"session": "s1", "turn": 2})
+        memory.store_text("c", "other", metadata={"session": "s2", "turn": 1})
+        self.assertEqual(memory.find_keys(session="s1", turn__gte=2), ["b"])
+        memory.set_metadata("b", {"session": "s2"})
+        self.assertEqual(memory.find_keys(session="s2"), ["b", "c"])
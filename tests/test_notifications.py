@@ -0,0 +1,118 @@
+import asyncio
+import inspect
+
+from components.llms.handlers import handle_prompt
+from components.prompts.handlers import handle_context_prompt
+from synapse.memory_manager.async_shared_memory_manager import AsyncSharedMemoryManager
+from synapse.memory_manager.notifications import KeyReady, KeyWaiter, ReadyNotifier, wait_for_key, _last_event_key
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.settings import READY_INLINE_BYTES, READY_WAIT_TIMEOUT
+from tests.support import AsyncBackendTestCase
+
+
+class KeyWaiterTest(AsyncBackendTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.memory = SharedMemoryManager("writer", cache_capacity=1 << 20, cache_expire_time=60)
+
+    async def write_soon(self, key: str, text: str, delay: float = 0.05):
+        await asyncio.sleep(delay)
+        return self.memory.store_text(key, text, notify="ch")
+
+    async def test_resolves_on_announcement(self):
+        writer = asyncio.ensure_future(self.write_soon("k", "hello"))
+        event = await wait_for_key("ch", "k", timeout=2)
+        self.assertEqual((event.version, event.data), (await writer, "hello"))
+
+    async def test_versioned_wait_finds_earlier_announcement(self):
+        self.memory.store_text("k", "hello", notify="ch")
+        event = await wait_for_key("ch", "k", version=0, timeout=2)
+        self.assertEqual(event.data, "hello")
+
+    async def test_unversioned_wait_ignores_stale_announcement(self):
+        self.memory.store_text("k", "stale", notify="ch")
+        with self.assertRaises(asyncio.TimeoutError):
+            await wait_for_key("ch", "k", timeout=0.2)
+        writer = asyncio.ensure_future(self.write_soon("k", "fresh"))
+        event = await wait_for_key("ch", "k", timeout=2)
+        await writer
+        self.assertEqual(event.data, "fresh")
+
+    async def test_waits_for_requested_version(self):
+        self.memory.store_text("k", "v0", notify="ch")
+        writer = asyncio.ensure_future(self.write_soon("k", "v1"))
+        event = await wait_for_key("ch", "k", version=1, timeout=2)
+        await writer
+        self.assertEqual(event.data, "v1")
+
+    async def test_large_values_are_not_inlined(self):
+        self.memory.store_text("k", "x" * (READY_INLINE_BYTES + 1), notify="ch")
+        event = await wait_for_key("ch", "k", version=0, timeout=2)
+        self.assertIsNone(event.data)
+        self.assertEqual(event.size, READY_INLINE_BYTES + 1)
+
+    async def test_dropped_events_are_recovered_from_stored_ones(self):
+        waiter = KeyWaiter.instance()
+        waiting = asyncio.ensure_future(waiter.wait("ch", "k", version=3, timeout=2))
+        await asyncio.sleep(0.05)
+        await self.async_redis.set(_last_event_key("ch", "k"), KeyReady("k", 3, 1, data="x").to_json())
+        subscription, _ = waiter.channels["ch"]
+        subscription.dropped += 1
+        ReadyNotifier().notify("ch", "other", 0, b"y")
+        self.assertEqual((await waiting).version, 3)
+
+    async def test_subscription_closed_after_last_waiter(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await wait_for_key("ch", "k", timeout=0.05)
+        self.assertEqual(KeyWaiter.instance().channels, {})
+        self.assertNotIn("synapse:ready:ch", self.transport.subscriptions)
+
+    async def test_inline_data_only_for_its_own_version(self):
+        event = KeyReady("k", 2, 5, data="value")
+        self.assertEqual(event.inline_data(), "value")
+        self.assertEqual(event.inline_data(2), "value")
+        self.assertIsNone(event.inline_data(1))
+
+
+class HandlerTest(AsyncBackendTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.memory = SharedMemoryManager("writer", cache_capacity=1 << 20, cache_expire_time=60)
+
+    async def test_handlers_return_requested_version(self):
+        self.memory.store_text("k", "v0", notify="ch")
+        self.memory.store_text("k", "v1", notify="ch")
+        self.assertEqual(await handle_prompt("ch", "k", 0, self.memory), "v0")
+        self.assertEqual(await handle_context_prompt("ch", "k", 0, self.memory), "v0")
+        self.assertEqual(await handle_prompt("ch", "k", 1, self.memory), "v1")
+
+    async def test_handlers_read_large_values_through_the_manager(self):
+        text = "y" * (READY_INLINE_BYTES * 2)
+        self.memory.store_text("k", text, notify="ch")
+        self.assertEqual(await handle_prompt("ch", "k", 0, self.memory), text)
+        self.assertEqual(await handle_context_prompt("ch", "k", 0, self.memory), text)
+
+    async def test_handlers_read_large_values_written_by_another_node(self):
+        reader = SharedMemoryManager("llm-node", cache_capacity=1 << 20, cache_expire_time=60)
+        first, second = "a" * (READY_INLINE_BYTES + 1), "b" * (READY_INLINE_BYTES + 1)
+        self.memory.store_text("p", first, notify="ch")
+        self.assertEqual(await handle_prompt("ch", "p", 0, reader), first)
+        self.memory.store_text("p", second, notify="ch")
+        self.assertEqual(await handle_context_prompt("ch", "p", 1, reader), second)
+        self.assertEqual(await AsyncSharedMemoryManager.wrap(reader).wait_for_text("ch", "p", 0, timeout=2), first)
+        self.memcached.data.clear()
+        reader.cache_manager.local.clear()
+        with self.assertRaises(KeyError):
+            await handle_prompt("ch", "p", 0, reader)
+
+    async def test_handlers_time_out(self):
+        for handler in (handle_prompt, handle_context_prompt):
+            self.assertEqual(inspect.signature(handler).parameters["timeout"].default, READY_WAIT_TIMEOUT)
+            with self.assertRaises(asyncio.TimeoutError):
+                await handler("ch", "missing", 0, self.memory, timeout=0.05)
+
+    async def test_async_manager_wait_for_text(self):
+        memory = AsyncSharedMemoryManager.wrap(self.memory)
+        self.memory.store_text("k", "v0", notify="ch")
+        self.memory.store_text("k", "v1", notify="ch")
+        self.assertEqual(await memory.wait_for_text("ch", "k", 0, timeout=2), "v0")
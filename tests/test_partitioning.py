@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.cache_manager import CacheManager
+from synapse.memory_manager.compression_service import CompressionService
+from synapse.memory_manager.control import (CachePartitionBackend, MemoryPartitionBackend, MmapPartitionBackend,
+                                            PartitioningService)
+from synapse.memory_manager.file_manager import MemoryMappedFileManager
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class RecordingBackend(MemoryPartitionBackend):
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+
+    def get(self, name, start=None, stop=None):
+        self.reads.append(name)
+        return super().get(name, start, stop)
+
+
+class PartitioningServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.backends = [RecordingBackend(), RecordingBackend()]
+        self.service = PartitioningService(4, self.backends)
+        self.addCleanup(self.service.executor.shutdown)
+        self.tensor = np.arange(40, dtype=np.float32).reshape(10, 4)
+
+    def test_round_trip(self):
+        self.service.store_partitioned("t", self.tensor)
+        np.testing.assert_array_equal(self.service.retrieve_partitioned("t"), self.tensor)
+        self.assertEqual(self.service.layouts["t"].boundaries, [0, 3, 6, 8, 10])
+
+    def test_partitions_are_spread_over_backends(self):
+        self.service.store_partitioned("t", self.tensor)
+        self.assertEqual(sorted(self.backends[0].partitions), ["t.g0.part0", "t.g0.part2"])
+        self.assertEqual(sorted(self.backends[1].partitions), ["t.g0.part1", "t.g0.part3"])
+
+    def test_row_reads_touch_only_overlapping_partitions(self):
+        self.service.store_partitioned("t", self.tensor)
+        np.testing.assert_array_equal(self.service.retrieve_rows("t", 4, 7), self.tensor[4:7])
+        self.assertEqual(self.backends[1].reads + self.backends[0].reads, ["t.g0.part1", "t.g0.part2"])
+        self.assertEqual(self.service.retrieve_rows("t", 5, 5).shape, (0, 4))
+        np.testing.assert_array_equal(self.service.retrieve_rows("t", -2, 100), self.tensor[-2:])
+
+    def test_rewrites_replace_the_previous_generation(self):
+        self.service.store_partitioned("t", self.tensor)
+        self.service.store_partitioned("t", self.tensor[:6] * 2)
+        names = sorted(self.backends[0].partitions) + sorted(self.backends[1].partitions)
+        self.assertEqual(names, ["t.g1.part0", "t.g1.part2", "t.g1.part1", "t.g1.part3"])
+        np.testing.assert_array_equal(self.service.retrieve_partitioned("t"), self.tensor[:6] * 2)
+
+    def test_update_partition_shifts_later_rows(self):
+        self.service.store_partitioned("t", self.tensor)
+        self.service.update_partition("t", 1, np.ones((5, 4), np.float32))
+        result = self.service.retrieve_partitioned("t")
+        self.assertEqual(result.shape, (12, 4))
+        np.testing.assert_array_equal(result[3:8], np.ones((5, 4)))
+        np.testing.assert_array_equal(result[8:], self.tensor[6:])
+
+    def test_update_partition_publishes_a_new_layout(self):
+        self.service.store_partitioned("t", self.tensor)
+        previous = self.service.layouts["t"]
+        self.service.update_partition("t", 1, np.ones((5, 4), np.float32))
+        layout = self.service.layouts["t"]
+        self.assertIsNot(layout, previous)
+        self.assertEqual((previous.boundaries, previous.shape), ([0, 3, 6, 8, 10], (10, 4)))
+        self.assertEqual((layout.boundaries, layout.generations), ([0, 3, 8, 10, 12], [0, 1, 0, 0]))
+        self.assertEqual(sorted(self.backends[1].partitions), ["t.g0.part3", "t.g1.part1"])
+        # A reader still holding the old layout finds its partition gone and rereads
+        with self.assertRaises(KeyError):
+            self.service._read_rows("t", previous, 0, 10)
+        np.testing.assert_array_equal(self.service.retrieve_rows("t", 3, 8), np.ones((5, 4)))
+
+    def test_delete(self):
+        self.service.store_partitioned("t", self.tensor)
+        self.service.delete_partitioned("t")
+        self.assertEqual(self.backends[0].partitions, {})
+        with self.assertRaises(KeyError):
+            self.service.retrieve_rows("t", 0, 1)
+
+
+class PartitionBackendTest(BackendTestCase):
+    def test_mmap_and_cache_backends(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        backends = [MmapPartitionBackend(MemoryMappedFileManager(directory)),
+                    CachePartitionBackend(CacheManager(capacity=1 << 20, expire_time=60), CompressionService())]
+        service = PartitioningService(3, backends)
+        self.addCleanup(service.executor.shutdown)
+        tensor = np.arange(30, dtype=np.int32).reshape(15, 2)
+        service.store_partitioned("t", tensor)
+        np.testing.assert_array_equal(service.retrieve_partitioned("t"), tensor)
+        np.testing.assert_array_equal(service.retrieve_rows("t", 4, 12), tensor[4:12])
+        service.delete_partitioned("t")
+        for index, backend in enumerate(backends):
+            with self.assertRaises(KeyError):
+                backend.get(f"t.g0.part{index}")
+
+    def test_manager_reads_rows_from_partitions(self):
+        memory = SharedMemoryManager("parts", cache_capacity=1 << 20, cache_expire_time=60, num_partitions=3,
+                                     partition_backends=["memory", "cache"])
+        tensor = np.arange(60, dtype=np.float32).reshape(20, 3)
+        memory.store_tensor("t", tensor)
+        np.testing.assert_array_equal(memory.retrieve_rows("t", 5, 15), tensor[5:15])
+        np.testing.assert_array_equal(memory.retrieve_tensor("t"), tensor)
+        with self.assertRaises(ValueError):
+            SharedMemoryManager("bad", cache_capacity=1 << 20, cache_expire_time=60, partition_backends=["disk"])
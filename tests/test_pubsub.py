@@ -0,0 +1,97 @@
+import asyncio
+
+import redis
+
+from connections.pubsub import AsyncPubSubTransport, Publisher, SlowConsumerError, Subscriber
+from tests.support import AsyncBackendTestCase
+
+
+async def eventually(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+class AsyncPubSubTransportTest(AsyncBackendTestCase):
+    async def test_subscribed_when_subscribe_returns(self):
+        subscription = await self.transport.subscribe("c")
+        self.assertIsNotNone(self.transport._pubsub)
+        self.assertEqual(await self.async_redis.publish("c", b"first"), 1)
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 2), b"first")
+
+    async def test_channels_share_one_connection(self):
+        first = await self.transport.subscribe("c")
+        pubsub = self.transport._pubsub
+        second = await self.transport.subscribe("c")
+        other = await self.transport.subscribe("d")
+        self.assertIs(self.transport._pubsub, pubsub)
+        await self.transport.publish("c", b"x")
+        await self.transport.publish("d", b"y")
+        self.assertEqual(await asyncio.wait_for(first.get(), 2), b"x")
+        self.assertEqual(await asyncio.wait_for(second.get(), 2), b"x")
+        self.assertEqual(await asyncio.wait_for(other.get(), 2), b"y")
+
+    async def test_full_queue_drops_oldest_by_default(self):
+        slow = await self.transport.subscribe("c", maxsize=2)
+        fast = await self.transport.subscribe("c", maxsize=10)
+        for i in range(5):
+            await self.transport.publish("c", str(i).encode())
+        await eventually(lambda: fast.queue.qsize() == 5)
+        self.assertEqual(slow.dropped, 3)
+        self.assertEqual([await slow.get(), await slow.get()], [b"3", b"4"])
+
+    async def test_full_queue_never_stalls_the_reader(self):
+        await self.transport.subscribe("slow", maxsize=1)
+        other = await self.transport.subscribe("other")
+        for i in range(3):
+            await self.transport.publish("slow", b"x")
+        await self.transport.publish("other", b"y")
+        self.assertEqual(await asyncio.wait_for(other.get(), 2), b"y")
+
+    async def test_disconnect_policy(self):
+        subscription = await self.transport.subscribe("c", maxsize=1, overflow="disconnect")
+        for i in range(3):
+            await self.transport.publish("c", str(i).encode())
+        await eventually(lambda: subscription.disconnected)
+        self.assertEqual(await subscription.get(), b"0")
+        with self.assertRaises(SlowConsumerError):
+            await subscription.get()
+        await eventually(lambda: "c" not in self.transport.subscriptions)
+        self.assertEqual(await self.async_redis.publish("c", b"late"), 0)
+
+    async def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            await self.transport.subscribe("c", overflow="block")
+
+    async def test_last_unsubscribe_leaves_the_channel(self):
+        subscription = await self.transport.subscribe("c")
+        await subscription.close()
+        self.assertEqual(await self.async_redis.publish("c", b"x"), 0)
+
+    async def test_reconnects_and_resubscribes(self):
+        subscription = await self.transport.subscribe("c")
+        await self.transport._drop_connection()
+        await eventually(lambda: self.transport._pubsub is not None)
+        await self.transport.publish("c", b"again")
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 2), b"again")
+
+    async def test_unreachable_redis_fails_subscribe(self):
+        transport = AsyncPubSubTransport(client=redis.asyncio.Redis(port=1, socket_connect_timeout=0.5))
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            await transport.subscribe("c")
+        self.assertEqual(transport.subscriptions, {})
+        await transport.close()
+
+
+class PublisherSubscriberTest(AsyncBackendTestCase):
+    async def test_publish_async_reaches_subscriber(self):
+        async with Subscriber("events") as subscriber:
+            self.assertEqual(await Publisher("events").publish_async(b"hello"), 1)
+            self.assertEqual(await asyncio.wait_for(subscriber.get_raw(), 2), b"hello")
+
+    async def test_publish_many(self):
+        async with Subscriber("events") as subscriber:
+            Publisher("events").publish_many([b"a", b"b"])
+            self.assertEqual([await subscriber.get_raw(), await subscriber.get_raw()], [b"a", b"b"])
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.compression_service import CompressionService
+from synapse.memory_manager.data_type_manager import DataTypeManager, QuantizedArray
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class QuantizationTest(unittest.TestCase):
+    def setUp(self):
+        self.types = DataTypeManager()
+        self.matrix = np.random.default_rng(0).normal(size=(8, 32)).astype(np.float32)
+
+    def test_modes_round_trip_within_their_precision(self):
+        for mode, tolerance in (("float16", 1e-3), ("bfloat16", 1e-2), ("int8", 2e-2)):
+            with self.subTest(mode=mode):
+                quantized = self.types.quantize(self.matrix, mode)
+                restored = quantized.dequantize()
+                self.assertEqual((restored.dtype, restored.shape), (np.float32, self.matrix.shape))
+                np.testing.assert_allclose(restored, self.matrix, atol=tolerance * np.abs(self.matrix).max())
+                self.assertLess(quantized.nbytes, self.matrix.nbytes)
+
+    def test_int8_keeps_one_scale_per_row(self):
+        quantized = self.types.quantize(self.matrix, "int8")
+        self.assertEqual((quantized.values.dtype, quantized.scales.shape), (np.int8, (8,)))
+        zero = self.types.quantize(np.zeros(4, np.float32), "int8")
+        np.testing.assert_array_equal(zero.dequantize(), np.zeros(4))
+
+    def test_bfloat16_rounds_to_nearest(self):
+        quantized = self.types.quantize(np.array([1 + 2 ** -8 + 2 ** -10], np.float32), "bfloat16")
+        self.assertEqual(quantized.dequantize()[0], 1 + 2 ** -7)
+
+    def test_dot_matches_dequantized_product(self):
+        query = np.ones(32, np.float32)
+        quantized = self.types.quantize(self.matrix, "int8")
+        np.testing.assert_allclose(quantized.dot(query), quantized.dequantize() @ query, rtol=1e-5)
+
+    def test_rejects_unknown_modes_and_integer_data(self):
+        with self.assertRaises(ValueError):
+            self.types.quantize(self.matrix, "int4")
+        with self.assertRaises(ValueError):
+            self.types.quantize(np.arange(4), "int8")
+
+    def test_pack_round_trip(self):
+        service = CompressionService()
+        for mode in ("float16", "int8"):
+            packed = self.types.pack_quantized(self.types.quantize(self.matrix, mode), service)
+            self.assertTrue(DataTypeManager.is_quantized(packed))
+            unpacked = self.types.unpack_quantized(packed, service)
+            self.assertIsInstance(unpacked, QuantizedArray)
+            self.assertEqual(unpacked.mode, mode)
+            np.testing.assert_array_equal(unpacked.dequantize(), self.types.quantize(self.matrix, mode).dequantize())
+
+
+class ManagerQuantizationTest(BackendTestCase):
+    def test_vectors_are_stored_quantized(self):
+        memory = SharedMemoryManager("quant", cache_capacity=1 << 20, cache_expire_time=60, vector_quantization="int8")
+        vector = np.linspace(-1, 1, 64, dtype=np.float32)
+        memory.store_vector("v", vector)
+        np.testing.assert_allclose(memory.retrieve_vector("v"), vector, atol=1 / 127)
+        self.assertIsInstance(memory.retrieve_vector("v", dequantize=False), QuantizedArray)
+        np.testing.assert_allclose(memory.retrieve_vector("v", version=0), vector, atol=1 / 127)
+
+    def test_quantization_is_opt_in(self):
+        memory = SharedMemoryManager("plain", cache_capacity=1 << 20, cache_expire_time=60)
+        vector = np.linspace(-1, 1, 64, dtype=np.float32)
+        memory.store_vector("v", vector)
+        np.testing.assert_array_equal(memory.retrieve_vector("v"), vector)
+        memory.store_vector("q", vector, quantize="float16")
+        self.assertEqual(memory.retrieve_vector("q", dequantize=False).mode, "float16")
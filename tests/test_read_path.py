@@ -0,0 +1,86 @@
+import tempfile
+import threading
+
+import numpy as np
+
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.synchronization import SynchronizationService
+from tests.support import BackendTestCase
+
+
+class TensorLocationTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = SharedMemoryManager("locations", cache_capacity=1024, cache_expire_time=60,
+                                          mmap_directory=tempfile.mkdtemp(), shared_tensor_dir=tempfile.mkdtemp())
+        self.small = np.full((4, 4), 1, np.float32)
+        self.large = np.full((64, 64), 2, np.float32)
+
+    def test_partition_then_mmap(self):
+        self.memory.store_tensor("t", self.small)
+        self.memory.store_tensor("t", self.large)
+        np.testing.assert_array_equal(self.memory.retrieve_tensor("t"), self.large)
+        np.testing.assert_array_equal(self.memory.retrieve_rows("t", 0, 2), self.large[:2])
+        self.assertEqual(self.memory.memory_allocator.get_tier("t"), "mmap")
+
+    def test_mmap_then_partition(self):
+        self.memory.store_tensor("t", self.large)
+        self.memory.store_tensor("t", self.small)
+        self.memory.cache_manager.local.clear()
+        np.testing.assert_array_equal(self.memory.retrieve_tensor("t"), self.small)
+        np.testing.assert_array_equal(self.memory.retrieve_rows("t", 0, 4), self.small)
+        with self.assertRaises(FileNotFoundError):
+            self.memory.mmap_manager.retrieve_mmap("t")
+
+    def test_shared_then_partition(self):
+        self.memory.store_tensor("t", self.small * 5, shared=True)
+        self.memory.store_tensor("t", self.small)
+        self.assertNotIn("t", self.memory.shared_tensor_store)
+        np.testing.assert_array_equal(self.memory.retrieve_tensor("t"), self.small)
+
+    def test_partition_then_shared(self):
+        self.memory.store_tensor("t", self.small)
+        self.memory.store_tensor("t", self.small * 3, shared=True)
+        self.assertIsNone(self.memory.cache_manager.get("t"))
+        self.assertEqual(self.memory.memory_allocator.get_allocation("t"), 0)
+        np.testing.assert_array_equal(self.memory.retrieve_tensor("t"), self.small * 3)
+
+    def test_delete_removes_tensor(self):
+        self.memory.store_tensor("t", self.large)
+        self.assertTrue(self.memory.delete("t"))
+        with self.assertRaises((KeyError, FileNotFoundError)):
+            self.memory.retrieve_tensor("t")
+
+
+class LockFreeReadTest(BackendTestCase):
+    def test_readers_see_whole_values_during_writes(self):
+        memory = SharedMemoryManager("reads", cache_capacity=1 << 20, cache_expire_time=60)
+        values = [np.full((32, 32), i, np.float32) for i in range(2)]
+        memory.store_tensor("t", values[0])
+        stop = threading.Event()
+        seen = []
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                memory.store_tensor("t", values[i % 2])
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            for _ in range(200):
+                tensor = memory.retrieve_tensor("t")
+                seen.append(float(tensor[0, 0]))
+                self.assertTrue((tensor == tensor[0, 0]).all())
+        finally:
+            stop.set()
+            thread.join()
+        self.assertTrue(set(seen) <= {0.0, 1.0})
+
+    def test_stripes(self):
+        service = SynchronizationService(num_stripes=8)
+        self.assertIs(service.lock("a"), service.lock("a"))
+        with service.lock_many(["a", "b", "c"]):
+            with service.lock("a"):
+                pass
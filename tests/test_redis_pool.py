@@ -0,0 +1,62 @@
+import unittest
+
+import redis
+
+from connections import db
+from connections.db import RedisBatch, redis_client, redis_pool
+from synapse.settings import REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT
+from tests.support import BackendTestCase
+
+
+class RedisPoolTest(unittest.TestCase):
+    url = "redis://pool-test.invalid:6379/0"
+
+    def setUp(self):
+        self.addCleanup(lambda: [db._redis_pools.pop(key) for key in list(db._redis_pools) if key[0] == self.url])
+
+    def test_pools_are_shared_per_url_and_db(self):
+        pool = redis_pool(self.url)
+        self.assertIs(redis_pool(self.url), pool)
+        self.assertIs(redis_client(self.url).connection_pool, pool)
+        other = redis_pool(self.url, db=3)
+        self.assertIsNot(other, pool)
+        self.assertEqual(other.connection_kwargs["db"], 3)
+
+    def test_pools_block_instead_of_growing(self):
+        pool = redis_pool(self.url)
+        self.assertIsInstance(pool, redis.BlockingConnectionPool)
+        self.assertEqual((pool.max_connections, pool.timeout), (REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT))
+
+
+class RedisBatchTest(BackendTestCase):
+    def test_results_in_command_order(self):
+        with RedisBatch() as batch:
+            batch.set("a", 1).incr("a")
+            batch.get("a")
+            self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.results, [True, 2, b"2"])
+
+    def test_sends_every_max_size_commands(self):
+        batch = RedisBatch(max_size=2)
+        batch.incr("n")
+        self.assertIsNone(self.redis.get("n"))
+        batch.incr("n")
+        self.assertEqual(self.redis.get("n"), b"2")
+        batch.incr("n")
+        self.assertEqual(batch.flush(), [3])
+        self.assertEqual(batch.flush(), [])
+        self.assertEqual(batch.results, [1, 2, 3])
+
+    def test_failed_block_discards_queued_commands(self):
+        with self.assertRaises(RuntimeError):
+            with RedisBatch() as batch:
+                batch.set("a", 1)
+                raise RuntimeError
+        self.assertEqual(len(batch), 0)
+        self.assertIsNone(self.redis.get("a"))
+
+    def test_transactions(self):
+        with RedisBatch(transaction=True) as batch:
+            batch.set("a", 1)
+            batch.incrby("a", 5)
+        self.assertEqual(batch.results, [True, 6])
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.shared_tensor_store import SharedTensorStore
+from tests.support import BackendTestCase
+
+
+def read_in_child(directory: str, key: str, queue):
+    store = SharedTensorStore(directory)
+    queue.put(store.get(key).sum())
+    store.close()
+
+
+class SharedTensorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.store = SharedTensorStore(self.directory)
+        self.addCleanup(self.store.close)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def test_round_trip_as_read_only_view(self):
+        tensor = np.arange(12, dtype=np.float32).reshape(3, 4)
+        self.store.put("t", tensor)
+        view = self.store.get("t")
+        np.testing.assert_array_equal(view, tensor)
+        with self.assertRaises(ValueError):
+            view[0, 0] = 1
+        self.assertIn("t", self.store)
+        with self.assertRaises(KeyError):
+            self.store.get("missing")
+
+    def test_other_processes_see_the_same_segment(self):
+        self.store.put("t", np.ones(1000, np.float64))
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        child = context.Process(target=read_in_child, args=(self.directory, "t", queue))
+        child.start()
+        self.assertEqual(queue.get(timeout=10), 1000)
+        child.join(10)
+
+    def test_overwrite_and_delete_unlink_unused_segments(self):
+        self.store.put("t", np.ones(4))
+        first = self.segments()
+        self.store.put("t", np.zeros(4))
+        self.assertNotEqual(self.segments(), first)
+        self.assertEqual(len(self.segments()), 1)
+        self.store.delete("t")
+        self.assertEqual(self.segments(), [])
+
+    def test_attached_views_survive_overwrite(self):
+        self.store.put("t", np.ones(4))
+        view = self.store.attach("t")
+        self.store.put("t", np.zeros(4))
+        self.assertEqual(len(self.segments()), 2)
+        np.testing.assert_array_equal(view, np.ones(4))
+        self.store.release(view)
+        self.assertEqual(len(self.segments()), 1)
+        with self.assertRaises(ValueError):
+            self.store.release(np.ones(4))
+
+    def test_stores_share_the_index(self):
+        other = SharedTensorStore(self.directory)
+        self.addCleanup(other.close)
+        self.store.put("t", np.ones(3))
+        self.assertEqual(other.keys(), ["t"])
+        other.delete("t")
+        self.assertNotIn("t", self.store)
+
+    def test_get_rereads_the_index_when_its_segment_is_gone(self):
+        other = SharedTensorStore(self.directory)
+        self.addCleanup(other.close)
+        self.store.put("t", np.ones(4))
+        self.assertIn("t", other)
+        stale = other._index
+        self.store.put("t", np.zeros(4))
+        # Index read just before the overwrite, segment opened just after it
+        with mock.patch.object(other, "_read_index", side_effect=[stale, SharedTensorStore._read_index.__get__(other)()]):
+            np.testing.assert_array_equal(other.get("t"), np.zeros(4))
+        self.store.delete("t")
+        other._index, other._index_stamp = stale, None
+        with mock.patch.object(other, "_read_index", side_effect=[stale, {"keys": {}, "segments": {}}]):
+            with self.assertRaises(KeyError):
+                other.get("t")
+
+    def test_maps_of_removed_segments_are_closed_on_reload(self):
+        other = SharedTensorStore(self.directory)
+        self.addCleanup(other.close)
+        self.store.put("t", np.ones(4))
+        held = other.get("t")
+        self.store.put("t", np.zeros(4))
+        np.testing.assert_array_equal(other.get("t"), np.zeros(4))
+        # A view still in use keeps its mapping until it is dropped
+        self.assertEqual(len(other._maps), 2)
+        np.testing.assert_array_equal(held, np.ones(4))
+        del held
+        self.store.delete("t")
+        self.assertNotIn("t", other)
+        self.assertEqual(other._maps, {})
+
+
+class ManagerSharedTensorTest(BackendTestCase):
+    def test_shared_tensors_are_served_from_the_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        writer = SharedMemoryManager("writer", cache_capacity=1 << 20, cache_expire_time=60, shared_tensor_dir=directory)
+        reader = SharedMemoryManager("reader", cache_capacity=1 << 20, cache_expire_time=60, shared_tensor_dir=directory)
+        tensor = np.arange(16, dtype=np.float32).reshape(4, 4)
+        writer.store_tensor("t", tensor, shared=True)
+        result = reader.retrieve_tensor("t")
+        np.testing.assert_array_equal(result, tensor)
+        self.assertFalse(result.flags.writeable)
@@ -0,0 +1,107 @@
+import asyncio
+
+from connections.pubsub import Publisher, Subscriber
+from connections.streams import StreamConsumer, StreamPublisher, is_durable, stream_key
+from tests.support import AsyncBackendTestCase
+
+
+class Drained(Exception):
+    pass
+
+
+class DrainingConsumer(StreamConsumer):
+    """
+    Stops listen() once the backlog is read: fakeredis answers blocking reads at once,
+    so an idle listen() would never yield to the test.
+    """
+
+    async def read(self):
+        messages = await super().read()
+        if not messages:
+            raise Drained
+        return messages
+
+
+class StreamTest(AsyncBackendTestCase):
+    def consumer(self, group: str = "g", **kwargs) -> StreamConsumer:
+        kwargs.setdefault("block_ms", 50)
+        return StreamConsumer("jobs", group, client=self.async_redis, **kwargs)
+
+    async def pending(self, group: str = "g") -> int:
+        return (await self.async_redis.xpending(stream_key("jobs"), group))["pending"]
+
+    async def test_entries_are_read_and_acknowledged(self):
+        consumer = self.consumer()
+        await consumer.ensure_group()
+        StreamPublisher("jobs", self.redis).publish(b"one", sender="node")
+        messages = await consumer.read()
+        self.assertEqual([(message.data, message.sender) for message in messages], [(b"one", "node")])
+        self.assertEqual(await self.pending(), 1)
+        await messages[0].ack()
+        self.assertEqual(await self.pending(), 0)
+        self.assertEqual(await consumer.read(), [])
+
+    async def test_new_groups_read_the_retained_backlog(self):
+        StreamPublisher("jobs", self.redis).publish_many([b"a", b"b"])
+        first, second = self.consumer("first"), self.consumer("second")
+        self.assertEqual([message.data for message in await first.read()], [b"a", b"b"])
+        self.assertEqual([message.data for message in await second.read()], [b"a", b"b"])
+        latest = self.consumer("latest", start_id="$")
+        self.assertEqual(await latest.read(), [])
+
+    async def test_members_of_a_group_share_the_entries(self):
+        StreamPublisher("jobs", self.redis).publish_many([b"a", b"b"])
+        first = self.consumer(batch_size=1)
+        second = self.consumer(batch_size=1)
+        received = [message.data for message in await first.read() + await second.read()]
+        self.assertEqual(sorted(received), [b"a", b"b"])
+
+    async def test_restarted_consumer_resumes_its_pending_entries(self):
+        StreamPublisher("jobs", self.redis).publish(b"job")
+        await self.consumer(consumer="worker").read()
+        restarted = self.consumer(consumer="worker")
+        messages = await restarted.read()
+        self.assertEqual([message.data for message in messages], [b"job"])
+
+    async def test_stale_entries_are_claimed_by_other_members(self):
+        StreamPublisher("jobs", self.redis).publish(b"job")
+        await self.consumer(consumer="crashed").read()
+        survivor = self.consumer(consumer="survivor", claim_idle_ms=10)
+        self.assertEqual(await survivor.read(), [])
+        await asyncio.sleep(0.05)
+        survivor._next_claim = 0
+        self.assertEqual([message.data for message in await survivor.read()], [b"job"])
+
+    async def test_listen_leaves_failed_entries_pending(self):
+        StreamPublisher("jobs", self.redis).publish_many([b"ok", b"fail"])
+        handled = []
+
+        async def callback(message):
+            handled.append(message.data)
+            if message.data == b"fail":
+                raise ValueError("handler failed")
+
+        consumer = DrainingConsumer("jobs", "g", client=self.async_redis)
+        with self.assertRaises(Drained):
+            await consumer.listen(callback)
+        self.assertEqual(handled, [b"ok", b"fail"])
+        self.assertEqual(await self.pending(), 1)
+
+
+class DurableChannelTest(AsyncBackendTestCase):
+    async def test_default_durable_channels_match_on_both_sides(self):
+        self.assertTrue(is_durable("url_processor_channel"))
+        publisher, subscriber = Publisher("url_processor_channel"), Subscriber("url_processor_channel")
+        self.assertIsNotNone(publisher.stream)
+        self.assertTrue(subscriber.durable)
+        publisher.publish(b"page")
+        await subscriber.subscribe()
+        self.assertEqual(await asyncio.wait_for(subscriber.get_raw(), 2), b"page")
+        await subscriber.close()
+
+    async def test_durable_messages_wait_for_subscribers(self):
+        Publisher("jobs", durable=True).publish(b"early")
+        subscriber = Subscriber("jobs", durable=True)
+        await subscriber.subscribe()
+        self.assertEqual(await asyncio.wait_for(subscriber.get_raw(), 2), b"early")
+        await subscriber.close()
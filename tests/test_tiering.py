@@ -0,0 +1,115 @@
+import tempfile
+import threading
+
+import numpy as np
+
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from synapse.memory_manager.tiering import RAM, CACHE, MMAP
+from tests.support import BackendTestCase
+
+
+class TieringTest(BackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = SharedMemoryManager("tiers", cache_capacity=1 << 20, cache_expire_time=60,
+                                          mmap_directory=tempfile.mkdtemp(), memory_budget=4096)
+        self.tiering = self.memory.tiering
+        self.tiering.promote_threshold = 3
+
+    def array(self, value, size=512):
+        return np.full(size, value, np.float32)
+
+    def test_cold_keys_are_demoted_to_make_room(self):
+        self.tiering.put("a", self.array(1))
+        self.tiering.put("b", self.array(2))
+        self.tiering.get("b")
+        self.tiering.put("c", self.array(3))
+        self.assertEqual(self.tiering.tier_of("a"), CACHE)
+        self.assertEqual(self.tiering.tier_of("b"), RAM)
+        self.assertLessEqual(self.memory.memory_allocator.get_usage(RAM), 4096)
+        np.testing.assert_array_equal(self.tiering.get("a"), self.array(1))
+
+    def test_large_payloads_go_to_mmap(self):
+        self.tiering.cache_item_limit = 16
+        data = np.random.rand(2048).astype(np.float32)
+        self.tiering.put("big", data)
+        self.assertEqual(self.tiering.tier_of("big"), MMAP)
+        np.testing.assert_array_equal(self.tiering.get("big"), data)
+
+    def test_hot_keys_are_promoted(self):
+        self.tiering.put("a", self.array(1))
+        self.tiering.put("b", self.array(2))
+        self.tiering.put("c", self.array(3))
+        self.assertEqual(self.tiering.tier_of("a"), CACHE)
+        for _ in range(5):
+            self.tiering.get("a")
+        self.assertEqual(self.tiering.tier_of("a"), RAM)
+        self.assertNotIn("a", self.memcached.data)
+
+    def test_rejected_cache_set_keeps_value_on_mmap(self):
+        self.memcached.accepting = False
+        self.tiering.put("a", self.array(1))
+        self.tiering.put("b", self.array(2))
+        self.tiering.put("c", self.array(3))
+        self.assertEqual(self.tiering.tier_of("a"), MMAP)
+        self.assertNotIn("a", self.tiering.ram)
+        np.testing.assert_array_equal(self.tiering.get("a"), self.array(1))
+
+    def test_value_evicted_by_memcached_is_read_from_mmap(self):
+        self.tiering.put("a", self.array(1))
+        self.tiering.put("b", self.array(2))
+        self.tiering.put("c", self.array(3))
+        self.memcached.data.clear()
+        np.testing.assert_array_equal(self.tiering.get("a"), self.array(1))
+        self.assertEqual(self.tiering.tier_of("a"), MMAP)
+
+    def test_failed_demotion_keeps_ram_copy(self):
+        self.tiering.put("a", self.array(1))
+
+        def fail(key, data):
+            raise OSError("disk full")
+
+        self.memory.mmap_manager.store_mmap = fail
+        self.assertEqual(self.tiering.free(1), 0)
+        self.assertEqual(self.tiering.tier_of("a"), RAM)
+        np.testing.assert_array_equal(self.tiering.get("a"), self.array(1))
+
+    def test_only_tiered_keys_have_a_tier(self):
+        self.memory.store_text("doc", "text")
+        self.assertIsNone(self.tiering.tier_of("doc"))
+        self.tiering.delete("doc")
+        self.assertGreater(self.memory.memory_allocator.get_allocation("doc"), 0)
+        with self.assertRaises(KeyError):
+            self.tiering.get("doc")
+        self.assertEqual(self.memory.retrieve_text("doc"), "text")
+
+    def test_manager_reads_through_tiers(self):
+        self.memory.store_tensor("t", self.array(7))
+        np.testing.assert_array_equal(self.memory.retrieve_tensor("t"), self.array(7))
+        np.testing.assert_array_equal(self.memory.retrieve_rows("t", 0, 4), self.array(7)[:4])
+
+    def test_reads_do_not_wait_for_other_keys(self):
+        self.tiering.put("ram", self.array(1, 16))
+        other = next(key for key in (f"k{i}" for i in range(100))
+                     if self.tiering._locks._stripe(key) != self.tiering._locks._stripe("busy"))
+        self.tiering.put(other, self.array(2, 2048))
+        held, done = threading.Event(), threading.Event()
+
+        def hold():
+            with self.tiering._locks.lock("busy"):
+                held.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            result = []
+            reader = threading.Thread(target=lambda: result.extend([self.tiering.get("ram"), self.tiering.get(other)]))
+            reader.start()
+            reader.join(2)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(len(result), 2)
+        finally:
+            done.set()
+            thread.join()
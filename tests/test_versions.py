@@ -0,0 +1,110 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from synapse.memory_manager.control import VersionControl
+from synapse.memory_manager.shared_memory_manager import SharedMemoryManager
+from tests.support import BackendTestCase
+
+
+class VersionControlTest(unittest.TestCase):
+    def test_versions_round_trip(self):
+        versions = VersionControl()
+        contents = [b"hello world " * 20 + str(i).encode() for i in range(5)]
+        numbers = [versions.create_version("k", content) for content in contents]
+        self.assertEqual(numbers, [0, 1, 2, 3, 4])
+        for number, content in zip(numbers, contents):
+            self.assertEqual(versions.get_version("k", number), content)
+        self.assertEqual(versions.get_latest("k"), contents[-1])
+
+    def test_consecutive_versions_are_delta_encoded(self):
+        versions = VersionControl()
+        base = bytes(range(256)) * 64
+        versions.create_version("k", base)
+        versions.create_version("k", base[:100] + b"edit" + base[104:])
+        stored = sum(len(payload) for _, payload, _ in versions.objects.values())
+        self.assertLess(stored, 2 * len(base) - len(base) // 2)
+        self.assertEqual(versions.get_version("k", 1), base[:100] + b"edit" + base[104:])
+
+    def test_keyframe_interval_bounds_chains(self):
+        versions = VersionControl(keyframe_interval=4)
+        base = b"x" * 1000
+        for i in range(10):
+            versions.create_version("k", base + str(i).encode())
+        self.assertLess(max(depth for _, _, depth in versions.objects.values()), 4)
+        self.assertEqual(versions.get_version("k", 9), base + b"9")
+
+    def test_identical_content_is_stored_once(self):
+        versions = VersionControl()
+        versions.create_version("a", b"same content")
+        versions.create_version("b", b"same content")
+        self.assertEqual(len(versions.objects), 1)
+        versions.delete("a")
+        self.assertEqual(versions.get_latest("b"), b"same content")
+        versions.delete("b")
+        self.assertEqual(versions.objects, {})
+        self.assertEqual(versions.refcounts, {})
+
+    def test_keep_last_drops_old_versions_and_their_objects(self):
+        versions = VersionControl(keep_last=2)
+        for i in range(5):
+            versions.create_version("k", str(i).encode() * 100)
+        self.assertEqual(versions.list_versions("k"), [3, 4])
+        with self.assertRaises(KeyError):
+            versions.get_version("k", 0)
+        self.assertEqual(versions.get_version("k", 3), b"3" * 100)
+        self.assertLessEqual(len(versions.objects), 2)
+
+    def test_keep_for_drops_expired_versions(self):
+        versions = VersionControl(keep_for=60)
+        versions.create_version("k", b"old")
+        versions.versions["k"][0].created_at -= 120
+        versions.create_version("k", b"new")
+        self.assertEqual(versions.list_versions("k"), [1])
+
+
+class ManagerVersionsTest(BackendTestCase):
+    def manager(self, **kwargs):
+        kwargs.setdefault("cache_capacity", 1 << 20)
+        return SharedMemoryManager("versions", cache_expire_time=60,
+                                   mmap_directory=tempfile.mkdtemp(), **kwargs)
+
+    def test_retention_is_configurable(self):
+        memory = self.manager(version_keep_last=2)
+        for i in range(4):
+            memory.store_text("k", f"text {i}")
+        self.assertEqual(memory.version_control.list_versions("k"), [2, 3])
+        self.assertEqual(memory.retrieve_text("k", 2), "text 2")
+
+    def test_tensor_versions_on_partition_path(self):
+        memory = self.manager()
+        first, second = np.zeros((64, 8), np.float32), np.ones((64, 8), np.float32)
+        self.assertEqual(memory.store_tensor("t", first), 0)
+        self.assertEqual(memory.store_tensor("t", second), 1)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t", 0), first)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t", 1), second)
+
+    def test_tensor_versions_on_mmap_path(self):
+        memory = self.manager(cache_capacity=1024)
+        first = np.arange(4096, dtype=np.float32)
+        memory.store_tensor("t", first)
+        memory.store_tensor("t", first * 2)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t", 0), first)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t"), first * 2)
+
+    def test_tensor_versions_on_tiering_path(self):
+        memory = self.manager(memory_budget=1 << 20)
+        first = np.arange(256, dtype=np.float32)
+        memory.store_tensor("t", first)
+        memory.store_tensor("t", first + 1)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t", 0), first)
+        np.testing.assert_array_equal(memory.retrieve_tensor("t", 1), first + 1)
+
+    def test_vector_versions(self):
+        memory = self.manager()
+        vector = np.arange(32, dtype=np.float32)
+        memory.store_vector("v", vector)
+        memory.store_vector("v", vector * 3)
+        np.testing.assert_array_equal(memory.retrieve_vector("v", 0), vector)
+        np.testing.assert_array_equal(memory.retrieve_vector("v"), vector * 3)